@@ -2,11 +2,42 @@
 *  Designed to be used with a python3/PyQt5 interface
 *  Copyright 2020 Cedric Pereira.
 *  Released under GNU GPL 3 license.
+*
+*  Commands (one per line) :
+*    s : slow mode (1000ms gate)     f : fast mode (100ms gate)
+*    b : send binary frames          a : send ASCII lines (default)
+*
+*  Binary frame (10 bytes, little endian) :
+*    sync word 0xA55A | uint16 sequence | uint8 flags | uint32 count | CRC-8
+*    flags bit 0 is set when the count was taken with the fast gate, the host
+*    does the count * 10 scaling. The CRC-8 (poly 0x07) covers sequence,
+*    flags and count.
+*
+*  Mode changes take effect at the end of the current gate : its count is
+*  sent with the old gate, then the new gate starts at once. The change is
+*  acknowledged with the sequence number of the first sample of the new gate
+*  and the dead time between the two gates (us) :
+*    binary : a frame with flags bit 1 set (bit 0 : new gate), the sequence
+*             number of that sample (not consumed) and the dead time as count
+*    ASCII  : a line '#f <sequence> <dead time>' or '#s ...'
+*  Samples are numbered in ASCII mode too.
  */
 #include <FreqCount.h>
 
+#define FRAME_SYNC 0xA55A
+#define FRAME_SIZE 10
+#define FLAG_FAST 0x01
+#define FLAG_ACK 0x02
+#define LED_BLINK 100
+
 uint8_t scale = 1;
+// scale asked for, applied at the end of the current gate (0 : none)
+uint8_t next_scale = 0;
 uint8_t ledpin = 13;
+// millis() when the led goes off (0 : off)
+unsigned long led_off = 0;
+bool binary = false;
+uint16_t seq = 0;
 
 void setup() {
   Serial.begin(57600);
@@ -15,33 +46,103 @@ void setup() {
   digitalWrite(ledpin, LOW);
 }
 
+uint8_t crc8(const uint8_t *data, uint8_t len) {
+  uint8_t crc = 0;
+  while (len--) {
+    crc ^= *data++;
+    for (uint8_t i = 0; i < 8; i++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void send_frame(uint8_t flags, unsigned long count) {
+  uint8_t frame[FRAME_SIZE];
+  frame[0] = FRAME_SYNC & 0xFF;
+  frame[1] = FRAME_SYNC >> 8;
+  frame[2] = seq & 0xFF;
+  frame[3] = seq >> 8;
+  frame[4] = flags;
+  frame[5] = count & 0xFF;
+  frame[6] = (count >> 8) & 0xFF;
+  frame[7] = (count >> 16) & 0xFF;
+  frame[8] = (count >> 24) & 0xFF;
+  frame[9] = crc8(frame + 2, FRAME_SIZE - 3);
+  Serial.write(frame, FRAME_SIZE);
+}
+
+void send_sample(uint8_t sample_scale, unsigned long count) {
+  if (binary) {
+    send_frame((sample_scale == 10) ? FLAG_FAST : 0, count);
+  }
+  else {
+    Serial.println(count * sample_scale);
+  }
+  seq++;
+}
+
+void send_ack(unsigned long dead) {
+  if (binary) {
+    send_frame(FLAG_ACK | ((scale == 10) ? FLAG_FAST : 0), dead);
+  }
+  else {
+    Serial.print((scale == 10) ? "#f " : "#s ");
+    Serial.print(seq);
+    Serial.print(' ');
+    Serial.println(dead);
+  }
+}
+
 void loop() {
   String str = "";
   // read frequency if available
   if (FreqCount.available()) {
+    unsigned long ended = micros();
     unsigned long count = FreqCount.read();
-    Serial.println(count * scale);
+    uint8_t sample_scale = scale;
+    if (next_scale) {
+      // restart at once with the new gate, the sample is sent afterwards
+      FreqCount.end();
+      scale = next_scale;
+      next_scale = 0;
+      FreqCount.begin((scale == 10) ? 100 : 1000);
+      unsigned long dead = micros() - ended;
+      send_sample(sample_scale, count);
+      send_ack(dead);
+      digitalWrite(ledpin, HIGH);
+      led_off = millis() + LED_BLINK;
+      if (!led_off) {
+        led_off = 1;
+      }
+    }
+    else {
+      send_sample(sample_scale, count);
+    }
+  }
+  // the blink doesn't stop the counter
+  if (led_off && (long)(millis() - led_off) >= 0) {
+    digitalWrite(ledpin, LOW);
+    led_off = 0;
   }
   // proceed a command if availabe
   if (Serial.available()>= 1) {
     str = Serial.readStringUntil('\n');
-    // go to slow mode
+    // go to slow mode at the end of the gate
     if (str.equals("s")) {
-      FreqCount.end();
-      scale = 1;
-      digitalWrite(ledpin,HIGH);
-      delay(100);
-      digitalWrite(ledpin,LOW);
-      FreqCount.begin(1000);
+      next_scale = 1;
     }
-    //go to fast mode
+    //go to fast mode at the end of the gate
     else if (str.equals("f")) {
-      FreqCount.end();
-      scale = 10;
-      digitalWrite(ledpin,HIGH);
-      delay(100);
-      digitalWrite(ledpin,LOW);
-      FreqCount.begin(100);
+      next_scale = 10;
+    }
+    // binary frames
+    else if (str.equals("b")) {
+      binary = true;
+    }
+    // ASCII lines
+    else if (str.equals("a")) {
+      binary = false;
     }
   }
 }
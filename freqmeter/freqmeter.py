@@ -31,23 +31,47 @@
  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from PyQt5.QtCore import (Qt, QThread, pyqtSignal, QSize, QLocale, QTranslator,
-                          QLibraryInfo, QResource, QCoreApplication, QSettings)
+import json
+import os
+import sys
+import time
+
+if __name__ == '__main__' and '--headless' in sys.argv:
+    # command line logger : start it before PyQt5 is imported
+    from tools.headless import main
+    sys.exit(main(sys.argv[1:]))
+
+from PyQt5.QtCore import (Qt, QThread, QSize, QLocale, QTranslator,
+                          QLibraryInfo, QResource, QCoreApplication, QSettings,
+                          QTimer)
 from PyQt5.QtWidgets import (QWidget, QMainWindow, QGridLayout, QHBoxLayout,
                              QVBoxLayout, QLabel,
                              QRadioButton, QPushButton, QMessageBox, QAction,
                              QGroupBox, QApplication, QLineEdit, QCheckBox,
-                             QComboBox)
+                             QComboBox, QActionGroup, QFileDialog)
 from PyQt5.QtGui import QIcon, QPixmap, QFont
 from tools.settingsdialogs import SerialSettingsDialog, LangSelector
 from tools.helpdialogs import HelpDialog
 from tools.graphdialog import GraphDialog
 from tools.langtranslate import load_section
-from tools.datafilters import filter
+from tools.filterapi import (batch_filter, benchmark, FilterChain,
+                             FilterLoader)
+from tools.filterworker import ProcessFilter
+from tools.streamfilters import BUILTIN_FILTERS
+from tools.filterdialog import FilterChainDialog, USER_FILTER
+from tools.statistics import Statistics
+from tools.statsdialog import StatisticsDialog
+from tools.allan import Stability
+from tools.allandialog import AllanDialog
+from tools.distribution import Distributions
+from tools.distdialog import DistributionDialog
+from tools.spectrum import Spectra
+from tools.spectrumdialog import SpectrumDialog
 from tools.CustomWidgets import EditorDialog
-import sys
+from tools.serialreader import BAD_SAMPLE
+from tools.acquisition import Device, AcquisitionEngine
+from tools.recorder import Recorder
 import serial
-import math
 
 
 class MainWindow(QMainWindow):
@@ -66,10 +90,17 @@ class MainWindow(QMainWindow):
     readvalue = 0
     # Settings saved by the system
     appsettings = QSettings("C.E.D", "freqmeter")
+    # samples/s assumed when nothing is connected (fast mode)
+    nominal_rate = 10.0
+    # a filter must be this much faster than the counters
+    filter_headroom = 2.0
     # Multipliers for external frequency dividers
     scale = ["x1", "x2", "x4", "x8", "x16", "x32", "x64", "x128", "x256"]
-    multiplier = 1
     use_internal_filter = False
+    use_binary_protocol = False
+    # display refresh rates (Hz), the display is polled, not fed per sample
+    refresh_rates = [10, 30, 60]
+    refresh_rate = 30
 
     def __init__(self):
         super(MainWindow,self).__init__()
@@ -103,16 +134,49 @@ class MainWindow(QMainWindow):
         # graph dialog
         self.graphdlg = GraphDialog()
 
+        # filter chain dialog
+        self.chaindlg = FilterChainDialog(timings=self.filter_timings)
+        self.chaindlg.stagesChanged.connect(self.set_filter_stages)
+        self.chaindlg.stageChanged.connect(self.set_filter_config)
+
+        # statistics of the raw samples of every device
+        self.statistics = Statistics()
+        self.statsdlg = StatisticsDialog(self.statistics)
+
+        # Allan deviations of every device
+        self.stability = Stability()
+        self.allandlg = AllanDialog(self.stability)
+
+        # histogram and quantiles of every device
+        self.distributions = Distributions()
+        self.distdlg = DistributionDialog(self.distributions)
+
+        # power spectral density of every device
+        self.spectra = Spectra()
+        self.spectrumdlg = SpectrumDialog(self.spectra)
+
         # language dialog
         self.langselectdlg = LangSelector()
         self.langselectdlg.lang_selected.connect(self.new_lang)
 
-        # Create serial object
-        self.serport = serial.Serial()
-
-        # create thread for reading data from serial port
+        # connected devices, the displayed one and the read position in
+        # each device ring buffer
+        self.devices = []
+        self.device = None
+        self.cursors = []
+        # samples/s read from all devices, measured every second
+        self.sample_rate = 0.0
+        self.rate_mark = (time.monotonic(), 0)
+        # background recorder (File->Record)
+        self.recorder = None
+
+        # create thread for reading data from serial ports
+        self.engine = AcquisitionEngine()
         self.Thread = DataThread(self)
-        self.Thread.dataReady.connect(self.display_data)
+
+        # timer polling the samples stored by the thread
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.timeout.connect(self.refresh_display)
 
     def initUI(self):
         """ Initialize widgets """
@@ -126,6 +190,15 @@ class MainWindow(QMainWindow):
         self.setWindowIcon(QIcon('resources/images/icon.png'))
 
         self.myeditor = EditorDialog(self)
+        self.myeditor.saved.connect(self.reload_filter)
+        # user filter, reloaded when the editor saves it
+        self.filter_loader = FilterLoader(
+            'tools/datafilters.py',
+            self.appsettings.value("FilterJit", False, type=bool))
+        try:
+            self.filter_loader.load()
+        except Exception as error:
+            print(f'{self.filter_loader.filename}: {error}', file=sys.stderr)
 
         # create menus
         self.exitAct = QAction(QIcon('resources/images/stop.png'),
@@ -151,11 +224,47 @@ class MainWindow(QMainWindow):
         self.filterAct.setChecked(self.appsettings.value("UseFilter", False,
                                                          type=bool))
         self.filterAct.triggered.connect(self.use_filter)
+        self.use_internal_filter = self.filterAct.isChecked()
+
+        self.processAct = QAction(self.langstr[41], self, checkable=True)
+        self.processAct.setChecked(self.appsettings.value("FilterProcess",
+                                                          False, type=bool))
+        self.processAct.triggered.connect(self.use_filter_process)
+
+        self.jitAct = QAction(self.langstr[42], self, checkable=True)
+        self.jitAct.setChecked(self.filter_loader.jit)
+        self.jitAct.triggered.connect(self.use_filter_jit)
+
+        # filter stages, see tools/filterdialog.py
+        self.filter_stages = json.loads(self.appsettings.value(
+            "FilterChain", json.dumps([{'name': USER_FILTER, 'config': {}}])))
+        self.chainAct = QAction(self.langstr[40], self)
+        self.chainAct.triggered.connect(self.show_filter_chain)
+
+        self.binaryAct = QAction(self.langstr[36], self, checkable=True)
+        self.use_binary_protocol = self.appsettings.value("BinaryProtocol",
+                                                          False, type=bool)
+        self.binaryAct.setChecked(self.use_binary_protocol)
+        self.binaryAct.triggered.connect(self.use_binary)
+
+        self.recordAct = QAction(QIcon('resources/images/disk.png'),
+                                 self.langstr[39], self, checkable=True)
+        self.recordAct.triggered.connect(self.record)
 
         self.editAct = QAction(
             QIcon.fromTheme('document-content'), self.langstr[35], self)
         self.editAct.triggered.connect(self.showedit)
 
+        self.refresh_rate = self.appsettings.value("RefreshRate",
+                                                   self.refresh_rate, type=int)
+        self.refreshGroup = QActionGroup(self)
+        self.refreshGroup.triggered.connect(self.set_refresh_rate)
+        for rate in self.refresh_rates:
+            rateAct = QAction(f'{rate} Hz', self, checkable=True)
+            rateAct.setData(rate)
+            rateAct.setChecked(rate == self.refresh_rate)
+            self.refreshGroup.addAction(rateAct)
+
         self.langAct = QAction(QIcon.fromTheme('document-language'),
                                self.langstr[32], self)
         self.langAct.triggered.connect(self.select_lang)
@@ -177,10 +286,17 @@ class MainWindow(QMainWindow):
         fileMenu = menubar.addMenu(self.langstr[11])
         fileMenu.addAction(self.configAct)
         fileMenu.addAction(self.connectAct)
+        fileMenu.addAction(self.binaryAct)
+        fileMenu.addAction(self.recordAct)
         fileMenu.addSeparator()
         fileMenu.addAction(self.filterAct)
+        fileMenu.addAction(self.processAct)
+        fileMenu.addAction(self.jitAct)
+        fileMenu.addAction(self.chainAct)
         fileMenu.addAction(self.editAct)
         fileMenu.addSeparator()
+        refreshMenu = fileMenu.addMenu(self.langstr[37])
+        refreshMenu.addActions(self.refreshGroup.actions())
         fileMenu.addAction(self.langAct)
         fileMenu.addSeparator()
         fileMenu.addAction(self.exitAct)
@@ -221,6 +337,21 @@ class MainWindow(QMainWindow):
         self.graph.clicked.connect(self.show_graph)
         self.graph.setEnabled(False)
 
+        self.stats = QPushButton(self.langstr[43])
+        self.stats.clicked.connect(self.show_statistics)
+        self.stats.setEnabled(False)
+
+        self.allan = QPushButton(self.langstr[44])
+        self.allan.clicked.connect(self.show_allan)
+
+        self.dist = QPushButton(self.langstr[45])
+        self.dist.clicked.connect(self.show_distribution)
+        self.dist.setEnabled(False)
+
+        self.spectrum = QPushButton(self.langstr[46])
+        self.spectrum.clicked.connect(self.show_spectrum)
+        self.spectrum.setEnabled(False)
+
         self.scale_combo = QComboBox()
         self.scale_combo.activated.connect(self.set_multiplier)
         for mult in self.scale:
@@ -232,11 +363,25 @@ class MainWindow(QMainWindow):
         self.scale_box.addWidget(self.scale_label)
         self.scale_box.addWidget(self.scale_combo)
 
+        # displayed device
+        self.channel_combo = QComboBox()
+        self.channel_combo.activated.connect(self.select_channel)
+        self.channel_label = QLabel(self.langstr[38])
+
+        self.channel_box = QHBoxLayout()
+        self.channel_box.addWidget(self.channel_label)
+        self.channel_box.addWidget(self.channel_combo)
+
         self.vbox2 = QVBoxLayout()
         self.vbox2.setAlignment(Qt.AlignTop)
         self.vbox2.addWidget(self.auto)
         self.vbox2.addWidget(self.graph)
+        self.vbox2.addWidget(self.stats)
+        self.vbox2.addWidget(self.allan)
+        self.vbox2.addWidget(self.dist)
+        self.vbox2.addWidget(self.spectrum)
         self.vbox2.addLayout(self.scale_box)
+        self.vbox2.addLayout(self.channel_box)
 
         self.probebox = QGroupBox(self.langstr[18])
         self.probebox.setAlignment(Qt.AlignCenter)
@@ -318,7 +463,49 @@ class MainWindow(QMainWindow):
 
     def showedit(self):
         self.myeditor.show()
-        self.myeditor.file_set('tools/datafilters.py')
+        self.myeditor.file_set(self.filter_loader.filename)
+
+    def reload_filter(self, path):
+        """ editor saved a file : benchmark the new user filter and swap it
+            in, keep the previous one if it doesn't work or can't keep up
+        """
+        loader = self.filter_loader
+        if os.path.abspath(path) != os.path.abspath(loader.filename):
+            return
+        previous = (loader.namespace, loader.source, loader.jit_errors)
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            loader.load()
+            result = benchmark(loader.namespace)
+        except Exception as error:
+            loader.namespace, loader.source, loader.jit_errors = previous
+            QApplication.restoreOverrideCursor()
+            self.myeditor.set_status(f'{type(error).__name__}: {error}')
+            QMessageBox.warning(self.myeditor, self.langstr[35],
+                                f'{type(error).__name__}: {error}\n\n'
+                                'The previous filter is kept.')
+            return
+        QApplication.restoreOverrideCursor()
+        rate = max(self.sample_rate, self.nominal_rate)
+        self.myeditor.set_status(
+            f"{result['ns_per_sample']:.0f} ns/sample, "
+            f"{result['throughput']:,.0f} samples/s, peak memory "
+            f"{result['peak_memory'] / 1024:,.0f} kB "
+            f"({result['samples']:,} samples), counters: {rate:,.0f} samples/s"
+            + ''.join(f'\nNot compiled, {error}'
+                      for error in loader.jit_errors))
+        if result['throughput'] < rate * self.filter_headroom:
+            reply = QMessageBox.question(
+                self.myeditor, self.langstr[35],
+                f"This filter processes {result['throughput']:,.0f} "
+                f"samples/s, the counters send {rate:,.0f} samples/s : it is "
+                "too slow to keep up safely.\n\nUse it anyway?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                loader.namespace, loader.source, loader.jit_errors = previous
+                return
+        if self.use_internal_filter:
+            self.update_filters()
 
     def use_filter(self):
         """ Menu->Edit->use filter callback """
@@ -327,10 +514,167 @@ class MainWindow(QMainWindow):
         else:
             self.use_internal_filter = False
         self.appsettings.setValue("UseFilter", self.use_internal_filter)
+        self.update_filters()
+
+    def use_filter_process(self):
+        """ Menu->File->filter process callback : run the user filter in
+            a separate process
+        """
+        self.appsettings.setValue("FilterProcess",
+                                  self.processAct.isChecked())
+        if self.use_internal_filter:
+            self.update_filters()
+
+    def use_filter_jit(self):
+        """ Menu->File->compile filter callback : reload the user filter
+            compiled with numba (or back in Python)
+        """
+        self.filter_loader.jit = self.jitAct.isChecked()
+        self.appsettings.setValue("FilterJit", self.filter_loader.jit)
+        self.reload_filter(self.filter_loader.filename)
+        if self.filter_loader.jit_errors:
+            self.statusBar().showMessage(
+                'Not compiled, ' + '; '.join(self.filter_loader.jit_errors),
+                5000)
+
+    def show_filter_chain(self):
+        """ Menu->File->filter chain callback """
+        self.chaindlg.set_stages(self.filter_stages)
+        self.chaindlg.show()
+
+    def set_filter_stages(self, stages):
+        """ the filter chain dialog changed the stages : the devices use
+            them from their next batch
+        """
+        self.filter_stages = stages
+        self.appsettings.setValue("FilterChain", json.dumps(stages))
+        self.update_filters()
+
+    def set_filter_config(self, index, config):
+        """ the filter chain dialog changed the parameter of a stage : the
+            stage of each device is updated in place, the other stages
+            keep their state and timings
+        """
+        self.filter_stages[index]['config'] = config
+        self.appsettings.setValue("FilterChain",
+                                  json.dumps(self.filter_stages))
+        for device in self.devices:
+            filtering = device.next_filter
+            if (isinstance(filtering, FilterChain)
+                    and len(filtering.stages) == len(self.filter_stages)):
+                filtering.configure(index, config)
+            else:
+                device.set_filter(self.current_filter())
+
+    def filter_timings(self):
+        """ [time (ns), samples in, samples out] of each stage, summed over
+            the devices
+        """
+        totals = [[0, 0, 0] for _ in self.filter_stages]
+        for device in self.devices:
+            filtering = device.filter
+            if (isinstance(filtering, FilterChain)
+                    and len(filtering.timings) == len(totals)):
+                for total, timing in zip(totals, filtering.timings):
+                    for index, value in enumerate(timing):
+                        total[index] += value
+        return totals
+
+    def filter_stage(self, stage):
+        """ new filter of a stage """
+        if stage['name'] != USER_FILTER:
+            return BUILTIN_FILTERS[stage['name']](stage['config'])
+        if self.processAct.isChecked():
+            return ProcessFilter(self.filter_loader.source,
+                                 self.filter_loader.filename,
+                                 jit=self.filter_loader.jit)
+        return batch_filter(self.filter_loader.namespace)
+
+    def current_filter(self):
+        """ new filter chain for a device (None when not used) """
+        if not self.use_internal_filter or not self.filter_stages:
+            return None
+        return FilterChain([self.filter_stage(stage)
+                            for stage in self.filter_stages])
+
+    def update_filters(self):
+        """ give each device a new filter (the filters keep a state) """
+        for device in self.devices:
+            device.set_filter(self.current_filter())
+
+    def use_binary(self):
+        """ Menu->File->binary protocol callback """
+        self.use_binary_protocol = self.binaryAct.isChecked()
+        self.appsettings.setValue("BinaryProtocol", self.use_binary_protocol)
+        # the reader belongs to the acquisition thread
+        for device in self.devices:
+            self.engine.set_binary(device, self.use_binary_protocol)
+
+    def record(self):
+        """ Menu->File->record callback : start or stop recording all
+            samples of all devices
+        """
+        if self.recordAct.isChecked():
+            directory = QFileDialog.getExistingDirectory(
+                self, self.langstr[39], self.appsettings.value("RecordDir", ""))
+            if not directory:
+                self.recordAct.setChecked(False)
+                return
+            self.appsettings.setValue("RecordDir", directory)
+            self.recorder = Recorder(directory)
+            self.recorder.start()
+            for device in self.devices:
+                device.sinks = device.sinks + [self.recorder]
+        else:
+            self.stop_recording()
+
+    def stop_recording(self):
+        """ detach the recorder from the devices and close its file """
+        if self.recorder is not None:
+            for device in self.devices:
+                device.sinks = [sink for sink in device.sinks
+                                if sink is not self.recorder]
+            self.recorder.stop()
+            self.recorder = None
+
+    def set_refresh_rate(self, action):
+        """ Menu->File->refresh rate callback """
+        self.refresh_rate = action.data()
+        self.appsettings.setValue("RefreshRate", self.refresh_rate)
+        self.refreshTimer.setInterval(1000 // self.refresh_rate)
 
     def set_multiplier(self, index):
         """ select frequency multiplier from combobox """
-        self.multiplier = math.pow(2, index)
+        if self.device is not None:
+            self.device.set_multiplier(index)
+
+    def select_channel(self, index):
+        """ display another device, show its own settings """
+        self.device = self.devices[index]
+        self.statsdlg.set_channel(self.device.channel)
+        self.allandlg.set_channel(self.device.channel)
+        self.distdlg.set_channel(self.device.channel)
+        self.spectrumdlg.set_channel(self.device.channel)
+        self.set_waterfall_channel()
+        self.scale_combo.setCurrentIndex(
+            int(self.device.multiplier).bit_length() - 1)
+        for button, checked in ((self.fast, self.device.fast),
+                                (self.slow, not self.device.fast)):
+            button.blockSignals(True)
+            button.setChecked(checked)
+            button.blockSignals(False)
+
+    def forget_device(self, device):
+        """ remove a failed device from the channels, the displayed one is
+            replaced by the first device left (kept if none is left)
+        """
+        index = self.devices.index(device)
+        del self.devices[index]
+        del self.cursors[index]
+        self.channel_combo.removeItem(index)
+        if device is self.device and self.devices:
+            self.channel_combo.setCurrentIndex(0)
+            self.select_channel(0)
 
     def new_lang(self, langue):
         """ Save selected language """
@@ -352,10 +696,16 @@ class MainWindow(QMainWindow):
         if reply == QMessageBox.Yes:
             event.accept()
             if self.isConnected:
-                self.serport.close()
+                self.refreshTimer.stop()
                 self.Thread.stop()
-                self.Thread.terminate()
+                self.engine.close()
                 self.graphdlg.close()
+                self.chaindlg.close()
+                self.statsdlg.close()
+                self.distdlg.close()
+                self.spectrumdlg.close()
+            self.allandlg.close()
+            self.stop_recording()
         else:
             event.ignore()
             self.statusBar().showMessage('')
@@ -365,6 +715,29 @@ class MainWindow(QMainWindow):
         self.graphdlg.setModal(False)
         self.graphdlg.show()
 
+    def show_statistics(self):
+        """ show statistics window """
+        self.statsdlg.set_channel(self.device.channel)
+        self.statsdlg.show()
+
+    def show_allan(self):
+        """ show Allan deviation window, recordings can be opened while
+            nothing is connected
+        """
+        if self.device is not None:
+            self.allandlg.set_channel(self.device.channel)
+        self.allandlg.show()
+
+    def show_distribution(self):
+        """ show distribution window """
+        self.distdlg.set_channel(self.device.channel)
+        self.distdlg.show()
+
+    def show_spectrum(self):
+        """ show spectrum window """
+        self.spectrumdlg.set_channel(self.device.channel)
+        self.spectrumdlg.show()
+
     def configure(self):
         """ Launch configuration dialog """
         self.configdlg.show()
@@ -380,15 +753,23 @@ class MainWindow(QMainWindow):
         else:
             pass
 
-    def set_fast(self):
+    def set_fast(self, checked):
         """ put arduino in fast reading mode """
-        if self.isConnected:
-            self.serport.write('f\n'.encode('ascii'))
-
-    def set_slow(self):
-        """ put arduino in slow reading mode """        
-        if self.isConnected:
-            self.serport.write('s\n'.encode('ascii'))
+        if checked and self.device is not None:
+            self.device.set_fast(True)
+
+    def set_slow(self, checked):
+        """ put arduino in slow reading mode """
+        if checked and self.device is not None:
+            self.device.set_fast(False)
+
+    def set_waterfall_channel(self):
+        """ the graph waterfall shows the displayed device, at the gate of
+            its last samples (the dialog measures the decimation of the
+            filters)
+        """
+        self.graphdlg.set_waterfall_channel(self.device.channel,
+                                            1.0 / self.device.gate)
 
     def set_hold(self):
         """ hold the previous display """        
@@ -415,15 +796,52 @@ class MainWindow(QMainWindow):
         QMessageBox.about(self,'About',
                           "The poorman's frequency counter based on Arduino !!!\n\nCopyright 2020 Cedric Pereira\nReleased under GNU GPL license")
 
-    def display_data(self, data):
-        """ get data from thread (the data argument) and display it """
-
-        if self.use_internal_filter:
-            self.readvalue = filter(data)
-        else:
-            self.readvalue = data
-
-        convertedval = data * self.multiplier
+    def refresh_display(self):
+        """ timer callback : display the samples stored since the last call """
+        now = time.monotonic()
+        if now - self.rate_mark[0] >= 1.0:
+            samples = sum(device.samples for device in self.devices)
+            self.sample_rate = ((samples - self.rate_mark[1])
+                                / (now - self.rate_mark[0]))
+            self.rate_mark = (now, samples)
+        while not self.engine.failures.empty():
+            # unplugged : the engine closed the port, it can be connected
+            # again
+            device, error = self.engine.failures.get()
+            # not if it was connected again meanwhile
+            if device in self.devices:
+                self.forget_device(device)
+            self.conBtn.setEnabled(True)
+            self.connectAct.setEnabled(True)
+            QMessageBox.warning(self, self.langstr[28],
+                                self.langstr[48].format(device.name, error))
+        for channel, device in enumerate(self.devices):
+            values, stamps, self.cursors[channel] = device.history(
+                self.cursors[channel])
+            if values.size:
+                if device is self.device:
+                    # the gate changes when the firmware acknowledges it
+                    self.set_waterfall_channel()
+                self.display_data(values, values.size, channel, stamps)
+
+    def display_data(self, values, count, channel=0, stamps=None):
+        """ display a batch of samples (values is an ndarray holding count
+            samples read at stamps) : all of them in the graph and, for the
+            displayed device, the last one in the labels
+        """
+        valid = values != BAD_SAMPLE
+        if stamps is not None:
+            stamps = stamps[valid]
+        valid = values[valid]
+        if self.devices and self.devices[channel] is not self.device:
+            if valid.size and not self.holddata:
+                self.graphdlg.update_data(valid, channel, stamps)
+            return
+        # does thread  read real values ?
+        if valid.size == 0:
+            self.statusBar().showMessage(self.langstr[28])
+            return
+        self.readvalue = valid[-1]
 
         if self.autorange:
             # MHz range
@@ -446,73 +864,100 @@ class MainWindow(QMainWindow):
             convertedval = self.readvalue
             self.unitlabel.setText('Hz')
             self.timelabel.setText('s')
-        # does thread  read real values ?
-        if self.readvalue != -1:
-            self.statusBar().showMessage(self.langstr[27])
-            # not in hold mode
-            if not self.holddata:
-                if (convertedval != 0):
-                    period = 1 / convertedval
-                    self.dispp.setText(str('{:10.6f}').format(period))
-                else:
-                    self.dispp.setText('0')
-                self.disp.setText(str('{:10.3f}').format(convertedval))
-                self.graphdlg.update_data(self.readvalue)
+        if valid.size == count:
+            if (self.device.ack_time is not None
+                    and time.monotonic() - self.device.ack_time < 5.0):
+                self.statusBar().showMessage(self.langstr[47].format(
+                    round(self.device.dead_time * 1e6)))
+            else:
+                self.statusBar().showMessage(self.langstr[27])
         else:
             self.statusBar().showMessage(self.langstr[28])
+        # not in hold mode
+        if not self.holddata:
+            if (convertedval != 0):
+                period = 1 / convertedval
+                self.dispp.setText(str('{:10.6f}').format(period))
+            else:
+                self.dispp.setText('0')
+            self.disp.setText(str('{:10.3f}').format(convertedval))
+            self.graphdlg.update_data(valid, channel, stamps)
 
     def connect_serial(self):
         """ Button conBtn clicked event handler
-            Try to connect to selected serial port
+            Try to connect to selected serial port, each new port is added
+            to the devices already connected
         """
-        # set serial configuration
-        self.serport.port = self.settingsList[1]
-        self.serport.baudrate = int(self.settingsList[2])
-        self.serport.timeout = 1
-        # not yet connected? -> try to connect
+        port = self.settingsList[1]
+        # the entry of a device dropped meanwhile is reused
+        previous = None
+        for device in self.devices:
+            if device.serport.port == port:
+                if device.error is None:
+                    return
+                previous = device
+        device = Device(port, self.settingsList[2],
+                        binary=self.use_binary_protocol)
+        device.set_filter(self.current_filter())
+        device.sinks = [self.statistics, self.stability, self.distributions,
+                        self.spectra]
+        try:
+            self.engine.add_device(device)
+        # something is wrong
+        except serial.serialutil.SerialException:
+            if previous is not None:
+                self.forget_device(previous)
+            QMessageBox.about(self, 'Big mistake!',
+                              'Error opening port.\nPlease check your connections!!!')
+            return
+        if self.recorder is not None:
+            device.sinks = device.sinks + [self.recorder]
+        if previous is not None:
+            index = self.devices.index(previous)
+            self.devices[index] = device
+            self.cursors[index] = device.ring.written
+        else:
+            index = len(self.devices)
+            self.devices.append(device)
+            self.cursors.append(device.ring.written)
+            self.channel_combo.addItem(device.name)
+        self.conBtn.setEnabled(False)
+        self.connectAct.setEnabled(False)
+        self.fast.setEnabled(True)
+        self.slow.setEnabled(True)
+        self.hold.setEnabled(True)
+        self.auto.setEnabled(True)
+        self.graph.setEnabled(True)
+        self.stats.setEnabled(True)
+        self.dist.setEnabled(True)
+        self.spectrum.setEnabled(True)
+        self.statusBar().showMessage(self.langstr[29].format(port), 1000)
+        # new device is displayed
+        self.channel_combo.setCurrentIndex(index)
+        self.select_channel(index)
         if not self.isConnected:
-            try:
-                if not self.serport.isOpen():
-                    self.serport.open()
-                self.isConnected = True
-                self.conBtn.setEnabled(False)
-                self.setBtn.setEnabled(False)
-                self.connectAct.setEnabled(False)
-                self.configAct.setEnabled(False)
-                self.fast.setEnabled(True)
-                self.slow.setEnabled(True)
-                self.hold.setEnabled(True)
-                self.auto.setEnabled(True)
-                self.graph.setEnabled(True)
-                self.statusBar().showMessage(self.langstr[29].format(self.settingsList[1]), 1000)
-                self.Thread.start()
-            # something is wrong
-            except serial.serialutil.SerialException:
-                QMessageBox.about(self, 'Big mistake!',
-                                  'Error opening port.\nPlease check your connections!!!')
+            self.isConnected = True
+            self.Thread.start()
+            self.refreshTimer.start(1000 // self.refresh_rate)
 
 
 class DataThread(QThread):
-    """ Thread for reading serial data """
+    """ Thread for reading serial data
+        The engine stores samples of each device in its ring buffer, polled
+        by the GUI
+    """
 
-    # custom signal to return data
-    dataReady = pyqtSignal(float)
     isOpen = True
 
     def __init__(self, parent=None):
         super(DataThread, self).__init__(parent)
         self.threadactive = True
-        self.parent = parent
+        self.engine = parent.engine
 
     def run(self):
-        # self.threadactive = True
+        self.threadactive = True
         while (self.threadactive):
-            try:
-                # read a string from serial and cast it to int
-                self.values = float(self.parent.serport.readline().decode('ascii'))
-                self.dataReady.emit(self.values) #envoi d'une valeur à afficher
-            except (TypeError, ValueError) as e:
-                self.dataReady.emit(-1)
+            self.engine.poll(0.1)
 
     def stop(self):
         self.threadactive = False
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+""" pytest configuration : the modules are imported as tools.x, like the
+    application run from the freqmeter folder
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
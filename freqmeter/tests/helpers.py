@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+""" Shared helpers of the tests """
+
+import numpy as np
+from tools.serialreader import FRAME_DTYPE, FRAME_SIZE, crc8
+
+
+def frames(counts, seq=0, flags=0):
+    """ binary frames of the firmware for these raw counts """
+    data = np.zeros(len(counts), dtype=FRAME_DTYPE)
+    data['sync'] = 0xA55A
+    data['seq'] = (seq + np.arange(len(counts))) % 65536
+    data['flags'] = flags
+    data['count'] = counts
+    raw = data.view(np.uint8).reshape(-1, FRAME_SIZE)
+    raw[:, FRAME_SIZE - 1] = crc8(raw[:, 2:FRAME_SIZE - 1])
+    return raw.tobytes()
+
+
+class FakeDevice():
+    """ what the sinks read from a Device """
+
+    def __init__(self, channel=0, gate=1.0, multiplier=1):
+        self.channel = channel
+        self.gate = gate
+        self.multiplier = multiplier
+
+
+class FakePort():
+    """ serial port fed by the test """
+
+    def __init__(self, data=b''):
+        self.data = data
+        self.sent = b''
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, size):
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+    def write(self, data):
+        self.sent += data
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+import pytest
+from tools import emulator
+from tools.acquisition import Device, AcquisitionEngine
+from tools.serialreader import SerialReader, FAST_GATE, SLOW_GATE, BAD_SAMPLE
+from tools.streamfilters import BoxCar
+from helpers import FakePort
+
+pytestmark = pytest.mark.skipif(emulator.tty is None,
+                                reason='no pseudo-terminal')
+
+
+class Collector():
+    """ sink keeping what the device pushes """
+
+    def __init__(self):
+        self.batches = []
+
+    def push(self, device, values, stamps):
+        self.batches.append((device.gate, values.copy(), stamps))
+
+
+def run(engine, seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        engine.poll(0.01)
+
+
+# emulator of each port
+EMULATORS = {}
+
+
+def emulator_of(device):
+    return EMULATORS[device.serport.port]
+
+
+@pytest.fixture
+def arduinos():
+    started = []
+
+    def start(frequency=12345.0, speed=20, **options):
+        arduino = emulator.VirtualArduino(
+            emulator.SignalGenerator('constant', frequency), speed=speed,
+            link=False, **options)
+        arduino.start()
+        started.append(arduino)
+        EMULATORS[arduino.port] = arduino
+        return arduino
+    yield start
+    for arduino in started:
+        arduino.stop()
+
+
+def test_several_devices(arduinos):
+    engine = AcquisitionEngine()
+    devices = [Device(arduinos(1000.0 * (number + 1), rate=200).port)
+               for number in range(3)]
+    for device in devices:
+        engine.add_device(device)
+    run(engine, 0.5)
+    engine.close()
+    for number, device in enumerate(devices):
+        values = device.ring.ordered()
+        assert values.size > 20
+        assert np.all(values == 1000.0 * (number + 1))
+        assert np.all(np.diff(device.stamps.ordered()) >= 0)
+
+
+def test_sinks_get_a_stamp_per_sample(arduinos):
+    device = Device(arduinos(rate=200).port)
+    collector = Collector()
+    device.sinks = [collector]
+    engine = AcquisitionEngine()
+    engine.add_device(device)
+    for _ in range(6):
+        # several samples per batch
+        time.sleep(0.05)
+        engine.poll(0)
+    engine.close()
+    assert all(len(values) == len(stamps)
+               for _, values, stamps in collector.batches)
+    stamps = np.concatenate([stamps for _, _, stamps in collector.batches])
+    assert np.all(np.diff(stamps) >= 0)
+    # the samples of a batch are spread over the batch
+    assert np.unique(stamps).size > len(collector.batches)
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_gate_switching(arduinos, binary):
+    arduino = arduinos()
+    device = Device(arduino.port, binary=binary)
+    collector = Collector()
+    device.sinks = [collector]
+    engine = AcquisitionEngine()
+    engine.add_device(device)
+    run(engine, 0.3)
+    device.set_fast(True)
+    run(engine, 0.3)
+    device.set_fast(False)
+    run(engine, 0.3)
+    engine.close()
+    assert device.switches == 2 and device.acknowledges
+    assert device.reader.is_binary() == binary
+    values = np.concatenate([values for _, values, _ in collector.batches])
+    # every sample is scaled with the gate it was counted with
+    assert np.all(np.abs(values - 12345.0) <= 10)
+    gates = [gate for gate, _, _ in collector.batches]
+    assert FAST_GATE in gates and gates[-1] == SLOW_GATE
+
+
+def test_switching_without_acknowledgements(arduinos):
+    device = Device(arduinos(12345.6, acks=False).port)
+    device.ack_timeout = 0.2
+    collector = Collector()
+    device.sinks = [collector]
+    engine = AcquisitionEngine()
+    engine.add_device(device)
+    run(engine, 0.3)
+    device.set_fast(True)
+    run(engine, 0.6)
+    assert device.acknowledges is False
+    # the samples of the unknown gate are dropped, not guessed
+    expected = {SLOW_GATE: 12346.0, FAST_GATE: 12350.0}
+    for gate, values, _ in collector.batches:
+        valid = values[values != BAD_SAMPLE]
+        assert np.all(valid == expected[gate])
+    values = np.concatenate([values for _, values, _ in collector.batches])
+    assert np.any(values == BAD_SAMPLE)
+    assert collector.batches[-1][0] == FAST_GATE
+    engine.close()
+    # another firmware may be plugged on the port
+    device.open()
+    assert device.acknowledges is None and not device.gate_fast
+    device.close()
+
+
+def test_protocol_switched_by_the_engine(arduinos):
+    device = Device(arduinos(rate=200).port)
+    engine = AcquisitionEngine()
+    engine.add_device(device)
+    run(engine, 0.2)
+    engine.set_binary(device, True)
+    # requested from another thread, sent by the next poll
+    assert not device.reader.is_binary()
+    run(engine, 0.3)
+    assert device.reader.is_binary()
+    engine.set_binary(device, False)
+    run(engine, 0.3)
+    assert not device.reader.is_binary()
+    engine.close()
+    assert device.ring.written > 80
+    assert np.all(device.ring.ordered() == 12345.0)
+
+
+def test_unplugged_device_is_dropped(arduinos):
+    engine = AcquisitionEngine()
+    unplugged, kept = (Device(arduinos(rate=200).port) for _ in range(2))
+    engine.add_device(unplugged)
+    engine.add_device(kept)
+    run(engine, 0.2)
+    emulator_of(unplugged).unplug()
+    before = kept.ring.written
+    run(engine, 0.3)
+    assert engine.devices == [kept]
+    failed, error = engine.failures.get_nowait()
+    assert failed is unplugged and isinstance(error, OSError)
+    assert not unplugged.serport.isOpen()
+    assert kept.ring.written > before + 20
+    assert not np.any(kept.ring.ordered() == BAD_SAMPLE)
+    engine.close()
+
+
+def test_decimating_filter_between_outputs():
+    device = Device('unused')
+    device.set_filter(BoxCar({'factor': 4}))
+    device.process(np.full(4, 1000.0), False, 10**9)
+    # a batch which doesn't complete a block : nothing to store
+    device.process(np.array([1000.0, 1002.0]), False, 2 * 10**9)
+    assert device.ring.written == 1
+    device.process(np.array([1004.0, 1006.0]), False, 3 * 10**9)
+    assert np.array_equal(device.ring.ordered(), [1000.0, 1003.0])
+    assert np.array_equal(device.stamps.ordered(), [10**9, 3 * 10**9])
+
+
+def test_stamps_increase_across_a_gate_switch():
+    device = Device('unused')
+    device.reader = SerialReader(FakePort(b'1000\r\n1001\r\n#f 2 20\r\n'
+                                          + b'1000\r\n' * 5))
+    collector = Collector()
+    device.sinks = [collector]
+    # read 10 ms ago : the slow run would start 2 s before that
+    previous = device.last_stamp = time.monotonic_ns() - 10 ** 7
+    device.read()
+    assert [(gate, len(values)) for gate, values, _ in collector.batches] \
+        == [(SLOW_GATE, 2), (FAST_GATE, 5)]
+    stamps = np.concatenate([stamps for _, _, stamps in collector.batches])
+    assert np.all(np.diff(np.concatenate(([previous], stamps))) > 0)
+
+
+def test_spread_with_a_coarse_clock():
+    device = Device('unused')
+    stamps = device.spread(10, 10 ** 9 + 5, 10 ** 9)
+    assert stamps[-1] == 10 ** 9 + 5 and stamps[0] >= 10 ** 9
+    assert np.all(np.diff(stamps) >= 0) and np.unique(stamps).size == 6
+    # a clock which didn't move
+    assert np.all(device.spread(3, 10 ** 9, 10 ** 9) == 10 ** 9)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from tools.allan import allan_deviation, AllanDeviation
+
+
+def naive(y, tau0, m):
+    """ NIST SP 1065 overlapping ADEV and MDEV, term by term """
+    x = np.concatenate(([0.0], np.cumsum(y))) * tau0
+    n, tau = x.size, m * tau0
+    adev = sum((x[i + 2 * m] - 2 * x[i + m] + x[i]) ** 2
+               for i in range(n - 2 * m)) / (2 * tau ** 2 * (n - 2 * m))
+    mdev = sum(sum(x[i + 2 * m] - 2 * x[i + m] + x[i]
+                   for i in range(j, j + m)) ** 2
+               for j in range(n - 3 * m + 1))
+    mdev /= 2 * m ** 2 * tau ** 2 * (n - 3 * m + 1)
+    return np.sqrt(adev), np.sqrt(mdev)
+
+
+def test_against_the_definition():
+    y = np.random.default_rng(3).normal(0, 1e-9, 200)
+    result = allan_deviation(y, 0.1)
+    for octave, m in enumerate((1, 2, 4, 8, 16)):
+        adev, mdev = naive(y, 0.1, m)
+        assert np.isclose(result['adev'][octave], adev, rtol=1e-9)
+        assert np.isclose(result['mdev'][octave], mdev, rtol=1e-9)
+
+
+def test_white_noise_slope():
+    y = np.random.default_rng(4).normal(0, 1e-9, 2 ** 16)
+    result = allan_deviation(y, 1.0)
+    # white frequency noise : adev(tau) = sigma / sqrt(tau)
+    assert np.allclose(result['adev'][:8] * np.sqrt(result['tau'][:8]),
+                       1e-9, rtol=0.1)
+
+
+def test_incremental_matches_batch():
+    y = np.random.default_rng(5).normal(0, 1e-9, 5000)
+    allan = AllanDeviation(0.1, max_octave=6)
+    for start in range(0, y.size, 333):
+        allan.update(y[start:start + 333])
+    expected = allan_deviation(y, 0.1)
+    result = allan.result()
+    assert np.allclose(result['adev'], expected['adev'][:7], rtol=1e-6)
+    assert np.allclose(result['mdev'], expected['mdev'][:7], rtol=1e-6)
+
+
+def test_incremental_with_an_offset():
+    # a frequency offset, batches of any size across the compactions
+    y = 1e-6 + np.random.default_rng(6).normal(0, 1e-9, 200000)
+    allan = AllanDeviation(0.1, max_octave=4)
+    sizes = np.random.default_rng(7).integers(1, 500, 2000)
+    bounds = np.concatenate(([0], np.cumsum(sizes)))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        allan.update(y[start:end])
+    expected = allan_deviation(y[:bounds[-1]], 0.1)
+    result = allan.result()
+    assert np.allclose(result['adev'], expected['adev'][:5], rtol=1e-6)
+    assert np.allclose(result['mdev'], expected['mdev'][:5], rtol=1e-6)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from tools.serialreader import BAD_SAMPLE, FAST_GATE
+from tools.spectrum import Spectra
+from tools.statistics import Statistics
+from helpers import FakeDevice
+
+
+def push(sink, device, values):
+    values = np.array(values, dtype=float)
+    sink.push(device, values, np.arange(values.size))
+
+
+def test_channels_are_kept_apart_without_bad_samples():
+    statistics = Statistics()
+    push(statistics, FakeDevice(0), [1000.0, BAD_SAMPLE, 1002.0])
+    push(statistics, FakeDevice(1), [5.0])
+    assert statistics.summary(0)['count'] == 2
+    assert statistics.summary(0)['mean'] == 1001.0
+    assert statistics.window(1)['count'] == 1
+    statistics.reset(0)
+    assert statistics.summary(0)['count'] == 0
+    assert statistics.summary(1)['count'] == 1
+
+
+def test_restart_on_gate_change():
+    spectra = Spectra(16)
+    slow, fast = FakeDevice(0), FakeDevice(0, gate=FAST_GATE)
+    push(spectra, slow, np.arange(40.0))
+    assert spectra.result(0)[2] > 0
+    push(spectra, fast, np.arange(4.0))
+    frequencies, _, segments, pending = spectra.result(0)
+    assert segments == 0 and pending == 4
+    assert frequencies[-1] == 0.5 / FAST_GATE
+    spectra.set_segment(32)
+    assert spectra.result(0) is None
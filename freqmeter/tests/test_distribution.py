@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from tools.distribution import (Histogram, QuantileSketch, Distribution,
+                                Distributions)
+from tools.serialreader import BAD_SAMPLE
+from helpers import FakeDevice
+
+
+def test_histogram_widens():
+    histogram = Histogram(16)
+    histogram.update(np.arange(1000.0, 1010.0))
+    histogram.update(np.array([900.0, 1200.0]))
+    assert histogram.counts.sum() == 12
+    edges = histogram.edges()
+    assert edges[0] <= 900 and edges[-1] > 1200
+    assert edges[0] % histogram.width == 0
+
+
+def test_save_load(tmp_path):
+    distribution = Distribution()
+    distribution.update(np.random.default_rng(9).normal(1000, 5, 5000))
+    filename = str(tmp_path / 'dist.npz')
+    distribution.save(filename)
+    loaded = Distribution.load(filename)
+    assert np.array_equal(loaded.histogram.counts,
+                          distribution.histogram.counts)
+    assert np.array_equal(loaded.sketch.quantiles(),
+                          distribution.sketch.quantiles())
+
+
+def test_sink_ignores_bad_samples():
+    distributions = Distributions()
+    distributions.push(FakeDevice(0), np.array([1000.0, BAD_SAMPLE]),
+                       np.array([0, 1]))
+    distributions.push(FakeDevice(1), np.array([2000.0]), np.array([0]))
+    assert distributions.snapshot(0).sketch.count == 1
+    assert distributions.snapshot().sketch.count == 2
+
+
+def rank_error(sketch, values, fractions=(0.01, 0.1, 0.5, 0.9, 0.99)):
+    """ largest rank distance between the sketch and the true quantiles """
+    ranks = np.searchsorted(np.sort(values), sketch.quantiles(fractions))
+    return np.abs(ranks / len(values) - np.array(fractions)).max()
+
+
+def test_sketch_rank_error():
+    values = np.random.default_rng(3).normal(1000, 5, 400000)
+    sketch = QuantileSketch(200, seed=3)
+    for start in range(0, values.size, 1000):
+        sketch.update(values[start:start + 1000])
+    assert rank_error(sketch, values) < 0.01
+    # four sessions merged keep as many items as a single one
+    merged = QuantileSketch(200, seed=4)
+    for part in np.split(values, 4):
+        session = QuantileSketch(200, seed=5)
+        for start in range(0, part.size, 500):
+            session.update(part[start:start + 500])
+        merged.merge(session)
+    assert merged.count == values.size and merged.size() > 200
+    assert rank_error(merged, values) < 0.01
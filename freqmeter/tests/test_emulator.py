@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import time
+import numpy as np
+import pytest
+from tools import emulator
+from tools.recorder import Recorder, EXTENSION
+from tools.serialreader import FrameParser, BAD_SAMPLE, FAST_GATE
+from helpers import FakeDevice
+
+
+@pytest.mark.skipif(emulator.tty is None, reason='no pseudo-terminal')
+def test_slow_reader_gets_whole_frames():
+    arduino = emulator.VirtualArduino(emulator.SignalGenerator('noise'),
+                                      rate=20000, link=False)
+    arduino.binary = True
+    arduino.start()
+    parser = FrameParser()
+    values = []
+    # nothing read at first : the pty fills up
+    time.sleep(0.3)
+    end = time.monotonic() + 0.3
+    while time.monotonic() < end:
+        try:
+            values.append(parser.feed(os.read(arduino.slave, 65536)))
+        except BlockingIOError:
+            time.sleep(0.001)
+    arduino.stop()
+    assert parser.rejected == 0
+    assert sum(map(len, values)) > 1000
+    # the dropped samples are missing from the sequence numbers
+    assert parser.lost <= arduino.dropped
+
+
+def test_replay_a_recording(tmp_path):
+    slow = FakeDevice(channel=0)
+    fast = FakeDevice(channel=1, gate=FAST_GATE, multiplier=4)
+    # two files, like a recording rotated or restarted
+    for start in (0, 150):
+        recorder = Recorder(str(tmp_path))
+        recorder.start()
+        recorder.push(slow, np.arange(start, start + 150.0), np.zeros(150))
+        recorder.push(fast, np.array([400.0, BAD_SAMPLE]), np.zeros(2))
+        recorder.stop()
+    assert len(glob.glob(str(tmp_path / ('*' + EXTENSION)))) == 2
+    prefix = str(tmp_path / 'freqmeter')
+    assert np.array_equal(emulator.load_replay(prefix), np.arange(300.0))
+    # the counts of the Arduino, without the bad samples
+    assert np.array_equal(emulator.load_replay(prefix, channel=1),
+                          [100.0, 100.0])
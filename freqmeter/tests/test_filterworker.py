@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+from tools.filterapi import FilterChain
+from tools.filterworker import ProcessFilter
+
+SOURCE = '''
+import sys
+import time
+import numpy as np
+QT = any(name.startswith('PyQt') for name in sys.modules)
+
+
+def filter_batch(values):
+    if np.any(values == 666):
+        time.sleep(60)
+    return values * 2 + QT
+'''
+
+
+def filter_all(filtering, batches, seconds=10):
+    results = [filtering.process(batch) for batch in batches]
+    end = time.monotonic() + seconds
+    while sum(map(len, results)) < sum(map(len, batches)):
+        assert time.monotonic() < end
+        time.sleep(0.01)
+        results.append(filtering.flush())
+    return np.concatenate(results)
+
+
+def test_worker_filters_in_order_without_qt():
+    filtering = ProcessFilter(SOURCE, 'worker_filter.py')
+    try:
+        batches = [np.arange(100.0) + 100 * number for number in range(5)]
+        filtered = filter_all(filtering, batches)
+        # nothing of the application (Qt) in the worker
+        assert np.array_equal(filtered, np.arange(500.0) * 2)
+        assert filtering.skipped == 0
+    finally:
+        filtering.close()
+
+
+def test_hung_worker_is_restarted():
+    filtering = ProcessFilter(SOURCE, 'worker_filter.py', timeout=0.5)
+    try:
+        batches = [np.array([1.0, 666.0]), np.array([2.0])]
+        assert np.array_equal(filter_all(filtering, batches), [1, 666, 2])
+        assert filtering.restarts == 1 and filtering.skipped == 3
+        assert np.array_equal(filter_all(filtering, [np.array([3.0])]), [6])
+    finally:
+        filtering.close()
+
+
+def test_broken_filter_is_given_up():
+    filtering = ProcessFilter('def filter(value)\n', 'broken_filter.py',
+                              attempts=2)
+    try:
+        # each worker fails on the batches sent to it
+        for number in range(2):
+            batch = np.array([1.0, 2.0]) + number
+            assert np.array_equal(filter_all(filtering, [batch]), batch)
+        assert filtering.failed() and filtering.restarts == 1
+        assert filtering.error.startswith('SyntaxError')
+        # no more worker
+        assert np.array_equal(filtering.process(np.array([4.0])), [4])
+    finally:
+        filtering.close()
+
+
+def test_chain_configures_the_worker():
+    source = ('from tools.filterapi import StreamFilter\n\n\n'
+              'class Filter(StreamFilter):\n'
+              '    defaults = {"gain": 1.0}\n\n'
+              '    def process(self, values):\n'
+              '        return values * self.config["gain"]\n')
+    chain = FilterChain([ProcessFilter(source, 'gain_filter.py')])
+    try:
+        assert np.array_equal(filter_all(chain, [np.ones(3)]), [1, 1, 1])
+        chain.configure(0, {'gain': 3.0})
+        assert np.array_equal(filter_all(chain, [np.ones(3)]), [3, 3, 3])
+    finally:
+        chain.close()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+import pytest
+from tools import emulator, headless
+
+pytestmark = pytest.mark.skipif(emulator.tty is None,
+                                reason='no pseudo-terminal')
+
+
+def test_a_time_per_sample(tmp_path):
+    arduino = emulator.VirtualArduino(
+        emulator.SignalGenerator('constant', 1000.0), link=False, rate=2000)
+    arduino.start()
+    output = str(tmp_path / 'log.csv')
+    try:
+        start = time.time()
+        assert headless.main(['--port', arduino.port, '--output', output,
+                              '--duration', '0.5']) == 0
+    finally:
+        arduino.stop()
+    lines = np.loadtxt(output, delimiter=',', skiprows=1, ndmin=2)
+    times, values = lines[:, 0], lines[:, 2]
+    assert values.size > 20 and np.all(values == 1000.0)
+    # seconds since the epoch, increasing within the batches too
+    assert start < times[-1] < time.time()
+    assert np.all(np.diff(times) > 0)
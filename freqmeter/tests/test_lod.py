@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from tools.lod import RecordingView, EnvelopeBuffer
+from tools.recorder import HEADER_DTYPE, RECORD_DTYPE, MAGIC, VERSION
+
+
+def write_recording(filename, values, channels=None, origin=0, wall=0):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['record_size'] = RECORD_DTYPE.itemsize
+    header['mono_ns'] = origin
+    header['wall_ns'] = wall
+    records = np.zeros(len(values), dtype=RECORD_DTYPE)
+    records['time'] = origin + np.arange(len(values)) * 1000000
+    records['value'] = values
+    if channels is not None:
+        records['channel'] = channels
+    with open(filename, 'wb') as writer:
+        writer.write(header.tobytes())
+        writer.write(records.tobytes())
+
+
+def test_envelope_keeps_the_spikes(tmp_path):
+    values = np.random.default_rng(1).normal(1000, 1, 200000)
+    values[123457] = 5000
+    values[54321] = -100
+    filename = str(tmp_path / 'rec.fqm')
+    write_recording(filename, values)
+    view = RecordingView(filename)
+    times, envelope = view.envelope(0, view.duration(), 500)
+    assert envelope.size < 4000
+    assert np.nanmax(envelope) == 5000
+    assert np.nanmin(envelope) == -100
+    # second open maps the pyramid built by the first one
+    again = RecordingView(filename)
+    assert len(again.parts[0].levels) == len(view.parts[0].levels)
+    times, samples = again.envelope(10.0, 10.25, 1000)
+    assert np.array_equal(samples, values[9999:10251])
+
+
+def test_envelope_of_a_channel(tmp_path):
+    values = np.arange(4000.0)
+    filename = str(tmp_path / 'rec.fqm')
+    write_recording(filename, values, channels=np.arange(4000) % 2)
+    view = RecordingView(filename, channel=1)
+    times, samples = view.envelope(0, 1, 10000)
+    assert np.array_equal(samples, values[1::2][:samples.size])
+
+
+def test_rotated_files_are_joined(tmp_path):
+    values = np.random.default_rng(2).normal(1000, 1, 30000)
+    values[25000] = 5000
+    # the second file comes from another run : its monotonic clock
+    # restarted, the wall clock places it 10 s after the first one
+    write_recording(str(tmp_path / 'rec-20201231-120000.fqm'), values[:10000],
+                    origin=5 * 10**12, wall=10**18)
+    write_recording(str(tmp_path / 'rec-20201231-120010.fqm'), values[10000:],
+                    origin=10**9, wall=10**18 + 10**10)
+    for names in (str(tmp_path / 'rec-20201231'), str(tmp_path / '*.fqm')):
+        view = RecordingView(names)
+        assert len(view.parts) == 2
+        assert np.isclose(view.duration(), 10 + 19.999)
+        times, envelope = view.envelope(0, view.duration(), 300)
+        assert np.nanmax(envelope) == 5000
+        assert np.all(np.diff(times) >= 0)
+        times, samples = view.envelope(9.995, 10.005, 10000)
+        assert np.array_equal(samples, values[9994:10006])
+
+
+def test_envelope_buffer():
+    history = EnvelopeBuffer(10000, times=True)
+    values = np.zeros(25000)
+    values[20001] = 7
+    history.write(values, np.arange(25000) * 10)
+    x, y = history.envelope(0, 25000, 10)
+    assert x[0] >= history.oldest()
+    assert y.max() == 7
+    assert history.search(200015) == 20002
+    assert history.search(0) == history.oldest()
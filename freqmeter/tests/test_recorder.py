@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import threading
+import time
+import numpy as np
+from tools.recorder import Recorder, load_recording, EXTENSION
+from tools.serialreader import FAST_GATE
+from helpers import FakeDevice
+
+
+def test_records_written_in_order(tmp_path):
+    recorder = Recorder(str(tmp_path), sync_interval=0.05)
+    recorder.start()
+    slow = FakeDevice(channel=0)
+    fast = FakeDevice(channel=1, gate=FAST_GATE, multiplier=4)
+    recorder.push(slow, np.array([1000.0, 1001.0]), np.array([10, 11]))
+    recorder.push(fast, np.array([40.0]), np.array([20]))
+    recorder.push(slow, np.array([1002.0]), np.array([30]))
+    recorder.stop()
+    files = glob.glob(os.path.join(str(tmp_path), '*' + EXTENSION))
+    assert len(files) == 1
+    records = load_recording(files[0])
+    assert np.array_equal(records['time'], [10, 11, 20, 30])
+    assert np.array_equal(records['value'], [1000, 1001, 40, 1002])
+    assert np.array_equal(records['channel'], [0, 0, 1, 0])
+    assert np.array_equal(records['mode'], [0, 0, 1, 0])
+    assert np.array_equal(records['multiplier'], [1, 1, 4, 1])
+    assert recorder.dropped == 0
+
+
+def test_stop_gives_up_on_a_blocked_writer(tmp_path):
+    recorder = Recorder(str(tmp_path), queue_size=1)
+    blocked = threading.Event()
+    recorder.write = lambda records: blocked.wait()
+    recorder.start()
+    device = FakeDevice(channel=0)
+    for stamp in range(3):
+        recorder.push(device, np.array([1000.0]), np.array([stamp]))
+    start = time.monotonic()
+    assert not recorder.stop(timeout=0.2)
+    assert time.monotonic() - start < 1
+    blocked.set()
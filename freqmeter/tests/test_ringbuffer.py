@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from tools.ringbuffer import RingBuffer
+
+
+def test_read_across_the_end():
+    ring = RingBuffer(8)
+    ring.write(np.arange(6.0))
+    values, cursor = ring.read(0)
+    assert np.array_equal(values, np.arange(6))
+    ring.write(np.arange(6.0, 11.0))
+    values, cursor = ring.read(cursor)
+    assert np.array_equal(values, np.arange(6, 11))
+    assert cursor == 11
+
+
+def test_slow_consumer_loses_the_oldest():
+    ring = RingBuffer(8)
+    ring.write(np.arange(20.0))
+    values, cursor = ring.read(0)
+    assert np.array_equal(values, np.arange(12, 20))
+    assert cursor == 20
+
+
+def test_ordered_and_end():
+    ring = RingBuffer(8, dtype=np.int64)
+    ring.write(np.arange(13))
+    assert np.array_equal(ring.ordered(), np.arange(5, 13))
+    assert np.array_equal(ring.ordered(3), [10, 11, 12])
+    values, end = ring.read(6, 9)
+    assert np.array_equal(values, [6, 7, 8]) and end == 9
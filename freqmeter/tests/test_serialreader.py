@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from tools.serialreader import (AsciiParser, FrameParser, SerialReader,
+                                BAD_SAMPLE, FLAG_FAST, FLAG_ACK, FAST_SCALE,
+                                BINARY_REQUEST)
+from helpers import frames, FakePort
+
+
+def test_ascii_lines_split_anywhere():
+    stream = b''.join(b'%d\r\n' % value for value in range(1000, 1100))
+    parser = AsciiParser()
+    values = [parser.feed(stream[start:start + 7])
+              for start in range(0, len(stream), 7)]
+    assert np.array_equal(np.concatenate(values), np.arange(1000, 1100))
+
+
+def test_ascii_corrupted_line():
+    values = AsciiParser().feed(b'1000\r\n10x0\r\n1002\r\n')
+    assert np.array_equal(values, [1000, BAD_SAMPLE, 1002])
+
+
+def test_ascii_acknowledgement():
+    parser = AsciiParser()
+    values = parser.feed(b'100\r\n200\r\n#f 2 20\r\n3000\r\n')
+    assert np.array_equal(values, [100, 200, 3000])
+    assert parser.acks == [(2, 2, True, 20)]
+
+
+def test_frames_scaled_and_split_anywhere():
+    stream = frames([100, 200], flags=0) + frames([30, 40], seq=2,
+                                                   flags=FLAG_FAST)
+    parser = FrameParser()
+    values = [parser.feed(stream[start:start + 3])
+              for start in range(0, len(stream), 3)]
+    assert np.array_equal(np.concatenate(values),
+                          [100, 200, 30 * FAST_SCALE, 40 * FAST_SCALE])
+    assert parser.lost == 0
+
+
+def test_frames_bad_crc_and_lost():
+    good = frames(np.arange(10), seq=0)
+    corrupted = bytearray(good)
+    corrupted[3 * 10 + 6] ^= 0xFF
+    parser = FrameParser()
+    values = parser.feed(b'\x01\x02' + bytes(corrupted))
+    assert np.array_equal(values, [0, 1, 2, 4, 5, 6, 7, 8, 9])
+    assert parser.rejected == 1
+    assert parser.lost == 1
+
+
+def test_frame_acknowledgement():
+    stream = (frames([100], seq=7) + frames([20], seq=8,
+                                            flags=FLAG_ACK | FLAG_FAST)
+              + frames([15], seq=8, flags=FLAG_FAST))
+    parser = FrameParser()
+    values = parser.feed(stream)
+    assert np.array_equal(values, [100, 150])
+    assert np.array_equal(parser.gates, [False, True])
+    assert parser.acks == [(1, 8, True, 20)]
+    assert parser.lost == 0
+
+
+def test_reader_switches_to_binary():
+    port = FakePort(b'1000\r\n1001\r\n' + frames([1002, 1003]))
+    reader = SerialReader(port, binary=True)
+    reader.reset()
+    assert port.sent == BINARY_REQUEST
+    values = reader.read_batch()
+    assert np.array_equal(values, [1000, 1001, 1002, 1003])
+    assert reader.is_binary()
+
+
+def test_back_to_ascii_with_frames_in_flight():
+    port = FakePort(b'1000\r\n' + frames([1001]))
+    reader = SerialReader(port, binary=True)
+    assert np.array_equal(reader.read_batch(), [1000, 1001])
+    reader.request_ascii()
+    assert port.sent.endswith(b'a\n')
+    # a frame sent before the firmware got the request, then the lines
+    port.data = frames([1002], seq=1)[:4]
+    assert reader.read_batch().size == 0
+    port.data = frames([1002], seq=1)[4:] + b'1003\r\n1004\r\n'
+    assert np.array_equal(reader.read_batch(), [1003, 1004])
+    port.data = b'1005\r\n1006\r\n'
+    assert np.array_equal(reader.read_batch(), [1005, 1006])
+    assert not reader.is_binary()
+    # a sync word in the ASCII stream doesn't switch to frames any more
+    port.data = b'1007\r\n' + frames([1008], seq=3) + b'\r\n1009\r\n'
+    values = reader.read_batch()
+    assert values[0] == 1007 and values[-1] == 1009
+    assert not reader.is_binary()
+
+
+def test_frame_parser_falls_back_to_ascii():
+    port = FakePort(frames([1000, 1001]))
+    reader = SerialReader(port, binary=True)
+    reader.read_batch()
+    assert reader.is_binary()
+    # the Arduino was reset : ASCII lines, no frame
+    port.data = b'1002\r\n1003\r\n1004\r\n'
+    assert np.array_equal(reader.read_batch(), [1003, 1004])
+    assert not reader.is_binary()
+    port.data = b'1005\r\n'
+    assert np.array_equal(reader.read_batch(), [1005])
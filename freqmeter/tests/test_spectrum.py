@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from tools.spectrum import WelchPSD, Waterfall, fft_size, decimated_rate
+
+
+def test_white_noise_density():
+    rate, sigma = 10.0, 2.0
+    values = np.random.default_rng(6).normal(1000, sigma, 2 ** 17)
+    welch = WelchPSD(1000, rate)
+    assert welch.segment == fft_size(1000) == 1024
+    welch.update(values)
+    # one-sided density of white noise : 2 sigma^2 / rate
+    assert np.isclose(np.mean(welch.psd()[1:-1]), 2 * sigma ** 2 / rate,
+                      rtol=0.05)
+
+
+def test_tone_frequency():
+    rate = 10.0
+    t = np.arange(2 ** 14) / rate
+    welch = WelchPSD(1024, rate)
+    welch.update(1000 + np.sin(2 * np.pi * 1.25 * t))
+    assert welch.frequencies()[np.argmax(welch.psd())] == 1.25
+
+
+def test_batches_match_one_shot():
+    values = np.random.default_rng(7).normal(0, 1, 10000)
+    once, batches = WelchPSD(256), WelchPSD(256)
+    once.update(values)
+    for start in range(0, values.size, 123):
+        batches.update(values[start:start + 123])
+    assert batches.segments == once.segments
+    assert np.allclose(batches.psd(), once.psd())
+
+
+def test_waterfall_scrolls():
+    waterfall = Waterfall(64, columns=8)
+    assert np.all(np.isnan(waterfall.image()))
+    assert waterfall.update(np.random.default_rng(8).normal(0, 1, 32 * 11
+                                                             + 32)) == 8
+    image = waterfall.image()
+    assert image.shape == (8, 33)
+    assert not np.any(np.isnan(image))
+
+
+def test_decimated_rate():
+    # a block of 4 samples counted at 10 Hz, stamped by batches of 3
+    stamps = (np.arange(1, 101) * 12 * 10**8)[:, None] \
+        - 10**8 * np.arange(2, -1, -1)
+    assert decimated_rate(10.0, stamps.ravel()) == 2.5
+    assert decimated_rate(10.0, np.arange(50) * 10**8) == 10.0
+    assert decimated_rate(10.0, np.full(5, 10**9)) is None
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from tools.statistics import RunningStats, WindowStats
+
+
+def test_running_stats():
+    values = np.random.default_rng(10).normal(1e6, 3, 10000)
+    stats = RunningStats()
+    for start in range(0, values.size, 777):
+        stats.update(values[start:start + 777])
+    summary = stats.summary()
+    assert summary['count'] == values.size
+    assert np.isclose(summary['mean'], values.mean())
+    assert np.isclose(summary['std'], values.std(ddof=1))
+    assert summary['min'] == values.min() and summary['max'] == values.max()
+
+
+def test_window_by_count_and_time():
+    values = np.random.default_rng(11).normal(1000, 1, 5000)
+    window = WindowStats(1024)
+    for number, start in enumerate(range(0, values.size, 100)):
+        window.update(values[start:start + 100],
+                      np.full(100, number * 10**9))
+    summary = window.summary(count=300)
+    assert np.isclose(summary['mean'], values[-300:].mean())
+    assert np.isclose(summary['std'], values[-300:].std(ddof=1))
+    assert summary['max'] == values[-300:].max()
+    # the last 2 s : batches 48 and 49
+    assert window.summary(seconds=1.5)['count'] == 200
+
+
+def test_window_after_a_jump():
+    rng = np.random.default_rng(12)
+    values = np.concatenate((rng.normal(1000, 1, 5000),
+                             rng.normal(16e6, 1, 3000)))
+    window = WindowStats(4096)
+    for start in range(0, values.size, 77):
+        end = min(start + 77, values.size)
+        window.update(values[start:end], np.zeros(end - start, dtype=int))
+        for count in (1, 100, 1000, 4096):
+            expected = values[max(end - count, 0):end]
+            summary = window.summary(count=count)
+            assert np.isclose(summary['mean'], expected.mean(), rtol=1e-12)
+            if expected.size > 1:
+                assert np.isclose(summary['std'], expected.std(ddof=1),
+                                  rtol=1e-6)
+            assert summary['min'] == expected.min()
+            assert summary['max'] == expected.max()
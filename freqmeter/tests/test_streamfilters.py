@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from tools.filterapi import FilterChain, StreamFilter
+from tools.streamfilters import (MovingAverage, ExponentialAverage,
+                                 SlidingMedian, Hampel, Kalman, BoxCar)
+
+VALUES = np.random.default_rng(2).normal(1000, 1, 3000)
+
+
+def by_batches(filtering, values, size=97):
+    return np.concatenate([filtering.process(values[start:start + size])
+                           for start in range(0, len(values), size)])
+
+
+def by_steps(filtering, values):
+    return np.array([value for value in map(filtering.step, values)
+                     if value is not None])
+
+
+@pytest.mark.parametrize('filter_class, config', [
+    (MovingAverage, {'window': 10}), (ExponentialAverage, {'span': 10}),
+    (SlidingMedian, {'window': 11}), (SlidingMedian, {'window': 300}),
+    (Hampel, {'window': 9, 'threshold': 3.0}),
+    (Hampel, {'window': 301, 'threshold': 3.0}),
+    (Kalman, {'ratio': 1e-3}), (BoxCar, {'factor': 10})])
+def test_batches_match_steps(filter_class, config):
+    expected = by_steps(filter_class(config), VALUES)
+    assert np.allclose(by_batches(filter_class(config), VALUES), expected)
+
+
+def test_moving_average():
+    filtered = MovingAverage({'window': 5}).process(VALUES)
+    assert np.allclose(filtered[4:],
+                       np.convolve(VALUES, np.ones(5) / 5, 'valid'))
+
+
+def test_sliding_median():
+    filtered = by_steps(SlidingMedian({'window': 7}), VALUES)
+    windows = np.lib.stride_tricks.sliding_window_view(VALUES, 7)
+    assert np.array_equal(filtered[6:], np.median(windows, axis=1))
+
+
+@pytest.mark.parametrize('window', [7, 300, 301])
+def test_sliding_median_batches_then_steps(window):
+    # equal samples too
+    values = np.round(VALUES, 1)
+    median = SlidingMedian({'window': window})
+    filtered = np.concatenate((median.process(values[:1000]),
+                               by_steps(median, values[1000:1100]),
+                               median.process(values[1100:1101]),
+                               median.process(values[1101:])))
+    windows = np.lib.stride_tricks.sliding_window_view(values, window)
+    assert np.array_equal(filtered[window - 1:], np.median(windows, axis=1))
+
+
+def test_hampel():
+    values = VALUES.copy()
+    # a jump when the window fills up, outliers later
+    values[3] += 50
+    values[[500, 501, 2000]] += [30, -40, 1e6]
+    config = {'window': 9, 'threshold': 3.0}
+    filtered = by_batches(Hampel(config), values)
+    assert np.array_equal(filtered[:9], values[:9])
+    changed = np.flatnonzero(filtered != values)
+    assert {500, 501, 2000} <= set(changed) and changed.size < 0.05 * 3000
+    assert np.array_equal(filtered, by_steps(Hampel(config), values))
+
+
+def test_reset():
+    average = MovingAverage({'window': 4})
+    average.process(np.full(10, 5.0))
+    average.reset()
+    assert average.process(np.array([1.0]))[0] == 1.0
+
+
+def test_chain_timings():
+    chain = FilterChain([StreamFilter(), BoxCar({'factor': 4})])
+    assert len(chain.process(np.arange(10.0))) == 2
+    assert [timing[1:] for timing in chain.timings] == [[10, 10], [10, 2]]
+
+
+def test_chain_stage_configured_in_place():
+    average = MovingAverage({'window': 4})
+    chain = FilterChain([average, Kalman({'ratio': 1e-3})])
+    chain.process(np.full(10, 5.0))
+    chain.configure(1, {'ratio': 0.0})
+    filtered = chain.process(np.array([9.0]))
+    # the average kept its window, the restarted Kalman passes it as is
+    assert filtered[0] == (5 + 5 + 5 + 9) / 4
+    assert chain.stages[1].noise == Kalman.minimum
+    assert chain.timings[0][1] == 11
@@ -123,12 +123,50 @@ class ClickableLabel(QLabel):
         self.clicked.emit()
 
 
+class RefreshDialog(QDialog):
+    """ Dialog refreshed every second while it is shown
+        usage : class ChannelDialog(RefreshDialog):
+                    def refresh(self):
+                        ...     # show self.channel
+                dialog = ChannelDialog('Title')
+                dialog.set_channel(device.channel)
+                dialog.show()
+    """
+
+    def __init__(self, title, interval=1000):
+        super(RefreshDialog, self).__init__()
+        self.title = title
+        self.setWindowTitle(title)
+        self.channel = 0
+        self.interval = interval
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+    def set_channel(self, channel):
+        self.channel = channel
+        self.setWindowTitle(f'{self.title} - channel {channel}')
+        self.refresh()
+
+    def refresh(self):
+        pass
+
+    def showEvent(self, event):
+        self.timer.start(self.interval)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+
 class EditorDialog(QDialog):
     """ Open a text editor
         Pass file name as an argument or use controls to load files
     """
 
     clicked = pyqtSignal(bool)
+    # path of the file just saved
+    saved = pyqtSignal(str)
 
     def __init__(self, parent=None):
         super(EditorDialog, self).__init__()
@@ -208,6 +246,10 @@ class EditorDialog(QDialog):
         select_action.setStatusTip("Select all text")
         select_action.triggered.connect(self.editor.selectAll)
 
+        # messages about the saved file
+        self.status = QLabel()
+        self.status.setWordWrap(True)
+
         # ok , save and cancel buttons
         self.buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         self.buttonBox.accepted.connect(self.onaccept)
@@ -217,6 +259,7 @@ class EditorDialog(QDialog):
         self.setLayout(layout)
         layout.addLayout(toollayout)
         layout.addWidget(self.editor)
+        layout.addWidget(self.status)
         layout.addWidget(self.buttonBox)
         layout.setAlignment(Qt.AlignBottom)
         self.setGeometry(200,200, 700, 500)
@@ -234,6 +277,9 @@ class EditorDialog(QDialog):
         self.clicked.emit(False)
         self.reject()
 
+    def set_status(self, text):
+        self.status.setText(text)
+
     def dialog_critical(self, s):
         dlg = QMessageBox(self)
         dlg.setText(s)
@@ -294,6 +340,7 @@ class EditorDialog(QDialog):
         else:
             self.path = path
             self.update_title()
+            self.saved.emit(path)
 
     def file_print(self):
         dlg = QPrintDialog()
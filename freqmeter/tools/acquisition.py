@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/acquisition.py
+ Version     : 1.0
+ Description : Acquisition engine reading several Arduino counters from
+               a single thread.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import queue
+import selectors
+import threading
+import time
+import numpy as np
+import serial
+from tools.serialreader import (SerialReader, BAD_SAMPLE, SLOW_GATE,
+                                FAST_GATE)
+from tools.ringbuffer import RingBuffer
+
+
+class Device():
+    """ An Arduino counter and its own settings
+        usage : device = Device('/dev/ttyACM0', 57600)
+                engine.add_device(device)
+                values, stamps, cursor = device.history(cursor)
+        Each batch is also pushed to the objects of 'sinks' (recorder...)
+        with sink.push(device, values, stamps), stamps are the host
+        monotonic times of the samples (ns). The filter (a StreamFilter, see
+        tools/filterapi.py) is then applied to the valid samples of the
+        batch. It is reset by the reading thread on gate and multiplier
+        changes and on reconnections. The ring samples are stamped in the
+        parallel ring 'stamps'.
+        The firmware changes its gate at the end of a measurement and
+        acknowledges it : a batch is split in runs of the same gate, 'gate'
+        is the one of the samples pushed. With a firmware which doesn't
+        acknowledge (or not yet known to), the gate of the samples read
+        until ack_timeout after the command is unknown : they are held until
+        an acknowledgement tells it, else marked BAD_SAMPLE, the following
+        ones have the new gate.
+    """
+    # samples kept for the GUI (a few seconds at the highest rates)
+    ring_size = 65536
+    # the end of a slow gate and some transmission time
+    ack_timeout = 2.5 * SLOW_GATE
+
+    def __init__(self, port, baudrate=57600, binary=False):
+        self.name = os.path.basename(port)
+        self.serport = serial.Serial()
+        self.serport.port = port
+        self.serport.baudrate = int(baudrate)
+        # non blocking reads, the engine waits for data with a selector
+        self.serport.timeout = 0
+        self.reader = SerialReader(self.serport, binary=binary)
+        self.ring = RingBuffer(self.ring_size)
+        # host monotonic time (ns) of each sample of the ring
+        self.stamps = RingBuffer(self.ring_size, dtype=np.int64)
+        # multiplier for an external frequency divider
+        self.multiplier = 1
+        # mode requested, the gate of the samples follows it once
+        # the firmware acknowledges the change
+        self.fast = False
+        self.gate = SLOW_GATE
+        self.gate_fast = False
+        # None until the firmware acknowledges (or not) a change
+        self.acknowledges = None
+        self.switch_time = None
+        # (values, stamp) read while the gate is unknown
+        self.held = []
+        # acknowledged changes, dead time of the last one (s)
+        self.switches = 0
+        self.dead_time = 0.0
+        self.ack_time = None
+        # channel number given by the engine
+        self.channel = 0
+        self.sinks = []
+        # samples read (before the filter)
+        self.samples = 0
+        # stamp of the last sample pushed (ns)
+        self.last_stamp = None
+        # StreamFilter, None to disable it, swapped by set_filter()
+        self.filter = None
+        self.next_filter = None
+        self.filter_lock = threading.Lock()
+        self.filter_errors = 0
+        self.filter_reset = False
+        # exception of the port when the engine dropped the device
+        self.error = None
+
+    def open(self):
+        """ open the port, raises serial.SerialException on failure """
+        if not self.serport.isOpen():
+            self.serport.open()
+        self.error = None
+        self.reader.reset()
+        # the Arduino restarts in slow mode, maybe with another firmware
+        self.gate_fast = False
+        self.switch_time = None
+        self.acknowledges = None
+        self.held = []
+        self.reset_filter()
+
+    def close(self):
+        self.serport.close()
+        for filtering in {self.filter, self.next_filter} - {None}:
+            filtering.close()
+        self.filter = self.next_filter = None
+
+    def set_filter(self, filtering):
+        """ use another filter (None : no filter) from the next batch, the
+            previous one is closed by the reading thread
+        """
+        with self.filter_lock:
+            # a filter set meanwhile was never used
+            unused = self.next_filter
+            if unused is self.filter:
+                unused = None
+            self.next_filter = filtering
+        if unused is not None:
+            unused.close()
+
+    def fileno(self):
+        """ file descriptor of the port (None if it can't be selected) """
+        try:
+            return self.serport.fileno()
+        except (AttributeError, serial.SerialException):
+            return None
+
+    def set_fast(self, fast):
+        """ put arduino in fast or slow reading mode """
+        self.fast = fast
+        if self.serport.isOpen():
+            self.serport.write(b'f\n' if fast else b's\n')
+        self.switch_time = time.monotonic()
+
+    def set_multiplier(self, index):
+        """ select frequency multiplier (2 ** index) """
+        self.multiplier = 2 ** index
+        self.reset_filter()
+
+    def reset_filter(self):
+        """ the filter state is cleared before the next batch """
+        self.filter_reset = True
+
+    def read(self):
+        """ read everything available and store it, return the sample count
+            (raises serial.SerialException or OSError if the port fails)
+        """
+        values = self.reader.read_batch()
+        gates, acks = self.reader.gates, self.reader.acks
+        if values.size:
+            self.samples += values.size
+            stamp = time.monotonic_ns()
+            if gates is None:
+                gates, unknown = self.ascii_gates(values.size, acks)
+                if unknown:
+                    self.held.append((values, stamp))
+                    return values.size
+            else:
+                self.gate_fast = bool(gates[-1])
+        if self.held and (values.size or acks):
+            self.release(bool(acks))
+        if values.size:
+            # one run per gate, in order, each ending a gate per sample of
+            # the next runs before the read
+            bounds = np.flatnonzero(gates[1:] != gates[:-1]) + 1
+            runs = np.split(values, bounds)
+            fasts = gates[np.concatenate(([0], bounds))]
+            ends = [stamp]
+            for run, fast in zip(runs[:0:-1], fasts[:0:-1]):
+                gate = FAST_GATE if fast else SLOW_GATE
+                ends.insert(0, ends[0] - int(len(run) * gate * 1e9))
+            for run, fast, end in zip(runs, fasts, ends):
+                if self.last_stamp is not None:
+                    # a run never starts before the previous one ends
+                    end = min(max(end, self.last_stamp + len(run)), stamp)
+                self.process(run, bool(fast), end)
+        for ack in acks:
+            self.acknowledge(ack)
+        return values.size
+
+    def ascii_gates(self, count, acks):
+        """ gates of samples which don't tell theirs, from the
+            acknowledgements or from the time of the command, and whether
+            they are unknown (a switch without acknowledgement going on)
+        """
+        if (not acks and self.acknowledges is not True
+                and self.switch_time is not None
+                and self.fast != self.gate_fast):
+            if time.monotonic() - self.switch_time <= self.ack_timeout:
+                return np.full(count, self.gate_fast), True
+            # this firmware doesn't acknowledge, it has switched by now
+            self.acknowledges = False
+            self.gate_fast = self.fast
+        gates = np.full(count, self.gate_fast)
+        for index, seq, fast, dead in acks:
+            gates[index:] = fast
+        return gates, False
+
+    def release(self, known):
+        """ push the samples held during a switch : of the gate of the
+            previous ones if the firmware acknowledged it since, else BAD
+        """
+        held, self.held = self.held, []
+        for values, stamp in held:
+            if not known:
+                values[:] = BAD_SAMPLE
+            self.process(values, self.gate == FAST_GATE, stamp)
+
+    def acknowledge(self, ack):
+        """ the firmware changed its gate """
+        index, seq, fast, dead = ack
+        self.acknowledges = True
+        self.gate_fast = fast
+        self.switches += 1
+        self.dead_time = dead * 1e-6
+        self.ack_time = time.monotonic()
+
+    def process(self, values, fast, stamp):
+        """ push and store samples read with the same gate """
+        gate = FAST_GATE if fast else SLOW_GATE
+        if gate != self.gate:
+            self.gate = gate
+            self.reset_filter()
+        if self.multiplier != 1:
+            values[values != BAD_SAMPLE] *= self.multiplier
+        stamps = self.spread(len(values), stamp, self.last_stamp)
+        self.last_stamp = int(stamps[-1])
+        for sink in self.sinks:
+            sink.push(self, values, stamps)
+        if self.next_filter is not self.filter:
+            with self.filter_lock:
+                previous, self.filter = self.filter, self.next_filter
+            if previous is not None:
+                previous.close()
+        if self.filter is not None:
+            values = self.apply_filter(values)
+        if len(values):
+            self.store(values, stamp)
+
+    def spread(self, count, stamp, last):
+        """ stamps of count samples, the last one read at stamp (ns) and
+            the others one gate before each other. Those which would not
+            come after last, the previous stamp (None at first), are spread
+            evenly between it and stamp instead : the stamps never
+            decrease, and increase while the clock gives a ns per sample.
+        """
+        gate = int(self.gate * 1e9)
+        stamps = stamp - gate * np.arange(count - 1, -1, -1, dtype=np.int64)
+        if last is not None and stamps[0] <= last:
+            stamp = max(stamp, last)
+            stamps = last + ((stamp - last)
+                             * np.arange(1, count + 1, dtype=np.int64)
+                             // count)
+        return stamps
+
+    def store(self, values, stamp):
+        """ append samples to the ring, the last one read at stamp (ns) """
+        if not len(values):
+            # a decimating filter holds them back
+            return
+        last = None
+        if self.stamps.written:
+            last = int(self.stamps.buffer[(self.stamps.written - 1)
+                                          % self.stamps.size])
+        # the stamps first : the consumer reads them up to the ring cursor
+        self.stamps.write(self.spread(len(values), stamp, last))
+        self.ring.write(values)
+
+    def history(self, cursor):
+        """ samples stored since cursor, their stamps and the new cursor """
+        values, end = self.ring.read(cursor)
+        stamps, _ = self.stamps.read(end - len(values), end)
+        # stamps written ahead may have overwritten the oldest ones
+        count = min(len(values), len(stamps))
+        return values[len(values) - count:], stamps[len(stamps) - count:], end
+
+    def flush_filter(self):
+        """ store the samples an asynchronous filter has finished since the
+            last batch, return their count
+        """
+        if self.filter is None:
+            return 0
+        values = self.filter.flush()
+        if len(values):
+            self.store(values, time.monotonic_ns())
+        return len(values)
+
+    def apply_filter(self, values):
+        """ filter the valid samples, a failing filter leaves them as is """
+        if self.filter_reset:
+            self.filter_reset = False
+            self.filter.reset()
+        valid = values != BAD_SAMPLE
+        try:
+            filtered = self.filter.process(values[valid])
+        except Exception:
+            self.filter_errors += 1
+            return values
+        if len(filtered) != np.count_nonzero(valid):
+            # decimating filter, unreadable samples are dropped
+            return filtered
+        values = values.copy()
+        values[valid] = filtered
+        return values
+
+
+class AcquisitionEngine():
+    """ Read all devices from a single loop
+        usage : engine = AcquisitionEngine()
+                engine.add_device(device)
+                while running:
+                    engine.poll(0.1)
+        Readiness of the ports is multiplexed with a selector. Ports
+        without a file descriptor (Windows) are polled.
+        add_device / remove_device / set_binary can be called from any
+        thread, the selector and the readers are only touched by the
+        thread calling poll().
+        A device whose port fails (unplugged) is removed and closed, the
+        other ones are still read : (device, exception) is put in
+        'failures' for the caller to report.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.devices = []
+        self.polled = []
+        self.pending = queue.SimpleQueue()
+        self.failures = queue.SimpleQueue()
+        self.channels = 0
+
+    def add_device(self, device):
+        """ open the device port and start reading it """
+        device.open()
+        device.channel = self.channels
+        self.channels += 1
+        self.devices.append(device)
+        self.pending.put(('add', device))
+
+    def remove_device(self, device):
+        """ stop reading a device and close its port """
+        self.devices.remove(device)
+        self.pending.put(('remove', device))
+
+    def set_binary(self, device, binary):
+        """ ask a device for binary frames or ASCII lines """
+        self.pending.put(('binary' if binary else 'ascii', device))
+
+    def _update(self):
+        """ apply the pending requests """
+        while not self.pending.empty():
+            request, device = self.pending.get()
+            fd = device.fileno()
+            if request in ('binary', 'ascii'):
+                # a device removed meanwhile has its port closed
+                if device in self.devices and device.error is None:
+                    self.request(device, request == 'binary')
+            elif request == 'add':
+                if fd is not None:
+                    self.selector.register(fd, selectors.EVENT_READ, device)
+                else:
+                    self.polled.append(device)
+            else:
+                if device in self.polled:
+                    self.polled.remove(device)
+                elif fd is not None:
+                    self.selector.unregister(fd)
+                device.close()
+
+    def request(self, device, binary):
+        """ send a protocol request, drop the device if its port fails """
+        try:
+            if binary:
+                device.reader.request_binary()
+            else:
+                device.reader.request_ascii()
+        except (serial.SerialException, OSError) as error:
+            self.drop(device, error)
+
+    def read(self, device, polled=False):
+        """ read a device, drop it if its port fails """
+        try:
+            if polled and not device.serport.in_waiting:
+                return 0
+            return device.read()
+        except (serial.SerialException, OSError) as error:
+            self.drop(device, error)
+            return 0
+
+    def drop(self, device, error):
+        """ remove a failed device, its port is closed by _update() """
+        device.error = error
+        if device in self.devices:
+            self.remove_device(device)
+            self.failures.put((device, error))
+
+    def poll(self, timeout=0.1):
+        """ wait up to timeout for data and read all ready devices,
+            return the number of samples read
+        """
+        self._update()
+        count = 0
+        if self.polled:
+            for device in self.polled:
+                count += self.read(device, polled=True)
+            timeout = min(timeout, 0.005)
+        if self.selector.get_map():
+            for key, _ in self.selector.select(timeout):
+                if key.data.error is None:
+                    count += self.read(key.data)
+        elif not count:
+            time.sleep(timeout)
+        for key in self.selector.get_map().values():
+            key.data.flush_filter()
+        for device in self.polled:
+            device.flush_filter()
+        return count
+
+    def close(self):
+        """ close all devices (call it once poll() is no more called) """
+        for device in list(self.devices):
+            self.remove_device(device)
+        self._update()
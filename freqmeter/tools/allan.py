@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/allan.py
+ Version     : 1.0
+ Description : Overlapping Allan and modified Allan deviations of the
+               readings, live (incremental) or from a recording.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from tools.serialreader import BAD_SAMPLE, SLOW_GATE, FAST_GATE
+from tools.channelsink import ChannelSink
+from tools.recorder import read_header, RECORD_DTYPE, HEADER_DTYPE
+
+# Notations (NIST SP 1065) : y fractional frequency samples taken every tau0,
+# x phase = tau0 * cumsum(y) (N points), m averaging factor, tau = m * tau0
+#   AVAR(tau)    = sum((x[i+2m] - 2x[i+m] + x[i])^2) / (2 tau^2 (N - 2m))
+#   MODAVAR(tau) = sum((S[j+3m] - 3S[j+2m] + 3S[j+m] - S[j])^2)
+#                  / (2 m^2 tau^2 (N - 3m + 1))
+# S prefix sum of x : the inner sum of m second differences of the MDEV is
+# a third difference of S. Both only depend on differences of x, so x and
+# S can be shifted by any constant (they are, to keep their precision).
+
+
+def fractional(values, nominal):
+    """ fractional frequency of the readings """
+    return (values - nominal) / nominal
+
+
+def deviations(tau0, adev_sums, adev_counts, mdev_sums, mdev_counts):
+    """ dict of numpy arrays tau, adev, mdev, count (of ADEV terms), one item
+        per octave. A deviation without any term is nan.
+    """
+    octaves = len(adev_counts)
+    m = 2.0 ** np.arange(octaves)
+    tau = m * tau0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        adev = np.sqrt(adev_sums / (2 * tau ** 2 * adev_counts))
+        mdev = np.sqrt(mdev_sums / (2 * m ** 2 * tau ** 2 * mdev_counts))
+    return {'tau': tau, 'adev': adev, 'mdev': mdev,
+            'count': np.asarray(adev_counts)}
+
+
+def allan_deviation(y, tau0=1.0):
+    """ ADEV and MDEV of a whole run of fractional frequencies, at every
+        octave tau having at least one term
+        usage : result = allan_deviation(fractional(values, 10e6), 0.1)
+                result['tau'], result['adev'], result['mdev']
+        Vectorized with cumulative sums : a few passes over the data per
+        octave, 10M samples take a few seconds.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    # a constant frequency offset doesn't change anything but the precision
+    x = np.empty(y.size + 1)
+    x[0] = 0.0
+    np.cumsum(y - y.mean() if y.size else y, out=x[1:])
+    x *= tau0
+    s = np.empty(x.size + 1)
+    s[0] = 0.0
+    np.cumsum(x, out=s[1:])
+    points = x.size
+    # the terms of each octave are computed in place, no temporaries
+    buffer = np.empty(points + 1)
+    adev_sums, adev_counts, mdev_sums, mdev_counts = [], [], [], []
+    m = 1
+    while points - 2 * m >= 1:
+        terms = buffer[:points - 2 * m]
+        np.subtract(x[2 * m:], x[m:-m], out=terms)
+        terms -= x[m:-m]
+        terms += x[:-2 * m]
+        adev_sums.append(np.dot(terms, terms))
+        adev_counts.append(terms.size)
+        if points - 3 * m + 1 >= 1:
+            # S[j+3m] - S[j] - 3 (S[j+2m] - S[j+m])
+            terms = buffer[:points - 3 * m + 1]
+            np.subtract(s[2 * m:-m], s[m:-2 * m], out=terms)
+            terms *= -3
+            terms += s[3 * m:]
+            terms -= s[:-3 * m]
+            mdev_sums.append(np.dot(terms, terms))
+            mdev_counts.append(terms.size)
+        else:
+            mdev_sums.append(0.0)
+            mdev_counts.append(0)
+        m *= 2
+    return deviations(tau0, np.array(adev_sums), np.array(adev_counts),
+                      np.array(mdev_sums), np.array(mdev_counts))
+
+
+def recording_deviation(filename, channel=None):
+    """ ADEV and MDEV of a channel of a recording (File->Record), with the
+        fractional frequencies to the mean of the readings. The longest run
+        in the same mode and with the same multiplier is used, without the
+        unreadable samples. Raises ValueError if there is nothing to compute.
+        Returns (result, channel, tau0).
+    """
+    read_header(filename)
+    records = np.memmap(filename, dtype=RECORD_DTYPE, mode='r',
+                        offset=HEADER_DTYPE.itemsize)
+    if channel is None:
+        if not records.size:
+            raise ValueError(f'{filename} is empty')
+        channel = int(records['channel'][0])
+    records = records[records['channel'] == channel]
+    if not records.size:
+        raise ValueError(f'no channel {channel} in {filename}')
+    # runs of the same settings
+    settings = (records['mode'].astype(np.int64) << 16) | records['multiplier']
+    starts = np.flatnonzero(np.diff(settings)) + 1
+    bounds = np.concatenate(([0], starts, [records.size]))
+    longest = int(np.argmax(np.diff(bounds)))
+    run = records[bounds[longest]:bounds[longest + 1]]
+    values = run['value'][run['value'] != BAD_SAMPLE]
+    if values.size < 3:
+        raise ValueError(f'not enough samples in channel {channel}')
+    tau0 = FAST_GATE if run['mode'][0] else SLOW_GATE
+    return allan_deviation(fractional(values, values.mean()), tau0), \
+        channel, tau0
+
+
+class AllanDeviation():
+    """ Overlapping ADEV and MDEV updated by batches of fractional
+        frequencies, at octave taus up to 2**max_octave * tau0
+        usage : allan = AllanDeviation(tau0=0.1)
+                allan.update(y)
+                allan.result()['adev']
+        The sums of squares of every octave are updated with the new terms
+        only : a batch costs O(batch * octaves), whatever the length of the
+        run. The terms of an octave m need the phase 2m (ADEV) or 3m (MDEV)
+        points back : the last 3 * 2**max_octave phase points and their
+        prefix sums are kept in buffers which the new points are appended
+        to, compacted (and shifted to 0 for the precision) when full.
+    """
+
+    def __init__(self, tau0=1.0, max_octave=16):
+        self.tau0 = tau0
+        self.max_octave = max_octave
+        # phase points kept
+        self.keep = 3 * 2 ** max_octave
+        self.reset()
+
+    def reset(self):
+        octaves = self.max_octave + 1
+        self.adev_sums = np.zeros(octaves)
+        self.adev_counts = np.zeros(octaves, dtype=np.int64)
+        self.mdev_sums = np.zeros(octaves)
+        self.mdev_counts = np.zeros(octaves, dtype=np.int64)
+        # phase x[:points] (the first point is 0) and its prefix sum
+        # s[:points + 1]
+        self.x = np.zeros(2 * self.keep)
+        self.s = np.zeros(2 * self.keep + 1)
+        self.points = 1
+        self.samples = 0
+
+    def compact(self, size):
+        """ keep the last phase points only, with room for size more """
+        kept = min(self.points, self.keep)
+        capacity = max(2 * self.keep, kept + size)
+        x = np.empty(capacity)
+        np.subtract(self.x[self.points - kept:self.points],
+                    self.x[self.points - kept], out=x[:kept])
+        s = np.empty(capacity + 1)
+        s[0] = 0.0
+        np.cumsum(x[:kept], out=s[1:kept + 1])
+        self.x, self.s, self.points = x, s, kept
+
+    def update(self, y):
+        if not len(y):
+            return
+        if self.points + len(y) > self.x.size:
+            self.compact(len(y))
+        old = self.points
+        n = self.points = old + len(y)
+        x, s = self.x, self.s
+        np.cumsum(y, out=x[old:n])
+        x[old:n] *= self.tau0
+        x[old:n] += x[old - 1]
+        np.cumsum(x[old:n], out=s[old + 1:n + 1])
+        s[old + 1:n + 1] += s[old]
+        for octave in range(self.max_octave + 1):
+            m = 2 ** octave
+            # terms ending at a new phase point
+            first = max(old - 2 * m, 0)
+            if n - 2 * m > first:
+                terms = (x[first + 2 * m:n] - 2 * x[first + m:n - m]
+                         + x[first:n - 2 * m])
+                self.adev_sums[octave] += np.dot(terms, terms)
+                self.adev_counts[octave] += terms.size
+            first = max(old - 3 * m + 1, 0)
+            if n - 3 * m + 1 > first:
+                last = n - 3 * m + 1
+                terms = (s[first + 3 * m:last + 3 * m]
+                         - 3 * s[first + 2 * m:last + 2 * m]
+                         + 3 * s[first + m:last + m] - s[first:last])
+                self.mdev_sums[octave] += np.dot(terms, terms)
+                self.mdev_counts[octave] += terms.size
+        self.samples += len(y)
+
+    def result(self):
+        """ deviations of the octaves having terms """
+        octaves = int(np.count_nonzero(self.adev_counts))
+        return deviations(self.tau0, self.adev_sums[:octaves],
+                          self.adev_counts[:octaves],
+                          self.mdev_sums[:octaves],
+                          self.mdev_counts[:octaves])
+
+
+class Stability(ChannelSink):
+    """ Device sink computing the Allan deviations of each channel
+        usage : stability = Stability()
+                device.sinks.append(stability)   # push() called per batch
+                stability.result(channel)
+        The fractional frequencies are taken to 'nominal' (Hz), or to the
+        first reading when it is None. tau0 is the gate time. A channel
+        starts again when its gate or multiplier changes. Unreadable
+        samples are ignored.
+    """
+    restart = True
+
+    def __init__(self, nominal=None, max_octave=16):
+        super().__init__()
+        self.nominal = nominal
+        self.max_octave = max_octave
+        # nominal frequency of each channel
+        self.nominals = {}
+
+    def create(self, device):
+        self.nominals[device.channel] = self.nominal
+        return AllanDeviation(device.gate, self.max_octave)
+
+    def update(self, channel, values, stamps):
+        if not values.size:
+            return
+        if self.nominals[channel] is None:
+            self.nominals[channel] = float(values[0])
+        self.channels[channel].update(fractional(values,
+                                                 self.nominals[channel]))
+
+    def clear(self, channel):
+        self.channels[channel].reset()
+        self.nominals[channel] = self.nominal
+
+    def result(self, channel):
+        """ deviations of a channel (see deviations()), None before any
+            sample
+        """
+        with self.lock:
+            if channel not in self.channels:
+                return None
+            return self.channels[channel].result()
+
+    def set_nominal(self, nominal=None):
+        """ new nominal frequency, every channel starts again """
+        with self.lock:
+            self.nominal = nominal
+        self.restart_all()
+
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/allandialog.py
+ Version     : 1.0
+ Description : Dialog plotting the Allan deviations sigma(tau) of a channel
+               or of a recording.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import (QDialogButtonBox, QVBoxLayout,
+                             QHBoxLayout, QPushButton, QDoubleSpinBox,
+                             QLabel, QFileDialog, QMessageBox, QApplication)
+from PyQt5.QtGui import QIcon
+from tools.CustomWidgets import RefreshDialog
+from tools.allan import recording_deviation
+
+
+class AllanDialog(RefreshDialog):
+    """ Log-log plot of the overlapping ADEV and of the MDEV
+        usage : dialog = AllanDialog(stability)   # tools/allan.py
+                dialog.set_channel(device.channel)
+                dialog.show()
+        The live curves are refreshed every second while the dialog is
+        shown. Open... computes those of a recording instead.
+    """
+
+    def __init__(self, stability, parent=None):
+        super(AllanDialog, self).__init__('Allan deviation')
+        self.stability = stability
+        # result of a recording, displayed instead of the live one
+        self.recording = None
+        self.setupUI()
+
+    def setupUI(self):
+        self.setWindowIcon(QIcon('resources/images/icon.png'))
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        self.pw = pg.PlotWidget()
+        self.pw.setLogMode(True, True)
+        self.pw.showGrid(True, True)
+        self.pw.setLabel('left', 'sigma(tau)')
+        self.pw.setLabel('bottom', 'tau', 's')
+        self.pw.addLegend()
+        self.adevplot = self.pw.plot(pen=(100, 200, 100), symbol='o',
+                                     symbolSize=6, symbolBrush=(100, 200, 100),
+                                     name='ADEV')
+        self.mdevplot = self.pw.plot(pen=(200, 150, 50), symbol='t',
+                                     symbolSize=6, symbolBrush=(200, 150, 50),
+                                     name='MDEV')
+
+        # fractional frequencies to this frequency, 0 : to the first reading
+        self.nominalspin = QDoubleSpinBox()
+        self.nominalspin.setPrefix('Nominal ')
+        self.nominalspin.setSuffix(' Hz')
+        self.nominalspin.setDecimals(3)
+        self.nominalspin.setRange(0.0, 1e9)
+        self.nominalspin.setSpecialValueText('Nominal : first reading')
+        self.nominalspin.setKeyboardTracking(False)
+        self.nominalspin.valueChanged.connect(self.set_nominal)
+        self.resetBtn = QPushButton('Reset')
+        self.resetBtn.clicked.connect(self.reset)
+        self.openBtn = QPushButton(
+            QIcon('resources/images/blue-folder-open-document.png'), 'Open...')
+        self.openBtn.clicked.connect(self.open_recording)
+        self.liveBtn = QPushButton('Live')
+        self.liveBtn.setVisible(False)
+        self.liveBtn.clicked.connect(self.show_live)
+        self.info = QLabel()
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Close)
+        self.buttonBox.rejected.connect(self.reject)
+
+        btnlayout = QHBoxLayout()
+        btnlayout.addWidget(self.nominalspin)
+        btnlayout.addWidget(self.resetBtn)
+        btnlayout.addWidget(self.openBtn)
+        btnlayout.addWidget(self.liveBtn)
+        btnlayout.addWidget(self.info)
+        btnlayout.addStretch()
+        btnlayout.addWidget(self.buttonBox)
+        layout.addWidget(self.pw)
+        layout.addLayout(btnlayout)
+        self.resize(700, 480)
+
+    def set_channel(self, channel):
+        if self.recording is None:
+            super().set_channel(channel)
+        else:
+            self.channel = channel
+
+    def set_nominal(self, value):
+        self.stability.set_nominal(value if value > 0 else None)
+        self.refresh()
+
+    def reset(self):
+        self.stability.reset(self.channel)
+        self.refresh()
+
+    def draw(self, result):
+        """ plot the octaves having a deviation """
+        if result is None:
+            self.adevplot.setData([], [])
+            self.mdevplot.setData([], [])
+            self.info.setText('')
+            return
+        for plot, key in ((self.adevplot, 'adev'), (self.mdevplot, 'mdev')):
+            valid = np.isfinite(result[key]) & (result[key] > 0)
+            plot.setData(result['tau'][valid], result[key][valid])
+        samples = int(result['count'][0]) + 1 if len(result['count']) else 0
+        self.info.setText(f'{samples:,} samples')
+
+    def refresh(self):
+        if self.recording is None:
+            self.draw(self.stability.result(self.channel))
+
+    def open_recording(self):
+        """ deviations of a recording (File->Record) """
+        filename, _ = QFileDialog.getOpenFileName(
+            self, 'Open recording', '', 'Recordings (*.fqm);;All files (*)')
+        if filename:
+            self.load_recording(filename)
+
+    def load_recording(self, filename, channel=None):
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            result, channel, tau0 = recording_deviation(filename, channel)
+        except (ValueError, OSError) as e:
+            QMessageBox.critical(self, 'Open recording', str(e))
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.recording = result
+        self.liveBtn.setVisible(True)
+        self.resetBtn.setEnabled(False)
+        self.nominalspin.setEnabled(False)
+        self.setWindowTitle(f'Allan deviation - {filename} channel {channel}'
+                            f' (tau0 = {tau0:g} s)')
+        self.draw(result)
+
+    def show_live(self):
+        """ back to the live deviations """
+        self.recording = None
+        self.liveBtn.setVisible(False)
+        self.resetBtn.setEnabled(True)
+        self.nominalspin.setEnabled(True)
+        self.set_channel(self.channel)
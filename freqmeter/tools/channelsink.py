@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/channelsink.py
+ Version     : 1.0
+ Description : Base of the device sinks keeping a result for each
+               channel.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+from tools.serialreader import BAD_SAMPLE
+
+
+class ChannelSink():
+    """ Device sink keeping a result for each channel
+        usage : class Means(ChannelSink):
+                    def create(self, device):
+                        return RunningStats()
+                    def update(self, channel, values, stamps):
+                        self.channels[channel].update(values)
+                means = Means()
+                device.sinks.append(means)   # push() called per batch
+        push() drops the unreadable samples and updates the result of the
+        device channel under 'lock'. The result is created by create() at
+        the first batch and, with 'restart', again when the gate or the
+        multiplier of the channel changes, or after restart_all().
+        reset() clears the results with clear().
+    """
+    # a new result on gate or multiplier changes
+    restart = False
+
+    def __init__(self):
+        # per channel : result, (gate, multiplier)
+        self.channels = {}
+        self.settings = {}
+        self.lock = threading.Lock()
+
+    def create(self, device):
+        """ new result for the channel of device """
+        raise NotImplementedError
+
+    def update(self, channel, values, stamps):
+        """ add the readable samples of a batch to the result """
+        raise NotImplementedError
+
+    def clear(self, channel):
+        self.channels[channel].reset()
+
+    def push(self, device, values, stamps):
+        readable = values != BAD_SAMPLE
+        settings = (device.gate, device.multiplier)
+        with self.lock:
+            channel = device.channel
+            if channel not in self.channels or (
+                    self.restart and self.settings[channel] != settings):
+                self.channels[channel] = self.create(device)
+            self.settings[channel] = settings
+            self.update(channel, values[readable], stamps[readable])
+
+    def restart_all(self):
+        """ every channel starts again at its next batch """
+        with self.lock:
+            self.channels.clear()
+
+    def reset(self, channel=None):
+        """ clear the result of a channel (None : of all) """
+        with self.lock:
+            for key in self.channels:
+                if channel is None or key == channel:
+                    self.clear(key)
@@ -9,3 +9,31 @@ def filter(value):
     # Put your code here!
 
     return value
+
+# For heavy filters you can also write a batch version working on numpy
+# arrays, it is used instead of filter() when it is defined :
+#
+# import numpy as np
+#
+# def filter_batch(values):
+#     """ values is a numpy array of floats, return an array of the same size """
+#     return np.polyval([1e-6, 1.0, 0.0], values)
+#
+# A filter keeping a state (averages...) is written as a class named Filter,
+# it is used instead of both functions. reset() is called when the mode, the
+# scale or the connection changes :
+#
+# import numpy as np
+# from tools.filterapi import StreamFilter
+#
+# class Filter(StreamFilter):
+#     defaults = {'window': 10}
+#
+#     def reset(self):
+#         self.history = np.zeros(self.config['window'])
+#         self.count = 0
+#
+#     def step(self, value):
+#         self.history[self.count % len(self.history)] = value
+#         self.count += 1
+#         return self.history[:self.count].mean()
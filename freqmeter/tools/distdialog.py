@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/distdialog.py
+ Version     : 1.0
+ Description : Dialog showing the histogram and the quantiles of the
+               readings.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import pyqtgraph as pg
+from PyQt5.QtWidgets import (QDialogButtonBox, QVBoxLayout,
+                             QHBoxLayout, QPushButton, QCheckBox, QLabel,
+                             QFileDialog, QMessageBox)
+from PyQt5.QtGui import QIcon
+from tools.CustomWidgets import RefreshDialog
+from tools.distribution import Distribution, QUANTILES, EXTENSION
+
+
+class DistributionDialog(RefreshDialog):
+    """ Histogram and p50 / p95 / p99 of a channel or of all channels
+        usage : dialog = DistributionDialog(distributions)
+                dialog.set_channel(device.channel)
+                dialog.show()
+        Distributions saved by other sessions can be merged to the live one
+        (Merge...), the current one can be saved (Save...). Refreshed every
+        second while the dialog is shown.
+    """
+
+    def __init__(self, distributions, parent=None):
+        super(DistributionDialog, self).__init__('Distribution')
+        self.distributions = distributions
+        # distributions loaded with Merge...
+        self.merged = None
+        self.setupUI()
+
+    def setupUI(self):
+        self.setWindowIcon(QIcon('resources/images/icon.png'))
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        self.pw = pg.PlotWidget()
+        self.pw.showGrid(True, True)
+        self.pw.setLabel('left', 'Samples')
+        self.pw.setLabel('bottom', 'Frequency', 'Hz')
+        self.histplot = self.pw.plot(stepMode='center', fillLevel=0,
+                                     pen=(100, 200, 100),
+                                     brush=(100, 200, 100, 80))
+        self.lines = []
+        for fraction in QUANTILES:
+            line = pg.InfiniteLine(angle=90, pen=(200, 150, 50),
+                                   label=f'p{fraction * 100:g}',
+                                   labelOpts={'position': 0.9})
+            line.setVisible(False)
+            self.pw.addItem(line)
+            self.lines.append(line)
+
+        self.allchannels = QCheckBox('All channels')
+        self.allchannels.toggled.connect(self.refresh)
+        self.info = QLabel()
+        self.resetBtn = QPushButton('Reset')
+        self.resetBtn.clicked.connect(self.reset)
+        self.saveBtn = QPushButton('Save...')
+        self.saveBtn.clicked.connect(self.save)
+        self.mergeBtn = QPushButton('Merge...')
+        self.mergeBtn.clicked.connect(self.merge)
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Close)
+        self.buttonBox.rejected.connect(self.reject)
+
+        btnlayout = QHBoxLayout()
+        btnlayout.addWidget(self.allchannels)
+        btnlayout.addWidget(self.resetBtn)
+        btnlayout.addWidget(self.saveBtn)
+        btnlayout.addWidget(self.mergeBtn)
+        btnlayout.addWidget(self.buttonBox)
+        layout.addWidget(self.pw)
+        layout.addWidget(self.info)
+        layout.addLayout(btnlayout)
+        self.resize(700, 480)
+
+    def current(self):
+        """ live distribution shown, with the merged ones (None if empty) """
+        channel = None if self.allchannels.isChecked() else self.channel
+        distribution = self.distributions.snapshot(channel)
+        if self.merged is not None:
+            if distribution is None:
+                distribution = self.merged.copy()
+            else:
+                distribution.merge(self.merged)
+        return distribution
+
+    def refresh(self):
+        if self.allchannels.isChecked():
+            title = 'Distribution - all channels'
+        else:
+            title = f'Distribution - channel {self.channel}'
+        if self.merged is not None:
+            title += ' + merged'
+        self.setWindowTitle(title)
+        distribution = self.current()
+        if distribution is None or not distribution.sketch.count:
+            self.histplot.setData([0, 1], [0])
+            for line in self.lines:
+                line.setVisible(False)
+            self.info.setText('')
+            return
+        histogram = distribution.histogram
+        self.histplot.setData(histogram.edges(), histogram.counts)
+        quantiles = distribution.sketch.quantiles(QUANTILES)
+        for line, value in zip(self.lines, quantiles):
+            line.setValue(value)
+            line.setVisible(not math.isnan(value))
+        text = '   '.join(f'p{fraction * 100:g} = {value:.1f} Hz'
+                           for fraction, value in zip(QUANTILES, quantiles))
+        self.info.setText(f'{distribution.sketch.count:,} samples   {text}'
+                          f'   bin width = {histogram.width:g} Hz')
+
+    def reset(self):
+        """ reset the live distribution, forget the merged ones """
+        self.distributions.reset(
+            None if self.allchannels.isChecked() else self.channel)
+        self.merged = None
+        self.refresh()
+
+    def save(self):
+        distribution = self.current()
+        if distribution is None:
+            return
+        filename, _ = QFileDialog.getSaveFileName(
+            self, 'Save distribution', '',
+            f'Distributions (*{EXTENSION});;All files (*)')
+        if filename:
+            try:
+                distribution.save(filename)
+            except OSError as e:
+                QMessageBox.critical(self, 'Save distribution', str(e))
+
+    def merge(self):
+        filenames, _ = QFileDialog.getOpenFileNames(
+            self, 'Merge distributions', '',
+            f'Distributions (*{EXTENSION});;All files (*)')
+        for filename in filenames:
+            self.merge_file(filename)
+
+    def merge_file(self, filename):
+        try:
+            distribution = Distribution.load(filename)
+        except (ValueError, OSError) as e:
+            QMessageBox.critical(self, 'Merge distributions', str(e))
+            return
+        if self.merged is None:
+            self.merged = distribution
+        else:
+            self.merged.merge(distribution)
+        self.refresh()
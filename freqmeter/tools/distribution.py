@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/distribution.py
+ Version     : 1.0
+ Description : Streaming histogram and mergeable quantile sketch of the
+               readings.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import copy
+import math
+import numpy as np
+from tools.channelsink import ChannelSink
+
+# quantiles shown by default
+QUANTILES = (0.5, 0.95, 0.99)
+# saved distributions
+EXTENSION = '.npz'
+
+
+class Histogram():
+    """ Histogram with a fixed number of bins whose width doubles when a
+        value falls outside of them
+        usage : histogram = Histogram(128)
+                histogram.update(values)
+                edges, counts = histogram.edges(), histogram.counts
+        The first batch gives the range (bins at least 'resolution' wide).
+        Bins are merged to widen the range, so the memory never grows; the
+        bin edges stay multiples of the width.
+    """
+
+    def __init__(self, bins=128, resolution=1.0):
+        self.bins = bins
+        self.resolution = resolution
+        self.reset()
+
+    def reset(self):
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.low = None
+        self.width = None
+
+    def edges(self):
+        if self.low is None:
+            return np.zeros(self.bins + 1)
+        return self.low + self.width * np.arange(self.bins + 1)
+
+    def widen(self, minimum, maximum):
+        """ double the width until [minimum, maximum] fits """
+        high = self.low + self.bins * self.width
+        if minimum >= self.low and maximum < high:
+            return
+        width, low = self.width, self.low
+        while (minimum < low or maximum >= low + self.bins * width
+               or high > low + self.bins * width):
+            width *= 2
+            # the low edge stays a multiple of the width
+            low = math.floor(min(minimum, self.low) / width) * width
+        # old bin i goes to new bin (i + offset) // factor
+        offset = round((self.low - low) / self.width)
+        factor = round(width / self.width)
+        index = (np.arange(self.bins) + offset) // factor
+        self.counts = np.bincount(index, self.counts,
+                                  minlength=self.bins).astype(np.int64)
+        self.low, self.width = low, width
+
+    def update(self, values, weights=None):
+        if not len(values):
+            return
+        minimum, maximum = float(values.min()), float(values.max())
+        if self.low is None:
+            self.width = max((maximum - minimum) / self.bins, self.resolution)
+            # round the width to a power of 2 times the resolution
+            self.width = self.resolution * 2 ** math.ceil(
+                math.log2(self.width / self.resolution))
+            self.low = math.floor(minimum / self.width) * self.width
+        self.widen(minimum, maximum)
+        index = ((values - self.low) / self.width).astype(np.intp)
+        np.clip(index, 0, self.bins - 1, out=index)
+        counts = np.bincount(index, weights, minlength=self.bins)
+        self.counts += counts.astype(np.int64)
+
+    def merge(self, other):
+        """ add the counts of another histogram, at the centre of its bins
+            (exact when both have the same resolution and bins)
+        """
+        if other.low is None:
+            return
+        used = np.flatnonzero(other.counts)
+        if used.size:
+            centres = other.low + other.width * (used + 0.5)
+            self.update(centres, other.counts[used])
+
+
+class QuantileSketch():
+    """ KLL sketch of the distribution of the values (Karnin, Lang, Liberty)
+        usage : sketch = QuantileSketch(200)
+                sketch.update(values)
+                sketch.quantiles([0.5, 0.99])
+                sketch.merge(other_sketch)
+        Level h holds items standing for 2**h values each. When the items
+        don't fit in the capacity of the levels, the lowest full level is
+        sorted and every other item (random offset) is promoted, until
+        they fit. The size is O(k log(n / k)), the rank error about 1.7 / k.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self.levels = [np.empty(0)]
+        self.count = 0
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def size(self):
+        return sum(len(items) for items in self.levels)
+
+    def compress(self):
+        while self.size() > sum(map(self.capacity, range(len(self.levels)))):
+            level = 0
+            while len(self.levels[level]) <= self.capacity(level):
+                level += 1
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[level])
+            # an odd item stays at its level
+            kept, items = items[:len(items) % 2], items[len(items) % 2:]
+            promoted = items[self.rng.integers(2)::2]
+            self.levels[level] = kept
+            self.levels[level + 1] = np.concatenate(
+                (self.levels[level + 1], promoted))
+
+    def update(self, values):
+        if len(values):
+            self.levels[0] = np.concatenate((self.levels[0], values))
+            self.count += len(values)
+            self.compress()
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.count += other.count
+        self.compress()
+
+    def quantiles(self, fractions=QUANTILES):
+        """ values at the fractions (nan while empty) """
+        if not self.count:
+            return np.full(len(fractions), math.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(kept), 2 ** level)
+                                  for level, kept in enumerate(self.levels)])
+        order = np.argsort(items)
+        ranks = np.cumsum(weights[order])
+        index = np.searchsorted(ranks, np.asarray(fractions) * ranks[-1])
+        return items[order][np.minimum(index, len(items) - 1)]
+
+
+class Distribution():
+    """ Histogram and quantile sketch of the same values
+        usage : distribution = Distribution()
+                distribution.update(values)
+                distribution.save('session.npz')
+                distribution.merge(Distribution.load('other.npz'))
+    """
+
+    def __init__(self, bins=128, k=200, resolution=1.0):
+        self.histogram = Histogram(bins, resolution)
+        self.sketch = QuantileSketch(k)
+
+    def reset(self):
+        self.histogram.reset()
+        self.sketch.reset()
+
+    def update(self, values):
+        self.histogram.update(values)
+        self.sketch.update(values)
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+        self.sketch.merge(other.sketch)
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def save(self, filename):
+        histogram, sketch = self.histogram, self.sketch
+        levels = {f'level{level}': items
+                  for level, items in enumerate(sketch.levels)}
+        np.savez(filename, counts=histogram.counts,
+                 histogram=[np.nan if histogram.low is None else histogram.low,
+                            np.nan if histogram.width is None
+                            else histogram.width, histogram.resolution],
+                 sketch=[sketch.k, sketch.count, len(sketch.levels)],
+                 **levels)
+
+    @classmethod
+    def load(cls, filename):
+        """ raises ValueError (or OSError) if the file can't be read """
+        try:
+            with np.load(filename) as data:
+                low, width, resolution = data['histogram']
+                k, count, levels = (int(value) for value in data['sketch'])
+                distribution = cls(len(data['counts']), k, resolution)
+                histogram = distribution.histogram
+                histogram.counts = data['counts'].astype(np.int64)
+                if not math.isnan(low):
+                    histogram.low, histogram.width = float(low), float(width)
+                distribution.sketch.levels = [data[f'level{level}']
+                                              for level in range(levels)]
+                distribution.sketch.count = count
+        except KeyError as error:
+            raise ValueError(f'{filename} is not a distribution ({error})')
+        return distribution
+
+
+class Distributions(ChannelSink):
+    """ Device sink keeping the distribution of each channel
+        usage : distributions = Distributions()
+                device.sinks.append(distributions)   # push() per batch
+                distributions.snapshot(channel)      # a copy, None if empty
+                distributions.snapshot()             # all channels merged
+        Unreadable samples are ignored, the values are the raw readings.
+    """
+
+    def __init__(self, bins=128, k=200):
+        super().__init__()
+        self.bins = bins
+        self.k = k
+
+    def create(self, device):
+        # a count of the counter can't be split
+        return Distribution(self.bins, self.k, float(device.multiplier))
+
+    def update(self, channel, values, stamps):
+        self.channels[channel].update(values)
+
+    def snapshot(self, channel=None):
+        with self.lock:
+            if channel is not None:
+                if channel not in self.channels:
+                    return None
+                return self.channels[channel].copy()
+            merged = None
+            for distribution in self.channels.values():
+                if merged is None:
+                    merged = distribution.copy()
+                else:
+                    merged.merge(distribution)
+            return merged
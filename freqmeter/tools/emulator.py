@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/emulator.py
+ Version     : 1.0
+ Description : Virtual Arduino running arduino/freqmeter.ino behaviour on a
+               pseudo-terminal, for testing without hardware.
+
+ Usage       : python3 -m tools.emulator --signal noise --frequency 1e4
+               python3 -m tools.emulator --replay session.csv --speed 100
+               python3 -m tools.emulator --replay records/freqmeter-20201231
+               python3 -m tools.emulator --bench --devices 16 --rate 1000
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import glob
+import os
+import select
+import signal
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from tools.lod import recording_files
+from tools.recorder import load_recording, EXTENSION
+from tools.serialreader import (FRAME_DTYPE, FRAME_SIZE, FLAG_FAST,
+                                FLAG_ACK, FAST_SCALE, SLOW_GATE, FAST_GATE,
+                                BAD_SAMPLE, crc8)
+try:
+    import tty
+except ImportError:
+    # no pseudo-terminal on Windows, only emulated_ports() can be used
+    tty = None
+
+# the emulated ports are linked here so that the serial settings dialog
+# can list them
+LINK_PREFIX = os.path.join(tempfile.gettempdir(), 'ttyFREQMETER')
+
+# time the firmware takes to restart the counter with the new gate (s)
+DEAD_TIME = 20e-6
+
+# bytes waiting for the reader of the port, the samples sent beyond are
+# dropped (whole lines or frames)
+OUTPUT_LIMIT = 65536
+
+SIGNALS = ['constant', 'drift', 'noise', 'steps', 'dropouts']
+
+
+def emulated_ports():
+    """ list of the ports created by running emulators """
+    return sorted(glob.glob(LINK_PREFIX + '*'))
+
+
+class SignalGenerator():
+    """ Synthetic frequencies
+        usage : gen = SignalGenerator('noise', frequency=1e4)
+                hz = gen.frequencies(t)   # t : ndarray of emulated times (s)
+        A count of 0 (dropout) is returned as a frequency of 0.
+    """
+
+    def __init__(self, kind='constant', frequency=1000.0, drift=1e-6,
+                 noise=1.0, step=10.0, period=10.0, dropout=0.01,
+                 replay=None, seed=None):
+        if kind not in SIGNALS:
+            raise ValueError(f'unknown signal {kind}')
+        self.kind = kind
+        self.frequency = frequency
+        # relative drift per second, noise sigma (Hz), step size (Hz),
+        # step period (s) and probability of a dropout
+        self.drift = drift
+        self.noise = noise
+        self.step = step
+        self.period = period
+        self.dropout = dropout
+        self.replay = replay
+        self.rng = np.random.default_rng(seed)
+
+    def frequencies(self, t, index):
+        """ frequency of the samples taken at times t, index is the sample
+            number (used to replay a recording)
+        """
+        if self.replay is not None:
+            return self.replay[index % self.replay.size]
+        hz = np.full(t.size, float(self.frequency))
+        if self.kind == 'drift':
+            hz *= 1 + self.drift * t
+        elif self.kind == 'noise':
+            hz += self.rng.normal(0, self.noise, t.size)
+        elif self.kind == 'steps':
+            hz += self.step * (np.floor(t / self.period) % 2)
+        elif self.kind == 'dropouts':
+            hz[self.rng.random(t.size) < self.dropout] = 0
+        return hz
+
+
+def load_replay(filename, channel=0):
+    """ load a recorded session : the last column of a text (csv) file,
+        or the samples of a channel of a recording (see recording_files()
+        in tools/lod.py), as counted by the Arduino (without multiplier)
+    """
+    if filename.endswith(EXTENSION) or not os.path.isfile(filename):
+        names = recording_files(filename)
+        if not names:
+            return np.empty(0)
+        records = np.concatenate([load_recording(name) for name in names])
+        records = records[(records['channel'] == channel)
+                          & (records['value'] != BAD_SAMPLE)]
+        return records['value'] / records['multiplier']
+    values = []
+    with open(filename, 'r') as reader:
+        for line in reader:
+            try:
+                values.append(float(line.replace(';', ',').split(',')[-1]))
+            except ValueError:
+                # header or corrupted line
+                pass
+    return np.array(values)
+
+
+class VirtualArduino():
+    """ Emulate the firmware on a pseudo-terminal
+        usage : arduino = VirtualArduino(SignalGenerator('noise'))
+                arduino.start()
+                serial.Serial(arduino.port)    # or arduino.link
+                ...
+                arduino.stop()
+        speed divides the gate times (1x - 1000x), rate forces a number of
+        samples per second (load tests). acks=False emulates the firmwares
+        which don't acknowledge the mode changes.
+    """
+
+    def __init__(self, generator=None, speed=1.0, rate=None, link=True,
+                 acks=True):
+        self.generator = generator if generator is not None else SignalGenerator()
+        self.speed = speed
+        self.rate = rate
+        self.acks = acks
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.link = None
+        if link:
+            self.link = self._make_link()
+        self.fast = False
+        # mode asked for, applied at the end of the gate (None : no change)
+        self.pending_fast = None
+        self.binary = False
+        self.seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self.commands = b''
+        # bytes the pty didn't take yet
+        self.output = bytearray()
+        self.running = False
+        self.thread = None
+
+    def _make_link(self):
+        number = 0
+        while True:
+            link = f'{LINK_PREFIX}{number}'
+            try:
+                os.symlink(self.port, link)
+                return link
+            except FileExistsError:
+                # stale link left by a killed emulator
+                if not os.path.exists(link):
+                    os.remove(link)
+                    continue
+                number += 1
+
+    def gate(self):
+        """ gate time of the current mode (s) """
+        return FAST_GATE if self.fast else SLOW_GATE
+
+    def interval(self):
+        """ real time between two samples (s) """
+        if self.rate:
+            return 1.0 / self.rate
+        return self.gate() / self.speed
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        if self.link is not None and os.path.islink(self.link):
+            os.remove(self.link)
+        if self.master is not None:
+            os.close(self.master)
+        os.close(self.slave)
+
+    def unplug(self):
+        """ stop and close the master side : the port fails like that of
+            an unplugged counter
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+        self.master = None
+
+    def run(self):
+        """ send the samples due, then wait for a command or the next gate """
+        start = time.perf_counter()
+        # emulated time of the first sample of the current mode
+        origin = 0.0
+        due = 0
+        while self.running:
+            now = time.perf_counter()
+            count = int((now - start) / self.interval()) - due
+            if count > 0 and self.pending_fast is not None:
+                # the gate running when the command came ends with the old mode
+                count = 1
+            if count > 0:
+                index = self.sent + np.arange(count)
+                t = origin + (due + np.arange(1, count + 1)) * self.gate()
+                self.send(self.generator.frequencies(t, index))
+                due += count
+                if self.pending_fast is not None:
+                    # the new gate starts right after the old one
+                    origin += due * self.gate() + DEAD_TIME
+                    start += due * self.interval() + DEAD_TIME / self.speed
+                    due = 0
+                    self.fast, self.pending_fast = self.pending_fast, None
+                    if self.acks:
+                        self.acknowledge()
+            wait = start + (due + 1) * self.interval() - time.perf_counter()
+            waiting = [self.master] if self.output else []
+            ready, writable, _ = select.select([self.master], waiting, [],
+                                              max(wait, 0))
+            if writable:
+                self.flush()
+            if ready:
+                self.receive()
+
+    def receive(self):
+        """ read commands """
+        try:
+            self.commands += os.read(self.master, 256)
+        except (BlockingIOError, OSError):
+            return
+        while b'\n' in self.commands:
+            command, self.commands = self.commands.split(b'\n', 1)
+            command = command.strip()
+            if command in (b's', b'f'):
+                self.pending_fast = command == b'f'
+            elif command == b'b':
+                self.binary = True
+            elif command == b'a':
+                self.binary = False
+
+    def encode(self, hz):
+        """ bytes sent by the firmware for these frequencies """
+        gate = self.gate()
+        counts = np.rint(hz * gate).astype(np.uint32)
+        if not self.binary:
+            scale = FAST_SCALE if self.fast else 1
+            # the firmware numbers the samples in ASCII mode too
+            self.seq = (self.seq + counts.size) % 65536
+            return b''.join(b'%d\r\n' % (count * scale) for count in counts)
+        data = self.frames(counts, FLAG_FAST if self.fast else 0)
+        self.seq = (self.seq + counts.size) % 65536
+        return data
+
+    def frames(self, counts, flags):
+        """ binary frames numbered from seq """
+        frames = np.zeros(counts.size, dtype=FRAME_DTYPE)
+        frames['sync'] = 0xA55A
+        frames['seq'] = (self.seq + np.arange(counts.size)) % 65536
+        frames['flags'] = flags
+        frames['count'] = counts
+        raw = frames.view(np.uint8).reshape(-1, FRAME_SIZE)
+        raw[:, FRAME_SIZE - 1] = crc8(raw[:, 2:FRAME_SIZE - 1])
+        return raw.tobytes()
+
+    def acknowledge(self):
+        """ the mode change message : sequence number of the first sample of
+            the new gate, dead time (us)
+        """
+        dead = round(DEAD_TIME * 1e6)
+        if self.binary:
+            data = self.frames(np.array([dead]),
+                               FLAG_ACK | (FLAG_FAST if self.fast else 0))
+        else:
+            data = b'#%s %d %d\r\n' % (b'f' if self.fast else b's',
+                                        self.seq, dead)
+        self.write(data)
+
+    def send(self, hz):
+        data = self.encode(hz)
+        self.sent += hz.size
+        if not self.write(data):
+            # nobody reads the port : samples are lost like on a real UART
+            self.dropped += hz.size
+
+    def write(self, data):
+        """ send whole lines or frames, False if they are dropped """
+        if len(self.output) + len(data) > OUTPUT_LIMIT:
+            return False
+        self.output += data
+        self.flush()
+        return True
+
+    def flush(self):
+        """ write what the pty takes, the rest waits for the reader """
+        while self.output:
+            try:
+                written = os.write(self.master, self.output)
+            except BlockingIOError:
+                return
+            except OSError:
+                # the port is closed
+                self.output.clear()
+                return
+            del self.output[:written]
+
+
+def benchmark(devices=1, rate=1000, duration=5.0, binary=False):
+    """ measure the sustained sample rate of the acquisition engine
+        fed by emulated devices, return (samples read / s, samples sent / s)
+    """
+    from tools.acquisition import Device, AcquisitionEngine
+
+    engine = AcquisitionEngine()
+    arduinos = []
+    for _ in range(devices):
+        arduino = VirtualArduino(SignalGenerator('noise'), rate=rate,
+                                 link=False)
+        arduinos.append(arduino)
+        engine.add_device(Device(arduino.port, binary=binary))
+    for arduino in arduinos:
+        arduino.start()
+    read = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        read += engine.poll(0.1)
+    elapsed = time.perf_counter() - start
+    for arduino in arduinos:
+        arduino.running = False
+    sent = sum(arduino.sent for arduino in arduinos)
+    engine.close()
+    for arduino in arduinos:
+        arduino.stop()
+    return read / elapsed, sent / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m tools.emulator',
+                                     description='Virtual freqmeter Arduino')
+    parser.add_argument('--signal', choices=SIGNALS, default='constant')
+    parser.add_argument('--frequency', type=float, default=1000.0)
+    parser.add_argument('--noise', type=float, default=1.0,
+                        help='noise sigma (Hz)')
+    parser.add_argument('--drift', type=float, default=1e-6,
+                        help='relative drift per second')
+    parser.add_argument('--step', type=float, default=10.0,
+                        help='step size (Hz)')
+    parser.add_argument('--period', type=float, default=10.0,
+                        help='step period (s)')
+    parser.add_argument('--dropout', type=float, default=0.01,
+                        help='dropout probability')
+    parser.add_argument('--replay',
+                        help='replay a recorded session (csv or recording)')
+    parser.add_argument('--channel', type=int, default=0,
+                        help='channel replayed from a recording')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='emulation speed (1 to 1000)')
+    parser.add_argument('--rate', type=float,
+                        help='force a sample rate (samples/s)')
+    parser.add_argument('--bench', action='store_true',
+                        help='measure the acquisition sustained rate')
+    parser.add_argument('--devices', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--binary', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        read, sent = benchmark(args.devices, args.rate or 1000,
+                               args.duration, args.binary)
+        print(f'sent {sent:.0f} samples/s, read {read:.0f} samples/s')
+        return 0
+
+    replay = load_replay(args.replay, args.channel) if args.replay else None
+    if replay is not None and replay.size == 0:
+        parser.error(f'no sample found in {args.replay}')
+    generator = SignalGenerator(args.signal, args.frequency, args.drift,
+                                args.noise, args.step, args.period,
+                                args.dropout, replay)
+    arduino = VirtualArduino(generator, min(max(args.speed, 1), 1000),
+                             args.rate)
+    arduino.start()
+    # clean exit (link removed) when killed by a test script
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f'Virtual Arduino on {arduino.link} ({arduino.port}), Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        arduino.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/filterapi.py
+ Version     : 1.0
+ Description : Batch contract for the user filters of tools/datafilters.py.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import hashlib
+import time
+import tracemalloc
+import numpy as np
+
+# samples given to a new filter before it is used
+VALIDATION_SIZE = 1000
+# synthetic workload of the benchmark
+BENCHMARK_SIZE = 1000000
+
+
+class StreamFilter():
+    """ Base class of the stateful filters
+        usage : class Filter(StreamFilter):
+                    defaults = {'window': 16}
+                    def reset(self):
+                        self.history = np.zeros(self.config['window'])
+                    def step(self, value):
+                        ...
+                filtering = Filter({'window': 100})
+                filtered = filtering.process(values)
+        config is a dict completed by 'defaults'. The state lives in the
+        attributes set by reset(), which the acquisition calls on mode and
+        multiplier changes and on reconnections. process() calls step()
+        for each sample : override it with a vectorized version. It may
+        return fewer samples than it gets (decimation). An asynchronous
+        filter returns later the samples it holds back with flush().
+        close() is called when the filter is no more used.
+    """
+    defaults = {}
+
+    def __init__(self, config=None):
+        self.config = dict(self.defaults)
+        if config:
+            self.config.update(config)
+        self.reset()
+
+    def reset(self):
+        pass
+
+    def step(self, value):
+        return value
+
+    def process(self, values):
+        step = self.step
+        return np.fromiter((step(value) for value in values.tolist()),
+                           dtype=np.float64, count=len(values))
+
+    def __call__(self, values):
+        return self.process(values)
+
+    def flush(self):
+        return np.empty(0)
+
+    def close(self):
+        pass
+
+
+class ScalarAdapter(StreamFilter):
+    """ Filter calling a scalar filter(value) once per sample, and the
+        optional reset() function of the user module
+        usage : filtering = ScalarAdapter(filter)
+                filtered = filtering(values)
+    """
+
+    def __init__(self, function, reset=None):
+        self.step = function
+        self.reset_function = reset
+        super().__init__()
+
+    def reset(self):
+        if self.reset_function is not None:
+            self.reset_function()
+
+
+class BatchAdapter(ScalarAdapter):
+    """ Filter calling a batch filter_batch(values) of the user module """
+
+    def process(self, values):
+        return np.asarray(self.step(values), dtype=np.float64)
+
+
+class FilterChain(StreamFilter):
+    """ Filters applied one after the other
+        usage : chain = FilterChain([MovingAverage(), batch_filter(ns)])
+                filtered = chain(values)
+        timings holds [time (ns), samples in, samples out] for each stage.
+        configure(index, config) changes the config of a stage from any
+        thread : it is reset with it before the next batch, the other
+        stages keep their state.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.timings = [[0, 0, 0] for _ in stages]
+        # (index, config) not applied yet
+        self.changes = collections.deque()
+        super().__init__()
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def configure(self, index, config):
+        self.changes.append((index, config))
+
+    def apply_changes(self):
+        while self.changes:
+            index, config = self.changes.popleft()
+            stage = self.stages[index]
+            stage.config.update(config)
+            stage.reset()
+
+    def process(self, values):
+        self.apply_changes()
+        for stage, timing in zip(self.stages, self.timings):
+            if not len(values):
+                break
+            begin = time.perf_counter_ns()
+            timing[1] += len(values)
+            values = stage.process(values)
+            timing[0] += time.perf_counter_ns() - begin
+            timing[2] += len(values)
+        return values
+
+    def flush(self):
+        self.apply_changes()
+        values = np.empty(0)
+        for stage, timing in zip(self.stages, self.timings):
+            begin = time.perf_counter_ns()
+            if len(values):
+                timing[1] += len(values)
+                values = stage.process(values)
+            values = np.concatenate((values, stage.flush()))
+            timing[0] += time.perf_counter_ns() - begin
+            timing[2] += len(values)
+        return values
+
+    def close(self):
+        for stage in self.stages:
+            stage.close()
+
+
+def batch_filter(namespace, config=None):
+    """ return the filter of a user filter module (its namespace :
+        vars(module)) : an instance of its StreamFilter subclass 'Filter'
+        built with config, else filter_batch(values) or filter(value)
+        adapted to batches
+    """
+    filter_class = namespace.get('Filter')
+    if isinstance(filter_class, type) and issubclass(filter_class,
+                                                     StreamFilter):
+        return filter_class(config)
+    reset = namespace.get('reset')
+    if not callable(reset):
+        reset = None
+    if callable(namespace.get('filter_batch')):
+        return BatchAdapter(namespace['filter_batch'], reset)
+    return ScalarAdapter(namespace['filter'], reset)
+
+
+def workload(size):
+    """ synthetic samples : 1 kHz with 1 Hz of noise """
+    return np.random.default_rng(0).normal(1000.0, 1.0, size)
+
+
+def benchmark(namespace, size=BENCHMARK_SIZE, batch=1000, max_time=1.0):
+    """ time the filter of a namespace on 'size' samples given by batches,
+        return a dict : samples (processed), ns_per_sample, throughput
+        (samples/s) and peak_memory (bytes allocated by the filter).
+        Each of the two runs (timing, then memory with tracemalloc) stops
+        after max_time seconds : slow filters are extrapolated.
+    """
+    values = workload(size)
+    filtering = batch_filter(namespace)
+    elapsed = 0
+    samples = 0
+    deadline = time.perf_counter_ns() + max_time * 1e9
+    for start in range(0, size, batch):
+        chunk = values[start:start + batch]
+        begin = time.perf_counter_ns()
+        filtering.process(chunk)
+        end = time.perf_counter_ns()
+        elapsed += end - begin
+        samples += len(chunk)
+        if end > deadline:
+            break
+    filtering = batch_filter(namespace)
+    tracemalloc.start()
+    try:
+        deadline = time.perf_counter() + max_time
+        for start in range(0, samples, batch):
+            filtering.process(values[start:start + batch])
+            if time.perf_counter() > deadline:
+                break
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    ns_per_sample = elapsed / samples
+    return {'samples': samples, 'ns_per_sample': ns_per_sample,
+            'throughput': 1e9 / max(ns_per_sample, 1e-3),
+            'peak_memory': peak}
+
+
+def validate(namespace, size=VALIDATION_SIZE):
+    """ run the filter of a namespace on a sample batch, raises an
+        exception if it fails or returns something else than finite floats
+    """
+    filtering = batch_filter(namespace)
+    values = workload(size)
+    filtered = filtering.process(values)
+    if filtered.ndim != 1 or len(filtered) > size:
+        raise ValueError(f'the filter returns {filtered.shape} values '
+                         f'for {size} samples')
+    if not np.all(np.isfinite(filtered)):
+        raise ValueError('the filter returns NaN or infinite values')
+
+
+class FilterLoader():
+    """ Compile and validate the user filter file
+        usage : loader = FilterLoader('tools/datafilters.py')
+                namespace = loader.load()   # raises an exception on error
+                filtering = batch_filter(namespace)
+        The code objects are cached by source, 'namespace' and 'source'
+        keep the last valid filter module. With jit the functions are
+        compiled by numba when it is installed (see tools/filterjit.py),
+        'jit_errors' tells why Python is used instead.
+    """
+
+    def __init__(self, filename, jit=False):
+        self.filename = filename
+        self.jit = jit
+        self.jit_errors = []
+        self.codes = {}
+        # pass through until a filter is loaded
+        self.namespace = {'Filter': StreamFilter}
+        self.source = 'from tools.filterapi import StreamFilter as Filter\n'
+
+    def compile(self, source):
+        key = hashlib.sha1(source.encode()).hexdigest()
+        code = self.codes.get(key)
+        if code is None:
+            code = compile(source, self.filename, 'exec')
+            self.codes[key] = code
+        return code
+
+    def load(self, source=None):
+        """ run the source (default : the file) as a module, validate it
+            and return its namespace
+        """
+        if source is None:
+            with open(self.filename, encoding='utf-8') as file:
+                source = file.read()
+        namespace = {'__name__': 'datafilters', '__file__': self.filename}
+        exec(self.compile(source), namespace)
+        jit_errors = []
+        if self.jit:
+            try:
+                from tools.filterjit import jit_namespace
+                namespace = jit_namespace(source)
+                jit_errors = namespace['jit_errors']
+            except Exception as error:
+                jit_errors = [f'{type(error).__name__}: {error}']
+        validate(namespace)
+        self.namespace = namespace
+        self.source = source
+        self.jit_errors = jit_errors
+        return namespace
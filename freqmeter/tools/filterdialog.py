@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/filterdialog.py
+ Version     : 1.0
+ Description : Dialog editing the filter chain and showing the time spent
+               in each stage.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import copy
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import (QDialogButtonBox, QVBoxLayout,
+                             QHBoxLayout, QPushButton, QComboBox,
+                             QDoubleSpinBox, QTableWidget, QTableWidgetItem,
+                             QAbstractItemView, QHeaderView)
+from PyQt5.QtGui import QIcon, QValidator
+from tools.CustomWidgets import RefreshDialog
+from tools.streamfilters import BUILTIN_FILTERS
+
+# stage running the filter of tools/datafilters.py
+USER_FILTER = 'UserFilter'
+
+
+def stage_name(stage):
+    if stage['name'] == USER_FILTER:
+        return 'User filter'
+    return BUILTIN_FILTERS[stage['name']].name
+
+
+class ParameterSpinBox(QDoubleSpinBox):
+    """ Spin box of a filter parameter, integer or spanning decades
+        usage : spin = ParameterSpinBox()
+                spin.set_scientific(True)   # %g, the arrows step by decades
+    """
+
+    def __init__(self):
+        super(ParameterSpinBox, self).__init__()
+        self.scientific = False
+
+    def set_scientific(self, scientific):
+        self.scientific = scientific
+        # no rounding of the small values
+        self.setDecimals(323 if scientific else 0)
+
+    def number(self, text):
+        if text.startswith(self.prefix()):
+            text = text[len(self.prefix()):]
+        return float(text)
+
+    def textFromValue(self, value):
+        if self.scientific:
+            return f'{value:g}'
+        return super().textFromValue(value)
+
+    def valueFromText(self, text):
+        if self.scientific:
+            return self.number(text)
+        return super().valueFromText(text)
+
+    def validate(self, text, position):
+        if not self.scientific:
+            return super().validate(text, position)
+        try:
+            value = self.number(text)
+        except ValueError:
+            return QValidator.Intermediate, text, position
+        if self.minimum() <= value <= self.maximum():
+            return QValidator.Acceptable, text, position
+        return QValidator.Intermediate, text, position
+
+    def stepBy(self, steps):
+        if not self.scientific:
+            return super().stepBy(steps)
+        self.setValue(self.value() * 10.0 ** steps)
+
+
+class FilterChainDialog(RefreshDialog):
+    """ Ordered list of filter stages
+        usage : dialog = FilterChainDialog(timings=mainwindow.filter_timings)
+                dialog.set_stages([{'name': 'Hampel', 'config': {}}, ...])
+                dialog.stagesChanged.connect(callback)
+        A stage is {'name': class name in BUILTIN_FILTERS or USER_FILTER,
+        'config': StreamFilter config}. Every change is sent at once :
+        stageChanged(index, config) when only the parameter of a stage
+        changed, stagesChanged(stages) else.
+        timings() returns (time ns, samples in, samples out) per stage.
+    """
+
+    stagesChanged = pyqtSignal(list)
+    stageChanged = pyqtSignal(int, dict)
+
+    def __init__(self, parent=None, timings=None):
+        super(FilterChainDialog, self).__init__('Filter chain')
+        self.timings = timings
+        self.stages = []
+        self.setupUI()
+
+    def setupUI(self):
+        self.setWindowIcon(QIcon('resources/images/icon.png'))
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        self.table = QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels(
+            ['Stage', 'Parameter', 'Samples in', 'Samples out', 'ns/sample'])
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.ResizeToContents)
+        self.table.itemSelectionChanged.connect(self.select_stage)
+
+        self.stagecombo = QComboBox()
+        self.stagecombo.addItem('User filter', USER_FILTER)
+        for name, filter_class in BUILTIN_FILTERS.items():
+            self.stagecombo.addItem(filter_class.name, name)
+        self.addBtn = QPushButton('Add')
+        self.addBtn.clicked.connect(self.add_stage)
+        self.removeBtn = QPushButton('Remove')
+        self.removeBtn.clicked.connect(self.remove_stage)
+        self.upBtn = QPushButton('Up')
+        self.upBtn.clicked.connect(lambda: self.move_stage(-1))
+        self.downBtn = QPushButton('Down')
+        self.downBtn.clicked.connect(lambda: self.move_stage(1))
+        # parameter of the selected stage
+        self.parameterspin = ParameterSpinBox()
+        self.parameterspin.setEnabled(False)
+        self.parameterspin.setKeyboardTracking(False)
+        self.parameterspin.valueChanged.connect(self.set_parameter)
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Close)
+        self.buttonBox.rejected.connect(self.reject)
+
+        btnlayout = QHBoxLayout()
+        btnlayout.addWidget(self.stagecombo)
+        btnlayout.addWidget(self.addBtn)
+        btnlayout.addWidget(self.removeBtn)
+        btnlayout.addWidget(self.upBtn)
+        btnlayout.addWidget(self.downBtn)
+        btnlayout.addWidget(self.parameterspin)
+        btnlayout.addWidget(self.buttonBox)
+        layout.addWidget(self.table)
+        layout.addLayout(btnlayout)
+        self.resize(640, 300)
+
+    def set_stages(self, stages):
+        self.stages = copy.deepcopy(stages)
+        self.fill_table()
+
+    def fill_table(self, current=-1):
+        self.table.blockSignals(True)
+        self.table.setRowCount(len(self.stages))
+        for row, stage in enumerate(self.stages):
+            self.table.setItem(row, 0, QTableWidgetItem(stage_name(stage)))
+            if stage['name'] == USER_FILTER:
+                text = ''
+            else:
+                filter_class = BUILTIN_FILTERS[stage['name']]
+                value = stage['config'].get(
+                    filter_class.parameter,
+                    filter_class.defaults[filter_class.parameter])
+                text = f'{filter_class.parameter} = {value:g}'
+            self.table.setItem(row, 1, QTableWidgetItem(text))
+        self.table.blockSignals(False)
+        self.table.selectRow(current)
+        self.select_stage()
+        self.refresh()
+
+    def current_row(self):
+        rows = self.table.selectionModel().selectedRows()
+        return rows[0].row() if rows else -1
+
+    def changed(self, current):
+        self.fill_table(current)
+        self.stagesChanged.emit(copy.deepcopy(self.stages))
+
+    def add_stage(self):
+        self.stages.append({'name': self.stagecombo.currentData(),
+                            'config': {}})
+        self.changed(len(self.stages) - 1)
+
+    def remove_stage(self):
+        row = self.current_row()
+        if row >= 0:
+            del self.stages[row]
+            self.changed(min(row, len(self.stages) - 1))
+
+    def move_stage(self, offset):
+        row = self.current_row()
+        if row >= 0 and 0 <= row + offset < len(self.stages):
+            stages = self.stages
+            stages[row], stages[row + offset] = stages[row + offset], stages[row]
+            self.changed(row + offset)
+
+    def select_stage(self):
+        """ show the parameter of the selected stage """
+        row = self.current_row()
+        stage = self.stages[row] if row >= 0 else None
+        self.parameterspin.blockSignals(True)
+        if stage is None or stage['name'] == USER_FILTER:
+            self.parameterspin.setEnabled(False)
+            self.parameterspin.setPrefix('')
+        else:
+            filter_class = BUILTIN_FILTERS[stage['name']]
+            default = filter_class.defaults[filter_class.parameter]
+            integer = isinstance(default, int)
+            self.parameterspin.setEnabled(True)
+            self.parameterspin.setPrefix(f'{filter_class.parameter} ')
+            self.parameterspin.set_scientific(not integer)
+            self.parameterspin.setRange(filter_class.minimum,
+                                        filter_class.maximum)
+            self.parameterspin.setValue(
+                stage['config'].get(filter_class.parameter, default))
+        self.parameterspin.blockSignals(False)
+
+    def set_parameter(self, value):
+        row = self.current_row()
+        if row < 0 or self.stages[row]['name'] == USER_FILTER:
+            return
+        filter_class = BUILTIN_FILTERS[self.stages[row]['name']]
+        if isinstance(filter_class.defaults[filter_class.parameter], int):
+            value = int(value)
+        self.stages[row]['config'][filter_class.parameter] = value
+        self.fill_table(row)
+        self.stageChanged.emit(row, copy.deepcopy(self.stages[row]['config']))
+
+    def refresh(self):
+        """ cumulated samples and time of each stage """
+        if self.timings is None:
+            return
+        for row, (elapsed, inputs, outputs) in enumerate(self.timings()):
+            if row >= self.table.rowCount():
+                break
+            cost = f'{elapsed / inputs:.0f}' if inputs else ''
+            for column, text in ((2, f'{inputs:,}'), (3, f'{outputs:,}'),
+                                 (4, cost)):
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/filterjit.py
+ Version     : 1.0
+ Description : Optional numba compilation of the user filter functions.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# compiled filters : one module per source, numba caches next to it
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'freqmeter',
+                         'jit')
+
+
+def available():
+    return numba is not None
+
+
+def source_module(source, directory=CACHE_DIR):
+    """ import the source from a file named after its hash : numba keys its
+        on-disk cache by file, so a known source is never compiled again
+    """
+    key = hashlib.sha1(source.encode()).hexdigest()
+    filename = os.path.join(directory, f'filter_{key}.py')
+    if not os.path.exists(filename):
+        os.makedirs(directory, exist_ok=True)
+        temporary = f'{filename}.{os.getpid()}'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(source)
+        os.replace(temporary, filename)
+    spec = importlib.util.spec_from_file_location(f'freqmeter_filter_{key}',
+                                                  filename)
+    module = importlib.util.module_from_spec(spec)
+    # the cached functions are loaded back from this module name
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def message(error):
+    """ numba error without its colors, first lines only """
+    text = re.sub(r'\x1b\[[0-9;]*m', '', str(error)).strip()
+    return ' '.join(text.splitlines()[:2])
+
+
+def jit_namespace(source, directory=CACHE_DIR):
+    """ namespace of the user filter module where filter_batch(values) is
+        compiled with numba.njit, and filter(value) with numba.vectorize
+        (it becomes filter_batch when there is none). Functions numba can't
+        compile are left in Python and listed in namespace['jit_errors'].
+        Raises ImportError if numba isn't installed.
+    """
+    if numba is None:
+        raise ImportError('numba is not installed')
+    namespace = dict(vars(source_module(source, directory)))
+    errors = []
+    values = np.full(16, 1000.0)
+    batch = namespace.get('filter_batch')
+    if callable(batch):
+        try:
+            compiled = numba.njit(cache=True)(batch)
+            # compile now (or load the cache), not in the acquisition
+            compiled(values)
+            namespace['filter_batch'] = compiled
+        except Exception as error:
+            errors.append(f'filter_batch: {message(error)}')
+    scalar = namespace.get('filter')
+    if callable(scalar) and not callable(namespace.get('filter_batch')):
+        try:
+            compiled = numba.vectorize(['float64(float64)'],
+                                       cache=True)(scalar)
+            compiled(values)
+            namespace['filter_batch'] = compiled
+        except Exception as error:
+            errors.append(f'filter: {message(error)}')
+    namespace['jit_errors'] = errors
+    return namespace
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/filterworker.py
+ Version     : 1.0
+ Description : Run the user filter in a separate process.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+import numpy as np
+from tools.filterapi import StreamFilter, FilterLoader, batch_filter
+
+# directory of the 'tools' package, for the worker interpreter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def attach(name):
+    """ shared memory created by the application : the worker must not
+        let its own resource tracker free it when it exits
+    """
+    memory = shared_memory.SharedMemory(name)
+    if os.name != 'nt':
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+def worker(connection, source, filename, jit, config, input_name,
+           output_name, capacity):
+    """ process main : filter the batches found in the input shared memory
+        at the (offset, size) received, in order, and answer the number of
+        filtered values written at the same offset of the output memory
+        (or an error message). A config (dict) updates the config of the
+        filter and resets it, None stops. True is sent once the filter is
+        ready, the error message if it can't be loaded.
+    """
+    try:
+        filtering = batch_filter(FilterLoader(filename, jit).load(source),
+                                 config)
+    except Exception as error:
+        traceback.print_exc()
+        connection.send(f'{type(error).__name__}: {error}')
+        return
+    inputs = attach(input_name)
+    outputs = attach(output_name)
+    values_in = np.ndarray((capacity,), dtype=np.float64, buffer=inputs.buf)
+    values_out = np.ndarray((capacity,), dtype=np.float64, buffer=outputs.buf)
+    connection.send(True)
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            # the application is gone
+            break
+        if message is None:
+            break
+        if isinstance(message, dict):
+            filtering.config.update(message)
+            filtering.reset()
+            continue
+        offset, size = message
+        try:
+            filtered = filtering.process(values_in[offset:offset + size])
+            if len(filtered) > size:
+                raise ValueError('the filter returns more values than it gets')
+            values_out[offset:offset + len(filtered)] = filtered
+            connection.send(len(filtered))
+        except Exception as error:
+            connection.send(f'{type(error).__name__}: {error}')
+    del values_in, values_out
+    inputs.close()
+    outputs.close()
+
+
+def main():
+    """ worker interpreter : the arguments of worker() come on stdin, the
+        connection is a socket given by the application
+    """
+    arguments = pickle.load(sys.stdin.buffer)
+    if os.name == 'nt':
+        channel = socket.fromshare(arguments[0])
+    else:
+        channel = socket.socket(fileno=arguments[0])
+    worker(Connection(channel.detach()), *arguments[1:])
+
+
+class ProcessFilter(StreamFilter):
+    """ User filter run by a worker process
+        usage : filtering = ProcessFilter(loader.source, loader.filename)
+                filtered = filtering.process(values)
+                filtering.close()
+        process() never waits more than 'wait' seconds : it returns the
+        batches filtered so far, in order, flush() returns the following
+        ones. The output lags when the filter is slow. Batches go through
+        shared memory. A batch still not filtered after 'timeout' seconds
+        kills the worker, which is restarted (the start up of the worker
+        isn't timed); batches that can't be filtered (timeout, error, full
+        memory) are returned as they are and counted in 'skipped'.
+        A worker which fails 'attempts' times in a row before being ready
+        (the module doesn't load) isn't restarted anymore : 'error' tells
+        why and the batches are returned as they are.
+        reset() sends the config to the worker, FilterChain.configure()
+        changes reach it.
+        The worker is a new interpreter running this module : unlike a
+        multiprocessing child it doesn't import the application (Qt).
+    """
+
+    def __init__(self, source, filename, config=None, jit=False,
+                 capacity=2**17, timeout=2.0, wait=0.005, attempts=3):
+        self.source = source
+        self.filename = filename
+        self.jit = jit
+        self.capacity = capacity
+        self.timeout = timeout
+        self.wait = wait
+        self.attempts = attempts
+        self.skipped = 0
+        self.restarts = 0
+        # start up failures in a row, message of the last one
+        self.failures = 0
+        self.error = None
+        size = capacity * np.dtype(np.float64).itemsize
+        self.inputs = shared_memory.SharedMemory(create=True, size=size)
+        self.outputs = shared_memory.SharedMemory(create=True, size=size)
+        self.values_in = np.ndarray((capacity,), dtype=np.float64,
+                                    buffer=self.inputs.buf)
+        self.values_out = np.ndarray((capacity,), dtype=np.float64,
+                                     buffer=self.outputs.buf)
+        # batches sent : (offset, values, time sent)
+        self.pending = collections.deque()
+        self.position = 0
+        self.process_ = None
+        super().__init__(config)
+        self.start()
+
+    def start(self):
+        # not forked : the GUI and acquisition threads must not be copied
+        parent, child = socket.socketpair()
+        command = [sys.executable, '-m', 'tools.filterworker']
+        path = os.environ.get('PYTHONPATH')
+        environment = dict(os.environ, PYTHONPATH=(
+            ROOT + os.pathsep + path if path else ROOT))
+        if os.name == 'nt':
+            self.process_ = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                             env=environment)
+            handle = child.share(self.process_.pid)
+        else:
+            self.process_ = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                             env=environment,
+                                             pass_fds=(child.fileno(),))
+            handle = child.fileno()
+        try:
+            self.process_.stdin.write(pickle.dumps(
+                (handle, self.source, self.filename, self.jit, self.config,
+                 self.inputs.name, self.outputs.name, self.capacity)))
+            self.process_.stdin.close()
+        except OSError:
+            # the worker died at once, its batches will time out
+            pass
+        child.close()
+        self.connection = Connection(parent.detach())
+        self.ready = False
+
+    def stop(self):
+        """ ask the worker to stop, kill it if it doesn't """
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        try:
+            self.process_.wait(0.5)
+        except subprocess.TimeoutExpired:
+            self.process_.kill()
+            self.process_.wait()
+        self.connection.close()
+
+    def restart(self):
+        """ kill the worker (hung filter), its batches are skipped """
+        self.process_.kill()
+        self.process_.wait()
+        self.connection.close()
+        if self.failed():
+            # the filter can't start, no more worker
+            return
+        self.restarts += 1
+        self.start()
+
+    def failed(self):
+        """ True when the worker isn't restarted anymore """
+        return self.failures >= self.attempts
+
+    def reset(self):
+        if self.process_ is not None and not self.failed():
+            try:
+                self.connection.send(self.config)
+            except OSError:
+                pass
+
+    def allocate(self, size):
+        """ offset of a free area of the shared memory (None if full) """
+        offset = self.position
+        if offset + size > self.capacity:
+            offset = 0
+        for used, values, _ in self.pending:
+            if offset < used + len(values) and used < offset + size:
+                return None
+        self.position = offset + size
+        return offset
+
+    def collect(self, wait=0.0):
+        """ list of the batches filtered so far """
+        results = []
+        try:
+            while self.pending and self.connection.poll(wait):
+                answer = self.connection.recv()
+                if answer is True:
+                    # worker started : time the batches from now
+                    self.ready = True
+                    self.failures = 0
+                    self.error = None
+                    self.pending = collections.deque(
+                        (offset, values, time.monotonic())
+                        for offset, values, _ in self.pending)
+                    continue
+                if not self.ready:
+                    # the filter doesn't load, the worker exits
+                    self.error = answer
+                    continue
+                offset, values, _ = self.pending.popleft()
+                if isinstance(answer, str):
+                    self.skipped += len(values)
+                    results.append(values)
+                else:
+                    results.append(
+                        self.values_out[offset:offset + answer].copy())
+                wait = 0.0
+        except (EOFError, OSError):
+            if not self.ready:
+                # died at start up, its stderr tells more
+                self.failures += 1
+                if self.error is None:
+                    self.error = 'the worker exited at start up'
+            # the worker died : its batches time out now
+            offset, values, _ = self.pending[0]
+            self.pending[0] = (offset, values, 0)
+            self.ready = True
+        if self.pending and self.ready and (
+                time.monotonic() - self.pending[0][2] > self.timeout):
+            for _, values, _ in self.pending:
+                self.skipped += len(values)
+                results.append(values)
+            self.pending.clear()
+            self.restart()
+        return results
+
+    def process(self, values):
+        if self.failed():
+            self.skipped += len(values)
+            return values
+        results = []
+        for start in range(0, len(values), self.capacity // 4):
+            part = values[start:start + self.capacity // 4]
+            offset = self.allocate(len(part))
+            if offset is None:
+                results.extend(self.collect())
+                offset = self.allocate(len(part))
+            if offset is None:
+                # the worker is far behind
+                self.skipped += len(part)
+                results.append(part)
+                continue
+            self.values_in[offset:offset + len(part)] = part
+            self.pending.append((offset, part, time.monotonic()))
+            try:
+                self.connection.send((offset, len(part)))
+            except OSError:
+                # the worker died, the batch times out
+                self.pending[-1] = (offset, part, 0)
+        results.extend(self.collect(self.wait))
+        if not results:
+            return np.empty(0)
+        return np.concatenate(results)
+
+    def flush(self):
+        results = self.collect()
+        if not results:
+            return np.empty(0)
+        return np.concatenate(results)
+
+    def close(self):
+        """ stop the worker and free the shared memory """
+        if self.process_ is not None:
+            self.stop()
+            self.process_ = None
+            self.pending.clear()
+            del self.values_in, self.values_out
+            self.inputs.close()
+            self.inputs.unlink()
+            self.outputs.close()
+            self.outputs.unlink()
+
+
+if __name__ == '__main__':
+    main()
@@ -32,22 +32,52 @@
 
 from pyqtgraph.Qt import QtGui, QtCore
 from PyQt5.QtWidgets import (QWidget, QDialog, QDialogButtonBox, QVBoxLayout, QHBoxLayout, QApplication,
-                             QFrame, QCheckBox)
-from PyQt5.QtCore import QTimer
+                             QFrame, QCheckBox, QPushButton, QSpinBox, QFileDialog, QMessageBox,
+                             QComboBox)
+from PyQt5.QtCore import QTimer, Qt, QSettings, QRectF
 import numpy as np
 import pyqtgraph as pg
 from PyQt5.QtGui import QIcon, QPixmap
+from tools.lod import RecordingView, EnvelopeBuffer
+from tools.spectrum import Waterfall, decimated_rate
 import os
+import time
 
 class GraphDialog(QDialog):
     """ This class displays a dialog box with a graph """
     
-    # array to store incoming data (120 samples = 120s in slow mode or 12s in fast mode)
-    data = np.zeros((120,))
+    # samples kept for each channel (120 samples = 120s in slow mode or 12s in fast mode)
+    histories = [120, 1200, 12000, 120000, 1200000, 12000000]
+    # time shown (s) when the x axis is automatic, 0 : all the samples kept
+    windows = [0, 10, 60, 600, 3600, 86400]
+    appsettings = QSettings("C.E.D", "freqmeter")
+    # waterfall : samples per FFT and columns kept
+    waterfall_segment = 128
+    waterfall_columns = 1024
+    # its height (pixels), stamps measuring its rate (the last ones, at least
+    # the minimum)
+    waterfall_height = 200
+    rate_stamps = 256
+    rate_minimum = 16
      
     def __init__(self, parent=None):
         super(GraphDialog,self).__init__()
         self.setWindowTitle('Plot')
+        self.history = self.appsettings.value("History", self.histories[0],
+                                              type=int)
+        self.window = self.appsettings.value("Window", 0, type=int)
+        # host time (monotonic ns) of the x axis origin, the first sample
+        self.origin = None
+        # recording displayed instead of live data (see open_recording)
+        self.view = None
+        # spectrogram of one channel (see set_waterfall_channel), created
+        # once its rate is known
+        self.waterfall = None
+        self.waterfall_channel = 0
+        self.waterfall_gate_rate = None
+        # sample numbers : first one at this gate, next one to transform
+        self.waterfall_first = 0
+        self.waterfall_cursor = 0
         self.setupUI()
         self.setFixedSize(self.size())
         self.create_graphs()
@@ -74,17 +104,58 @@ class GraphDialog(QDialog):
         self.yaxisgrid.toggled.connect(self.set_axis_grid)
         self.xaxisgrid.toggled.connect(self.set_axis_grid)
         self.yaxislog.toggled.connect(self.set_axis_log)
+        ## recordings
+        self.openBtn = QPushButton(QIcon('resources/images/blue-folder-open-document.png'), 'Open...')
+        self.openBtn.clicked.connect(self.open_recording)
+        self.channelspin = QSpinBox()
+        self.channelspin.setPrefix('Channel ')
+        self.channelspin.setRange(0, 255)
+        self.channelspin.setVisible(False)
+        self.channelspin.valueChanged.connect(self.select_recording_channel)
+        self.liveBtn = QPushButton('Live')
+        self.liveBtn.setVisible(False)
+        self.liveBtn.clicked.connect(self.show_live)
+        self.waterfallbox = QCheckBox('Waterfall')
+        self.waterfallbox.toggled.connect(self.show_waterfall)
+        ## history depth
+        self.historycombo = QComboBox()
+        for depth in self.histories:
+            self.historycombo.addItem(f'{depth} samples', depth)
+        self.historycombo.setCurrentIndex(max(self.historycombo.findData(self.history), 0))
+        self.historycombo.activated.connect(self.set_history)
+        ## time window
+        self.windowcombo = QComboBox()
+        for seconds in self.windows:
+            self.windowcombo.addItem(f'last {seconds} s' if seconds else 'all', seconds)
+        self.windowcombo.setCurrentIndex(max(self.windowcombo.findData(self.window), 0))
+        self.windowcombo.activated.connect(self.set_window)
         ## pack them horizontally
+        self.btnlayout.addWidget(self.historycombo)
+        self.btnlayout.addWidget(self.windowcombo)
+        self.btnlayout.addWidget(self.openBtn)
+        self.btnlayout.addWidget(self.channelspin)
+        self.btnlayout.addWidget(self.liveBtn)
         self.btnlayout.addWidget(self.xaxisgrid)
         self.btnlayout.addWidget(self.yaxisgrid)
         self.btnlayout.addWidget(self.yaxislog)
+        self.btnlayout.addWidget(self.waterfallbox)
         self.btnlayout.addWidget(self.buttonBox)
         
         ## create a PlotWidget from pyqtgraph
         self.pw = pg.PlotWidget()
         self.pw.setLabel('left','Frequency', 'Hz')
-        self.pw.setLabel('bottom','Samples')
+        self.pw.setLabel('bottom', 'Time', 's')
         self.pw.showGrid(True, True)
+
+        ## spectrogram of the displayed channel, under the plot
+        self.wf = pg.PlotWidget()
+        self.wf.setLabel('left', 'Frequency', 'Hz')
+        self.wf.setLabel('bottom', 'Time', 's')
+        self.wfimage = pg.ImageItem(axisOrder='col-major')
+        self.wfimage.setColorMap(pg.colormap.get('viridis'))
+        self.wf.addItem(self.wfimage)
+        self.wf.setFixedHeight(self.waterfall_height)
+        self.wf.setVisible(False)
         
         ## using a frame as an horizontal line separator
         self.line = QFrame()
@@ -93,19 +164,239 @@ class GraphDialog(QDialog):
         
         # add all the stuff to layout
         self.layout.addWidget(self.pw)
+        self.layout.addWidget(self.wf)
         self.layout.addWidget(self.line)
         self.layout.addLayout(self.btnlayout)
         
     def create_graphs(self):
         """ create a new plot inside the PlotWidget """
-        self.p1 = self.pw.plot()        # create a new plot and set color to green
-        self.p1.setPen((100,200,100))
-        
-    def update_data(self,value):
-        """ setter called by parent window to update the display"""  
-        self.data[:-1] = self.data[1:]  # shift data in the array one sample left
-        self.data[-1] = value           # add new value
-        self.p1.setData(self.data)      # update display
+        # one array of samples and one plot for each channel (device)
+        self.data = []
+        self.plots = []
+        self.add_channel()
+        # plot of a recording
+        self.viewplot = self.pw.plot(connect='finite')
+        self.viewplot.setPen((100,200,100))
+        self.viewplot.setVisible(False)
+        self.pw.getViewBox().sigXRangeChanged.connect(self.update_view)
+
+    def add_channel(self):
+        """ create a new plot, the first one is green """
+        channel = len(self.plots)
+        self.data.append(EnvelopeBuffer(self.history, times=True))
+        plot = self.pw.plot()
+        plot.setPen((100,200,100) if channel == 0 else pg.intColor(channel))
+        plot.setVisible(self.view is None)
+        self.plots.append(plot)
+
+    def update_data(self,values,channel=0,stamps=None):
+        """ setter called by parent window to update the display
+            values can be a single sample or an array of samples, stamps
+            their host times (monotonic ns, now by default)
+        """
+        while channel >= len(self.plots):
+            self.add_channel()
+        values = np.atleast_1d(values)
+        if stamps is None:
+            stamps = np.full(values.size, time.monotonic_ns())
+        if self.origin is None and values.size:
+            self.origin = int(stamps[0])
+        self.data[channel].write(values, stamps)         # add new values
+        if self.view is None and self.isVisible():
+            self.draw_channel(channel)                   # update display
+        if channel == self.waterfall_channel:
+            self.update_waterfall()
+
+    def set_waterfall_channel(self, channel, rate):
+        """ spectrogram of channel counted at rate (Hz, the inverse of the
+            gate), it starts again when any of them changes
+        """
+        if (channel != self.waterfall_channel
+                or rate != self.waterfall_gate_rate):
+            self.waterfall_channel = channel
+            self.waterfall_gate_rate = rate
+            self.waterfall = None
+            self.waterfall_first = 0
+            if channel < len(self.data):
+                self.waterfall_first = self.data[channel].written
+            if self.wf.isVisible():
+                self.draw_waterfall()
+
+    def update_waterfall(self):
+        """ transform the new samples of the waterfall channel at their
+            rate : the gate one divided by the decimation of the filters,
+            measured on the stamps. The waterfall starts again when it
+            changes.
+        """
+        data = self.data[self.waterfall_channel]
+        if self.waterfall_gate_rate is None:
+            return
+        first = max(self.waterfall_first, data.oldest(),
+                    data.written - self.rate_stamps)
+        if data.written - first < self.rate_minimum:
+            return
+        rate = decimated_rate(self.waterfall_gate_rate,
+                              data.time(np.arange(first, data.written)))
+        if rate is None:
+            return
+        if self.waterfall is None or rate != self.waterfall.rate:
+            if self.waterfall is not None:
+                # the samples measured at the new rate
+                self.waterfall_first = first
+            self.waterfall = Waterfall(self.waterfall_segment,
+                                       self.waterfall_columns, rate)
+            self.waterfall_cursor = max(self.waterfall_first, data.oldest())
+        values, self.waterfall_cursor = data.read(self.waterfall_cursor)
+        if self.waterfall.update(values) and self.wf.isVisible():
+            self.draw_waterfall()
+
+    def show_waterfall(self, checked):
+        """ the size of the dialog is fixed : it grows by the waterfall
+            instead of squeezing the plot
+        """
+        if checked != self.wf.isHidden():
+            return
+        height = self.waterfall_height + self.layout.spacing()
+        self.wf.setVisible(checked)
+        self.setFixedSize(self.width(),
+                          self.height() + (height if checked else -height))
+        if checked:
+            self.draw_waterfall()
+
+    def draw_waterfall(self):
+        """ the ring is shown as it is, scaled to time and frequency """
+        if self.waterfall is None:
+            self.wfimage.clear()
+            return
+        image = self.waterfall.image()
+        computed = image[-min(self.waterfall.written, len(image)):]
+        finite = computed[np.isfinite(computed)]
+        if finite.size:
+            levels = np.percentile(finite, [5, 99.5])
+        else:
+            levels = (0, 1)
+        self.wfimage.setImage(image, autoLevels=False, levels=levels)
+        duration = self.waterfall.duration()
+        self.wfimage.setRect(QRectF(-duration, 0, duration,
+                                    self.waterfall.rate / 2))
+
+    def draw_channel(self, channel):
+        """ draw the min/max envelope of the visible samples, one point pair
+            per pixel column at most
+        """
+        data = self.data[channel]
+        if not data.written:
+            return
+        viewbox = self.pw.getViewBox()
+        if viewbox.autoRangeEnabled()[0]:
+            first, last = data.oldest(), data.written
+            if self.window:
+                # the window follows the newest sample of all channels
+                newest = max(int(buffer.time(buffer.written - 1))
+                             for buffer in self.data if buffer.written)
+                first = data.search(newest - self.window * 10**9)
+        else:
+            # seconds to sample numbers, one more sample on each side
+            t0, t1 = viewbox.viewRange()[0]
+            first = data.search(self.origin + t0 * 1e9) - 1
+            last = data.search(self.origin + t1 * 1e9) + 1
+        x, y = data.envelope(first, last, max(self.pw.width(), 1))
+        if x.size:
+            x = (data.time(x) - self.origin) / 1e9
+        self.plots[channel].setData(x, y)
+
+    def showEvent(self, event):
+        """ nothing is drawn while the dialog is hidden """
+        super(GraphDialog, self).showEvent(event)
+        if self.view is None:
+            for channel in range(len(self.plots)):
+                self.draw_channel(channel)
+        if self.waterfallbox.isChecked():
+            self.draw_waterfall()
+
+    def set_history(self, index):
+        """ change the number of samples kept, the newest ones are kept """
+        self.history = self.historycombo.itemData(index)
+        self.appsettings.setValue("History", self.history)
+        for channel, data in enumerate(self.data):
+            self.data[channel] = EnvelopeBuffer(self.history, times=True)
+            # keep the sample numbers
+            self.data[channel].written = data.oldest()
+            self.data[channel].write(data.ordered(), data.stamps())
+            if self.view is None:
+                self.draw_channel(channel)
+
+    def set_window(self, index):
+        """ change the time shown, the x axis becomes automatic """
+        self.window = self.windowcombo.itemData(index)
+        self.appsettings.setValue("Window", self.window)
+        if self.view is None:
+            self.pw.enableAutoRange()
+            for channel in range(len(self.plots)):
+                self.draw_channel(channel)
+
+    def open_recording(self):
+        """ display a recording (File->Record) instead of live data """
+        filenames, _ = QFileDialog.getOpenFileNames(self, 'Open recording', '',
+                                                    'Recordings (*.fqm);;All files (*)')
+        if filenames:
+            self.load_recording(filenames)
+
+    def load_recording(self, filenames, channel=None):
+        """ map the files of a recording, their pyramids are built on
+            first open
+        """
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            view = RecordingView(filenames, channel)
+        except (ValueError, OSError) as e:
+            QMessageBox.critical(self, 'Open recording', str(e))
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.view = None
+        self.channelspin.blockSignals(True)
+        self.channelspin.setValue(view.channel)
+        self.channelspin.blockSignals(False)
+        for plot in self.plots:
+            plot.setVisible(False)
+        self.viewplot.setVisible(True)
+        self.channelspin.setVisible(True)
+        self.liveBtn.setVisible(True)
+        self.pw.setLabel('bottom', 'Time', 's')
+        self.view = view
+        self.pw.setXRange(0, max(view.duration(), 1), padding=0)
+        self.update_view()
+
+    def select_recording_channel(self, channel):
+        if self.view is not None:
+            self.load_recording(self.view.filenames, channel)
+
+    def update_view(self):
+        """ load the part of the recording shown, at the level of detail
+            matching the plot width (or of the live data after a zoom)
+        """
+        if self.view is None:
+            if not self.pw.getViewBox().autoRangeEnabled()[0]:
+                for channel in range(len(self.plots)):
+                    self.draw_channel(channel)
+            return
+        t0, t1 = self.pw.getViewBox().viewRange()[0]
+        times, values = self.view.envelope(t0, t1, max(self.pw.width(), 1))
+        self.viewplot.setData(times, values)
+
+    def show_live(self):
+        """ back to live data """
+        self.view = None
+        self.viewplot.setVisible(False)
+        self.viewplot.setData([], [])
+        self.channelspin.setVisible(False)
+        self.liveBtn.setVisible(False)
+        self.pw.setLabel('bottom', 'Time', 's')
+        self.pw.enableAutoRange()
+        for channel, plot in enumerate(self.plots):
+            self.draw_channel(channel)
+            plot.setVisible(True)
         
     def set_axis_log(self):
         """ set log display mode on vertical axis """
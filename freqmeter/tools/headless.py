@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/headless.py
+ Version     : 1.0
+ Description : Command line data logger, doesn't import PyQt5 nor pyqtgraph.
+
+ Usage       : python3 -m freqmeter --headless --port /dev/ttyACM0
+                       --baud 57600 --mode fast --format csv --output log.csv
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import signal
+import sys
+import time
+import numpy as np
+import serial
+from tools.acquisition import Device, AcquisitionEngine
+from tools.serialreader import BAD_SAMPLE
+from tools.recorder import Recorder
+from tools.filterapi import batch_filter, FilterChain, FilterLoader
+from tools.filterworker import ProcessFilter
+from tools.streamfilters import BUILTIN_FILTERS
+
+# same choices as the scale combo box of the GUI
+SCALES = ["x1", "x2", "x4", "x8", "x16", "x32", "x64", "x128", "x256"]
+
+# record written by the binary format
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('channel', '<u2'),
+                         ('value', '<f8')])
+
+
+class CsvWriter():
+    """ time,channel,value lines """
+    binary = False
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.stream.write('time,channel,value\n')
+
+    def write(self, stamps, channel, values):
+        self.stream.write(''.join(f'{stamp:.6f},{channel},{value:.6f}\n'
+                                  for stamp, value in zip(stamps, values)))
+
+
+class JsonWriter():
+    """ one json object per line """
+    binary = False
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, stamps, channel, values):
+        self.stream.write(''.join(
+            json.dumps({'time': stamp, 'channel': channel, 'value': value})
+            + '\n'
+            for stamp, value in zip(stamps.tolist(), values.tolist())))
+
+
+class BinaryWriter():
+    """ RECORD_DTYPE records, read them back with
+        numpy.fromfile(filename, dtype=RECORD_DTYPE)
+    """
+    binary = True
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, stamps, channel, values):
+        records = np.empty(values.size, dtype=RECORD_DTYPE)
+        records['time'] = stamps
+        records['channel'] = channel
+        records['value'] = values
+        self.stream.write(records.tobytes())
+
+
+WRITERS = {'csv': CsvWriter, 'json': JsonWriter, 'binary': BinaryWriter}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python3 -m freqmeter --headless',
+        description="The poorman's frequency counter, command line logger")
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--port', action='append', required=True,
+                        help='serial port (repeat it for several devices)')
+    parser.add_argument('--baud', type=int, default=57600)
+    parser.add_argument('--mode', choices=['slow', 'fast'], default='slow')
+    parser.add_argument('--scale', choices=SCALES, default='x1',
+                        help='external frequency divider')
+    parser.add_argument('--binary-protocol', action='store_true',
+                        help='ask the Arduino for binary frames')
+    parser.add_argument('--filter', action='store_true',
+                        help='apply the filter of tools/datafilters.py')
+    parser.add_argument('--filter-process', action='store_true',
+                        help='run the --filter filter in a separate process')
+    parser.add_argument('--filter-jit', action='store_true',
+                        help='compile the --filter functions with numba')
+    parser.add_argument('--builtin-filter', choices=list(BUILTIN_FILTERS),
+                        help='built-in filter applied before --filter')
+    parser.add_argument('--filter-parameter', type=float,
+                        help='window, span, ratio or factor of the built-in '
+                             'filter')
+    parser.add_argument('--format', choices=list(WRITERS), default='csv')
+    parser.add_argument('--output', help='output file (default: stdout)')
+    parser.add_argument('--record', metavar='DIRECTORY',
+                        help='also record all samples in binary log files')
+    parser.add_argument('--duration', type=float,
+                        help='stop after this number of seconds')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.filter:
+        loader = FilterLoader('tools/datafilters.py', args.filter_jit)
+        try:
+            loader.load()
+        except Exception as error:
+            print(f'Error in {loader.filename}: {error}', file=sys.stderr)
+            return 1
+        for error in loader.jit_errors:
+            print(f'Not compiled, {error}', file=sys.stderr)
+
+    engine = AcquisitionEngine()
+    devices = []
+    for port in args.port:
+        device = Device(port, args.baud, binary=args.binary_protocol)
+        device.set_multiplier(SCALES.index(args.scale))
+        try:
+            engine.add_device(device)
+        except serial.SerialException as error:
+            print(f'Error opening port {port}: {error}', file=sys.stderr)
+            engine.close()
+            return 1
+        devices.append(device)
+
+    writer_class = WRITERS[args.format]
+    if args.output:
+        stream = open(args.output, 'wb' if writer_class.binary else 'w')
+    else:
+        stream = sys.stdout.buffer if writer_class.binary else sys.stdout
+    writer = writer_class(stream)
+
+    recorder = None
+    if args.record:
+        recorder = Recorder(args.record)
+        recorder.start()
+        for device in devices:
+            device.sinks.append(recorder)
+
+    for device in devices:
+        stages = []
+        if args.builtin_filter:
+            filter_class = BUILTIN_FILTERS[args.builtin_filter]
+            config = {}
+            if args.filter_parameter is not None:
+                config[filter_class.parameter] = args.filter_parameter
+            stages.append(filter_class(config))
+        if args.filter and args.filter_process:
+            stages.append(ProcessFilter(loader.source, loader.filename,
+                                        jit=loader.jit))
+        elif args.filter:
+            stages.append(batch_filter(loader.namespace))
+        if stages:
+            device.set_filter(FilterChain(stages))
+
+    # stop on Ctrl+C or kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    cursors = [device.ring.written for device in devices]
+    # the Arduino resets when the port opens : the mode is sent once it talks
+    mode_sent = [False] * len(devices)
+    bad = 0
+    failed = False
+    start = time.monotonic()
+    # the samples are stamped with the monotonic clock, written in seconds
+    # since the epoch
+    epoch = time.time() - time.monotonic_ns() * 1e-9
+    try:
+        while args.duration is None or time.monotonic() - start < args.duration:
+            engine.poll(0.1)
+            while not engine.failures.empty():
+                device, error = engine.failures.get()
+                print(f'Port {device.serport.port} failed: {error}',
+                      file=sys.stderr)
+                failed = True
+            if not engine.devices:
+                break
+            # a filter may also have finished samples without a read
+            for channel, device in enumerate(devices):
+                values, stamps, cursors[channel] = device.history(
+                    cursors[channel])
+                if not values.size:
+                    continue
+                if not mode_sent[channel]:
+                    if args.mode == 'fast':
+                        device.set_fast(True)
+                    mode_sent[channel] = True
+                readable = values != BAD_SAMPLE
+                valid = values[readable]
+                bad += values.size - valid.size
+                if valid.size:
+                    writer.write(epoch + stamps[readable] * 1e-9, channel,
+                                 valid)
+            stream.flush()
+    except (KeyboardInterrupt, SystemExit, BrokenPipeError):
+        pass
+    finally:
+        engine.close()
+        if recorder is not None and not recorder.stop():
+            print('Recorder: the last samples could not be written',
+                  file=sys.stderr)
+        if args.output:
+            stream.close()
+    if bad:
+        print(f'{bad} unreadable samples', file=sys.stderr)
+    return 1 if failed else 0
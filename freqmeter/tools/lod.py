@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/lod.py
+ Version     : 1.0
+ Description : Min/max level of detail : memory mapped view of big
+               recordings and pixel-aware decimation of live histories.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import glob
+import os
+import numpy as np
+from tools.recorder import (read_header, HEADER_DTYPE, RECORD_DTYPE,
+                           EXTENSION)
+from tools.serialreader import BAD_SAMPLE
+from tools.ringbuffer import RingBuffer
+
+# Pyramid file '<recording>.ch<N>.lod' : a LOD_HEADER_DTYPE header, the
+# length of each level (int64) then the levels. Level 0 is the samples
+# themselves (not stored), level k >= 1 holds the min and the max of each
+# block of 2**k samples. Bad samples are stored as NaN and ignored.
+LOD_MAGIC = b'FQMLOD'
+LOD_VERSION = 1
+LOD_HEADER_DTYPE = np.dtype([('magic', 'S6'), ('version', '<u2'),
+                             ('records', '<i8'), ('channel', '<u2'),
+                             ('levels', '<u2'), ('reserved', 'V4')])
+LOD_DTYPE = np.dtype([('min', '<f8'), ('max', '<f8')])
+# samples of one channel of a multi-channel recording ('<recording>.ch<N>')
+CHANNEL_DTYPE = np.dtype([('time', '<i8'), ('value', '<f8')])
+# records processed at once, bounds the memory used to build the pyramid
+CHUNK = 2**20
+# the pyramid stops when a level is this short
+MIN_LEVEL = 1024
+
+
+def level_sizes(size):
+    """ length of levels 1, 2... for size samples """
+    sizes = []
+    while size > MIN_LEVEL:
+        size = (size + 1) // 2
+        sizes.append(size)
+    return sizes
+
+
+def halve(minimum, maximum):
+    """ min and max of each pair of blocks (the last one may be alone) """
+    result = np.empty((len(minimum) + 1) // 2, dtype=LOD_DTYPE)
+    result['min'] = minimum[0::2]
+    result['max'] = maximum[0::2]
+    pairs = len(minimum) // 2
+    result['min'][:pairs] = np.fmin(result['min'][:pairs], minimum[1::2])
+    result['max'][:pairs] = np.fmax(result['max'][:pairs], maximum[1::2])
+    return result
+
+
+def recording_files(names):
+    """ files of a recording : a file name, a glob pattern, the prefix of
+        the files of a session ('records/freqmeter-20201231') or a list of
+        them, sorted by creation time
+    """
+    if isinstance(names, str):
+        names = [names]
+    found = set()
+    for name in names:
+        if any(character in name for character in '*?['):
+            found.update(glob.glob(name))
+        elif os.path.isfile(name):
+            found.add(name)
+        else:
+            found.update(glob.glob(glob.escape(name) + '*' + EXTENSION))
+    return sorted(found, key=lambda name: (int(read_header(name)['wall_ns']),
+                                           name))
+
+
+class RecordingFile():
+    """ Read only, memory mapped view of one channel of a recording file
+        usage : part = RecordingFile('records/freqmeter-20201231-120000.fqm')
+                times, values = part.envelope(t0, t1, width)
+        Times are in seconds from origin (the creation of the file by
+        default, monotonic ns). The pyramid is built beside the file on
+        first open (and when the file grew), later opens only map the
+        files : nothing is read before a part of the recording is displayed.
+    """
+
+    def __init__(self, filename, channel=None):
+        self.filename = filename
+        self.header = read_header(filename)
+        self.origin = int(self.header['mono_ns'])
+        # the last record may be incomplete while the file is recorded
+        count = ((os.path.getsize(filename) - HEADER_DTYPE.itemsize)
+                 // RECORD_DTYPE.itemsize)
+        if count > 0:
+            self.records = np.memmap(filename, dtype=RECORD_DTYPE, mode='r',
+                                     offset=HEADER_DTYPE.itemsize,
+                                     shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+        if channel is None:
+            channel = int(self.records['channel'][0]) if self.records.size else 0
+        self.channel = channel
+        self.rawname = f'{filename}.ch{channel}'
+        self.lodname = f'{filename}.ch{channel}.lod'
+        if not self._map_pyramid():
+            self.build()
+            self._map_pyramid()
+
+    def channels(self):
+        """ channels found in the recording (reads the whole file) """
+        found = set()
+        for start in range(0, self.records.size, CHUNK):
+            found.update(np.unique(
+                self.records['channel'][start:start + CHUNK]).tolist())
+        return sorted(found)
+
+    def _map_pyramid(self):
+        """ map an up to date pyramid file, return False if there is none """
+        if not os.path.exists(self.lodname):
+            return False
+        header = np.fromfile(self.lodname, dtype=LOD_HEADER_DTYPE, count=1)
+        if (header.size == 0 or header['magic'][0] != LOD_MAGIC
+                or header['version'][0] != LOD_VERSION
+                or header['records'][0] != self.records.size):
+            return False
+        self.samples = self._level0()
+        levels = int(header['levels'][0])
+        sizes = np.fromfile(self.lodname, dtype='<i8', count=levels,
+                            offset=LOD_HEADER_DTYPE.itemsize)
+        self.levels = [self.samples]
+        if sizes.sum():
+            data = np.memmap(self.lodname, dtype=LOD_DTYPE, mode='r',
+                             offset=LOD_HEADER_DTYPE.itemsize + sizes.nbytes,
+                             shape=(int(sizes.sum()),))
+            start = 0
+            for size in sizes:
+                self.levels.append(data[start:start + size])
+                start += size
+        return True
+
+    def _level0(self):
+        """ samples of the channel : the recording itself if it holds a
+            single channel, else the extracted channel file
+        """
+        if os.path.exists(self.rawname) and os.path.getsize(self.rawname):
+            return np.memmap(self.rawname, dtype=CHANNEL_DTYPE, mode='r')
+        if os.path.exists(self.rawname):
+            return np.empty(0, dtype=CHANNEL_DTYPE)
+        return self.records
+
+    def build(self):
+        """ build the pyramid, reading the recording by chunks """
+        records = self.records
+        single = all(np.all(records['channel'][start:start + CHUNK]
+                            == self.channel)
+                     for start in range(0, records.size, CHUNK))
+        if single:
+            if os.path.exists(self.rawname):
+                os.remove(self.rawname)
+        else:
+            # extract the channel samples in a file of their own
+            with open(self.rawname, 'wb') as writer:
+                for start in range(0, records.size, CHUNK):
+                    chunk = records[start:start + CHUNK]
+                    chunk = chunk[chunk['channel'] == self.channel]
+                    samples = np.empty(chunk.size, dtype=CHANNEL_DTYPE)
+                    samples['time'] = chunk['time']
+                    samples['value'] = chunk['value']
+                    writer.write(samples.tobytes())
+        samples = self._level0()
+
+        sizes = np.array(level_sizes(samples.size), dtype='<i8')
+        header = np.zeros(1, dtype=LOD_HEADER_DTYPE)
+        header['magic'] = LOD_MAGIC
+        header['version'] = LOD_VERSION
+        header['records'] = records.size
+        header['channel'] = self.channel
+        header['levels'] = sizes.size
+        with open(self.lodname, 'wb') as writer:
+            writer.write(header.tobytes())
+            writer.write(sizes.tobytes())
+        if not sizes.size:
+            return
+        data = np.memmap(self.lodname, dtype=LOD_DTYPE, mode='r+',
+                         offset=LOD_HEADER_DTYPE.itemsize + sizes.nbytes,
+                         shape=(int(sizes.sum()),))
+        # level 1 from the samples
+        for start in range(0, samples.size, 2 * CHUNK):
+            values = samples['value'][start:start + 2 * CHUNK]
+            values = np.where(values == BAD_SAMPLE, np.nan, values)
+            result = halve(values, values)
+            data[start // 2:start // 2 + result.size] = result
+        # each level from the previous one
+        start = 0
+        for previous in sizes[:-1]:
+            target = start + previous
+            for first in range(0, previous, 2 * CHUNK):
+                source = data[start + first:
+                              start + min(first + 2 * CHUNK, previous)]
+                result = halve(source['min'], source['max'])
+                data[target + first // 2:
+                     target + first // 2 + result.size] = result
+            start = target
+        data.flush()
+        del data
+
+    def time(self, index):
+        """ time of sample number index (s) """
+        return (int(self.samples['time'][index]) - self.origin) * 1e-9
+
+    def duration(self):
+        """ time of the last sample (s) """
+        return self.time(-1) if self.samples.size else 0.0
+
+    def search(self, t):
+        """ index of the first sample at or after time t (binary search on
+            the mapped file, only a few pages are read)
+        """
+        stamp = int(t * 1e9) + self.origin
+        times = self.samples['time']
+        return bisect.bisect_left(range(times.size), stamp,
+                                  key=lambda index: times[index])
+
+    def choose_level(self, first, last, width):
+        """ coarsest level still holding at least width points in
+            samples [first, last[
+        """
+        number = 0
+        while (number + 1 < len(self.levels)
+               and (last - first) >> (number + 1) >= width):
+            number += 1
+        return number
+
+    def envelope(self, t0, t1, width):
+        """ times and values to draw [t0, t1] on width pixels : each block
+            gives its min and its max so that no spike is lost
+        """
+        if not self.samples.size:
+            return np.empty(0), np.empty(0)
+        # one more sample on each side so that lines reach the borders
+        first = max(self.search(t0) - 1, 0)
+        last = min(self.search(t1) + 1, self.samples.size)
+        number = self.choose_level(first, last, width)
+        if number == 0:
+            samples = np.asarray(self.samples[first:last])
+            values = np.where(samples['value'] == BAD_SAMPLE, np.nan,
+                              samples['value'])
+            return (samples['time'] - self.origin) * 1e-9, values
+        first >>= number
+        last = min(((last - 1) >> number) + 1, self.levels[number].size)
+        level = np.asarray(self.levels[number][first:last])
+        # time of the first sample of each block
+        index = np.arange(first, last) << number
+        times = (self.samples['time'][index] - self.origin) * 1e-9
+        values = np.empty(2 * level.size)
+        values[0::2] = level['min']
+        values[1::2] = level['max']
+        return np.repeat(times, 2), values
+
+
+class RecordingView():
+    """ Read only view of one channel of a recording split in several
+        files by the recorder rotation
+        usage : view = RecordingView('records/freqmeter-20201231-*.fqm')
+                times, values = view.envelope(t0, t1, width)
+        Each file keeps its own pyramid (see RecordingFile), the envelopes
+        of the files shown are joined. Times are in seconds from the
+        creation of the first file, the files are placed with their wall
+        clock creation time so that sessions of several runs (whose
+        monotonic clocks differ) line up.
+    """
+
+    def __init__(self, filenames, channel=None):
+        self.filenames = recording_files(filenames)
+        if not self.filenames:
+            raise ValueError(f'no recording found for {filenames}')
+        self.parts = []
+        for filename in self.filenames:
+            part = RecordingFile(filename, channel)
+            channel = part.channel
+            self.parts.append(part)
+        self.channel = channel
+        first = int(self.parts[0].header['wall_ns'])
+        for part in self.parts:
+            part.origin -= int(part.header['wall_ns']) - first
+        self.origin = self.parts[0].origin
+
+    def channels(self):
+        """ channels found in the recording (reads all the files) """
+        return sorted(set().union(*(part.channels() for part in self.parts)))
+
+    def duration(self):
+        """ time of the last sample (s) """
+        return max(part.duration() for part in self.parts)
+
+    def envelope(self, t0, t1, width):
+        """ envelope of each file shown, width shared by their samples """
+        shown = []
+        for part in self.parts:
+            if not part.samples.size:
+                continue
+            count = part.search(t1) - part.search(t0)
+            if count or part.time(0) <= t0 <= part.duration():
+                shown.append((part, count))
+        total = sum(count for _, count in shown)
+        times, values = [np.empty(0)], [np.empty(0)]
+        for part, count in shown:
+            x, y = part.envelope(t0, t1, max(width * count // max(total, 1),
+                                              1))
+            times.append(x)
+            values.append(y)
+        return np.concatenate(times), np.concatenate(values)
+
+
+def minmax_columns(values, step):
+    """ min and max of each group of step values (the last one may be
+        shorter), interleaved : min0, max0, min1, max1...
+    """
+    count = -(-values.size // step)
+    padded = np.empty(count * step)
+    padded[:values.size] = values
+    # repeat the last value, it changes neither min nor max
+    padded[values.size:] = values[-1]
+    padded = padded.reshape(count, step)
+    result = np.empty(2 * count)
+    result[0::2] = padded.min(axis=1)
+    result[1::2] = padded.max(axis=1)
+    return result
+
+
+class EnvelopeBuffer(RingBuffer):
+    """ Ring buffer keeping the min and max of each block of 'block' samples
+        usage : history = EnvelopeBuffer(10000000)
+                history.write(values)
+                x, y = history.envelope(first, last, width)
+        x are sample numbers (0 is the first sample ever written). Drawing
+        any range costs about width * block operations at most : when a
+        pixel column holds more than a block, the block min/max are used
+        instead of the samples, no spike is lost.
+        With times=True the host time (monotonic ns) of each sample is kept
+        in a parallel int64 array : time() converts sample numbers, search()
+        finds the sample of a time by bisection.
+    """
+    block = 1024
+
+    def __init__(self, size, dtype=np.float64, times=False):
+        # whole number of blocks, so that blocks never straddle the end
+        size = -(-size // self.block) * self.block
+        super(EnvelopeBuffer, self).__init__(size, dtype)
+        self.mins = np.zeros(size // self.block)
+        self.maxs = np.zeros(size // self.block)
+        self.times = np.zeros(size, dtype=np.int64) if times else None
+
+    def write(self, values, stamps=None):
+        """ append an array of samples (and their times) and update the
+            blocks they touch
+        """
+        first = max(self.written, self.written + len(values) - self.size)
+        if self.times is not None:
+            self.times[np.arange(first, self.written + len(values))
+                       % self.size] = stamps[len(stamps) - (
+                           self.written + len(values) - first):]
+        super(EnvelopeBuffer, self).write(values)
+        for number in range(first // self.block,
+                            (self.written - 1) // self.block + 1):
+            start = number * self.block
+            end = min(start + self.block, self.written)
+            pos = start % self.size
+            samples = self.buffer[pos:pos + end - start]
+            self.mins[number % self.mins.size] = samples.min()
+            self.maxs[number % self.maxs.size] = samples.max()
+
+    def oldest(self):
+        """ number of the oldest sample still stored """
+        return max(self.written - self.size, 0)
+
+    def time(self, numbers):
+        """ times of stored samples """
+        return self.times[np.asarray(numbers) % self.size]
+
+    def stamps(self):
+        """ times of all the stored samples, oldest first """
+        return self.time(np.arange(self.oldest(), self.written))
+
+    def search(self, stamp):
+        """ number of the first stored sample at or after stamp (written if
+            none) : the ring is two sorted runs, each one is bisected
+        """
+        oldest = self.oldest()
+        first = oldest % self.size
+        head = self.times[first:min(first + self.written - oldest,
+                                    self.size)]
+        index = np.searchsorted(head, stamp)
+        if index == head.size:
+            tail = self.times[:self.written - oldest - head.size]
+            index += np.searchsorted(tail, stamp)
+        return oldest + int(index)
+
+    def envelope(self, first, last, width):
+        """ sample numbers and values to draw samples [first, last[ on width
+            pixel columns
+        """
+        first = max(int(first), self.oldest())
+        last = min(int(last), self.written)
+        if last - first <= 0:
+            return np.empty(0), np.empty(0)
+        step = -(-(last - first) // max(int(width), 1))
+        if step < 2:
+            x = np.arange(first, last)
+            return x, self.ordered(self.written - first)[:last - first]
+        if step < self.block:
+            samples = self.ordered(self.written - first)[:last - first]
+            y = minmax_columns(samples, step)
+        else:
+            # whole blocks : round the range and the step to blocks
+            blocks = step // self.block
+            step = blocks * self.block
+            first_block = first // self.block
+            if first_block * self.block < self.oldest():
+                # partly overwritten by the newest samples
+                first_block += 1
+            last_block = -(-last // self.block)
+            index = np.arange(first_block, last_block) % self.mins.size
+            mins = self.mins[index]
+            maxs = self.maxs[index]
+            count = -(-mins.size // blocks)
+            y = np.empty(2 * count)
+            y[0::2] = minmax_columns(mins, blocks)[0::2]
+            y[1::2] = minmax_columns(maxs, blocks)[1::2]
+            first = first_block * self.block
+        x = np.repeat(first + np.arange(y.size // 2) * step, 2)
+        return x, y
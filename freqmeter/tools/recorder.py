@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/recorder.py
+ Version     : 1.0
+ Description : Background recorder writing every sample to append-only
+               binary files.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import queue
+import threading
+import time
+import numpy as np
+from tools.serialreader import FAST_GATE
+
+# File layout : a HEADER_DTYPE header followed by RECORD_DTYPE records.
+# wall_ns / mono_ns are time.time_ns() and time.monotonic_ns() taken when the
+# file was created, they convert the record times to dates.
+MAGIC = b'FQMLOG'
+VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S6'), ('version', '<u2'),
+                         ('record_size', '<u4'), ('wall_ns', '<i8'),
+                         ('mono_ns', '<i8'), ('reserved', 'V4')])
+# time : host monotonic time of the sample (ns), mode : 1 in fast mode,
+# value : frequency with the multiplier applied (count = value / multiplier)
+RECORD_DTYPE = np.dtype([('time', '<i8'), ('value', '<f8'),
+                         ('multiplier', '<u2'), ('channel', 'u1'),
+                         ('mode', 'u1')])
+EXTENSION = '.fqm'
+
+
+def read_header(filename):
+    """ return the header of a recording, raises ValueError if the file
+        is not a recording
+    """
+    header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+    if (header.size == 0 or header['magic'][0] != MAGIC
+            or header['record_size'][0] != RECORD_DTYPE.itemsize):
+        raise ValueError(f'{filename} is not a freqmeter recording')
+    return header[0]
+
+
+def load_recording(filename):
+    """ load all records of a file in memory """
+    read_header(filename)
+    return np.fromfile(filename, dtype=RECORD_DTYPE,
+                       offset=HEADER_DTYPE.itemsize)
+
+
+class Recorder():
+    """ Record samples in the background
+        usage : recorder = Recorder('records')
+                recorder.start()
+                device.sinks.append(recorder)   # push() called per batch
+                recorder.stop()                 # False if the writer hangs
+        push() never blocks : when the queue is full the batch is dropped and
+        counted in 'dropped'. The writer thread drains the whole queue at
+        each wake up, writes it in one call and fsyncs at most every
+        sync_interval seconds. Files rotate by size (bytes) or age (s).
+    """
+
+    def __init__(self, directory, prefix='freqmeter', max_size=256 * 2**20,
+                 max_age=3600, queue_size=4096, sync_interval=1.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        self.max_age = max_age
+        self.sync_interval = sync_interval
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.written = 0
+        self.filename = None
+        self.file = None
+        self.thread = None
+
+    def push(self, device, values, stamps):
+        """ queue a batch of samples and their monotonic times (ns) """
+        try:
+            self.queue.put_nowait((stamps, device.channel, values,
+                                   device.gate == FAST_GATE,
+                                   device.multiplier))
+        except queue.Full:
+            self.dropped += len(values)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """ write what is queued and close the file, return False if the
+            writer didn't finish within timeout seconds (a blocked disk) :
+            the daemon thread is then abandoned
+        """
+        if self.thread is None:
+            return True
+        thread, self.thread = self.thread, None
+        end = time.monotonic() + timeout
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return False
+        thread.join(max(end - time.monotonic(), 0))
+        return not thread.is_alive()
+
+    def run(self):
+        last_sync = time.monotonic()
+        dirty = False
+        running = True
+        while running:
+            try:
+                batches = [self.queue.get(timeout=self.sync_interval)]
+            except queue.Empty:
+                batches = []
+            # drain everything queued meanwhile
+            while True:
+                try:
+                    batches.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batches:
+                running = False
+                batches = batches[:batches.index(None)]
+            if batches:
+                self.write(self.records(batches))
+                dirty = True
+            if dirty and time.monotonic() - last_sync >= self.sync_interval:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                last_sync = time.monotonic()
+                dirty = False
+        self.close()
+
+    @staticmethod
+    def records(batches):
+        """ build the records of a list of queued batches """
+        sizes = [len(values) for _, _, values, _, _ in batches]
+        records = np.empty(sum(sizes), dtype=RECORD_DTYPE)
+        records['time'] = np.concatenate([batch[0] for batch in batches])
+        records['value'] = np.concatenate([batch[2] for batch in batches])
+        records['channel'] = np.repeat([batch[1] for batch in batches], sizes)
+        records['mode'] = np.repeat([batch[3] for batch in batches], sizes)
+        records['multiplier'] = np.repeat([batch[4] for batch in batches],
+                                          sizes)
+        return records
+
+    def write(self, records):
+        if self.file is None or self.must_rotate():
+            self.rotate()
+        self.file.write(records.tobytes())
+        self.written += records.size
+
+    def must_rotate(self):
+        return (self.file.tell() >= self.max_size
+                or time.monotonic() - self.opened >= self.max_age)
+
+    def rotate(self):
+        """ close the current file and start a new one """
+        self.close()
+        name = time.strftime(f'{self.prefix}-%Y%m%d-%H%M%S')
+        filename = os.path.join(self.directory, name + EXTENSION)
+        number = 1
+        while os.path.exists(filename):
+            filename = os.path.join(self.directory,
+                                    f'{name}-{number}{EXTENSION}')
+            number += 1
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['record_size'] = RECORD_DTYPE.itemsize
+        header['wall_ns'] = time.time_ns()
+        header['mono_ns'] = time.monotonic_ns()
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        self.file.write(header.tobytes())
+        self.opened = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/ringbuffer.py
+ Version     : 1.0
+ Description : Preallocated numeric ring buffer used to hand samples over
+               from the acquisition thread to the GUI.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+
+class RingBuffer():
+    """ Single producer / single consumer ring buffer
+        usage : ring = RingBuffer(65536)
+                ring.write(values)                    # producer thread
+                values, cursor = ring.read(cursor)    # consumer thread
+        Only the producer moves 'written' (and only after the data is
+        copied), so the consumer never needs a lock. A consumer that falls
+        more than 'size' samples behind loses the oldest ones.
+    """
+
+    def __init__(self, size, dtype=np.float64):
+        self.size = size
+        self.buffer = np.zeros(size, dtype=dtype)
+        # total number of samples written since creation
+        self.written = 0
+
+    def write(self, values):
+        """ append an array of samples """
+        count = len(values)
+        values = values[-self.size:]
+        pos = (self.written + count - len(values)) % self.size
+        first = min(len(values), self.size - pos)
+        self.buffer[pos:pos + first] = values[:first]
+        self.buffer[:len(values) - first] = values[first:]
+        self.written += count
+
+    def read(self, cursor, end=None):
+        """ return the samples written since cursor (up to end) and the new
+            cursor
+        """
+        if end is None:
+            end = self.written
+        start = max(cursor, end - self.size)
+        values = self._copy(start, end)
+        # the producer may have overwritten the oldest samples meanwhile
+        overrun = self.written - self.size - start
+        if overrun > 0:
+            values = values[overrun:]
+        return values, end
+
+    def ordered(self, count=None):
+        """ the last count samples (all the stored ones by default), oldest
+            first : a view of the buffer when they are contiguous, else a
+            single copy
+        """
+        end = self.written
+        start = max(end - self.size, 0)
+        if count is not None:
+            start = max(start, end - count)
+        first = start % self.size
+        if first + end - start <= self.size:
+            return self.buffer[first:first + end - start]
+        return self._copy(start, end)
+
+    def _copy(self, start, end):
+        """ copy samples [start, end[ out of the buffer """
+        first = start % self.size
+        count = end - start
+        if first + count <= self.size:
+            return self.buffer[first:first + count].copy()
+        return np.concatenate((self.buffer[first:],
+                               self.buffer[:first + count - self.size]))
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/serialreader.py
+ Version     : 1.0
+ Description : Chunked serial reader, parses every complete line (ASCII
+               firmware) or every frame (binary firmware) of a chunk
+               in a single numpy pass.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import numpy as np
+
+# value stored for a line that can't be read (same as the old readline code)
+BAD_SAMPLE = -1.0
+
+# Binary frames sent by the firmware once the host asked for them with 'b\n'
+# (see arduino/freqmeter.ino). Little endian, 10 bytes :
+#   sync word 0xA55A | sequence number | flags | raw count | CRC-8
+FRAME_SYNC = b'\x5a\xa5'
+FRAME_DTYPE = np.dtype([('sync', '<u2'), ('seq', '<u2'), ('flags', 'u1'),
+                        ('count', '<u4'), ('crc', 'u1')])
+FRAME_SIZE = FRAME_DTYPE.itemsize
+# flags : bit 0 set when the frame was counted with the 100ms (fast) gate,
+# bit 1 set for the acknowledgement of a mode change : the sequence number is
+# the one of the first sample of the new gate (bit 0), the count is the dead
+# time between the gates (us)
+FLAG_FAST = 0x01
+FLAG_ACK = 0x02
+# ASCII acknowledgement : '#f <sequence> <dead time>' or '#s ...'
+ACK_PREFIX = b'#'
+# count multiplier for each gate, same as 'scale' in the firmware
+FAST_SCALE = 10
+# gate times (s) of the slow and fast modes
+SLOW_GATE = 1.0
+FAST_GATE = SLOW_GATE / FAST_SCALE
+# commands understood by the binary capable firmware
+BINARY_REQUEST = b'b\n'
+ASCII_REQUEST = b'a\n'
+# complete lines of digits : the firmware sends ASCII again
+ASCII_LINES = re.compile(rb'(?:^|\n)\d+\r?\n\d+\r?\n')
+
+
+def _crc8_table(poly=0x07):
+    """ lookup table for the CRC-8 (poly x^8+x^2+x+1) used by the firmware """
+    table = np.zeros(256, dtype=np.uint8)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly if crc & 0x80 else crc << 1) & 0xFF
+        table[byte] = crc
+    return table
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    """ CRC-8 of each row of a 2D uint8 array (one frame payload per row) """
+    crc = np.zeros(data.shape[0], dtype=np.uint8)
+    for column in range(data.shape[1]):
+        crc = CRC8_TABLE[crc ^ data[:, column]]
+    return crc
+
+
+class AsciiParser():
+    """ Parse the decimal ASCII stream sent by the Arduino
+        usage : parser = AsciiParser()
+                values = parser.feed(chunk)   # ndarray of float64
+                parser.acks                   # mode changes of the chunk
+        A partial line at the end of a chunk is kept for the next call.
+        The lines don't tell their gate : 'gates' is always None, 'acks'
+        lists the (index of the first sample of the new gate, sequence
+        number, fast, dead time in us) of the acknowledgement lines.
+    """
+
+    def __init__(self):
+        self.tail = b''
+        self.gates = None
+        self.acks = []
+
+    def reset(self):
+        """ forget the partial line """
+        self.tail = b''
+
+    def feed(self, chunk):
+        """ parse all complete lines of chunk, return them as an array """
+        self.acks = []
+        buf = self.tail + chunk
+        end = buf.rfind(b'\n')
+        if end < 0:
+            self.tail = buf
+            return np.empty(0)
+        self.tail = buf[end + 1:]
+        lines = np.char.strip(np.array(buf[:end].split(b'\n')))
+        if ACK_PREFIX in buf[:end]:
+            is_ack = np.char.startswith(lines, ACK_PREFIX)
+            for position in np.flatnonzero(is_ack):
+                ack = self._parse_ack(lines[position])
+                if ack is not None:
+                    # samples before the acknowledgement
+                    index = int(position - np.count_nonzero(is_ack[:position]))
+                    self.acks.append((index,) + ack)
+            lines = lines[~is_ack]
+        try:
+            return lines.astype(np.float64)
+        except ValueError:
+            # at least one line is corrupted, parse them one by one
+            return np.array([self._parse_line(line) for line in lines])
+
+    @staticmethod
+    def _parse_line(line):
+        try:
+            return float(line)
+        except ValueError:
+            return BAD_SAMPLE
+
+    @staticmethod
+    def _parse_ack(line):
+        """ (sequence, fast, dead time) of an acknowledgement line, None if
+            it is corrupted
+        """
+        fields = line[1:].split()
+        try:
+            return (int(fields[1]) % 65536, fields[0] == b'f',
+                    int(fields[2]))
+        except (IndexError, ValueError):
+            return None
+
+
+class FrameParser():
+    """ Parse the binary frames sent by the Arduino
+        usage : parser = FrameParser()
+                values = parser.feed(chunk)   # ndarray of float64
+        Frames with a bad CRC are skipped (the parser resynchronizes on the
+        next sync word), lost frames are counted from the sequence numbers.
+        After feed(), 'gates' is True for each value counted with the fast
+        gate and 'acks' lists the mode changes like AsciiParser.acks.
+    """
+
+    def __init__(self):
+        self.tail = b''
+        self.gates = np.empty(0, dtype=bool)
+        self.acks = []
+        self.last_seq = None
+        # number of frames missing in the sequence numbers
+        self.lost = 0
+        # number of frames rejected because of a bad CRC
+        self.rejected = 0
+
+    def reset(self):
+        """ forget the partial frame and the sequence number """
+        self.tail = b''
+        self.last_seq = None
+
+    def feed(self, chunk):
+        """ decode all complete frames of chunk, return their values """
+        frames = self.decode(chunk)
+        is_ack = (frames['flags'] & FLAG_ACK) != 0
+        self.acks = []
+        if np.any(is_ack):
+            for position in np.flatnonzero(is_ack):
+                frame = frames[position]
+                self.acks.append((
+                    int(position - np.count_nonzero(is_ack[:position])),
+                    int(frame['seq']), bool(frame['flags'] & FLAG_FAST),
+                    int(frame['count'])))
+            frames = frames[~is_ack]
+        self.gates = (frames['flags'] & FLAG_FAST) != 0
+        scale = np.where(self.gates, FAST_SCALE, 1)
+        return frames['count'] * scale.astype(np.float64)
+
+    def decode(self, chunk):
+        """ decode all complete frames of chunk, return a FRAME_DTYPE array """
+        raw = self.tail + chunk
+        buf = np.frombuffer(raw, dtype=np.uint8)
+        size = buf.size
+        if size < FRAME_SIZE:
+            self.tail = raw
+            return np.empty(0, dtype=FRAME_DTYPE)
+        # aligned stream (the usual case) : decode the buffer directly
+        complete = size - size % FRAME_SIZE
+        frames = np.frombuffer(raw, dtype=FRAME_DTYPE,
+                               count=complete // FRAME_SIZE)
+        if (np.all(frames['sync'] == 0xA55A)
+                and np.all(self._check(buf[:complete].reshape(-1, FRAME_SIZE)))):
+            self.tail = raw[complete:]
+            self._count_lost(frames)
+            return frames
+        # otherwise look for every sync word and keep the frames with a good CRC
+        last = size - FRAME_SIZE
+        starts = np.flatnonzero((buf[:last + 1] == 0x5A)
+                                & (buf[1:last + 2] == 0xA5))
+        windows = buf[starts[:, None] + np.arange(FRAME_SIZE)]
+        good = self._check(windows)
+        self.rejected += int(np.count_nonzero(~good))
+        starts = starts[good]
+        windows = windows[good]
+        if starts.size > 1 and np.any(np.diff(starts) < FRAME_SIZE):
+            # a sync word and a good CRC found inside a frame : keep the first
+            keep = []
+            end = 0
+            for index, start in enumerate(starts):
+                if start >= end:
+                    keep.append(index)
+                    end = start + FRAME_SIZE
+            starts = starts[keep]
+            windows = windows[keep]
+        end = starts[-1] + FRAME_SIZE if starts.size else 0
+        self.tail = raw[max(end, size - FRAME_SIZE + 1):]
+        frames = np.frombuffer(windows.tobytes(), dtype=FRAME_DTYPE)
+        self._count_lost(frames)
+        return frames
+
+    @staticmethod
+    def _check(windows):
+        """ True for each frame whose CRC matches """
+        return crc8(windows[:, 2:FRAME_SIZE - 1]) == windows[:, FRAME_SIZE - 1]
+
+    def _count_lost(self, frames):
+        # acknowledgements don't use a sequence number
+        seq = frames['seq'][(frames['flags'] & FLAG_ACK) == 0]
+        if seq.size == 0:
+            return
+        seq = seq.astype(np.int64)
+        if self.last_seq is not None:
+            seq = np.concatenate(([self.last_seq], seq))
+        self.lost += int(np.sum((np.diff(seq) - 1) % 65536))
+        self.last_seq = int(seq[-1])
+
+
+class SerialReader():
+    """ Drain a serial port in chunks
+        usage : reader = SerialReader(serport, binary=True)
+                values = reader.read_batch()
+        read_batch() waits for at least one byte (port timeout) then reads
+        everything waiting in the input buffer in a single call. 'gates'
+        (fast gate of each value, None when the firmware doesn't tell)
+        and 'acks' describe the last batch (see AsciiParser).
+        With binary=True the firmware is asked for binary frames; an old
+        firmware ignores the request and keeps on sending ASCII lines.
+        After request_ascii() the frames still in flight are dropped and
+        the sync words are no more looked for until binary frames are
+        requested again. Lines of digits without any valid frame (firmware
+        reset) also bring the reader back to ASCII.
+    """
+    # how many times we ask for binary frames before giving up
+    binary_retries = 3
+
+    def __init__(self, port, parser=None, binary=False):
+        self.port = port
+        self.parser = parser if parser is not None else AsciiParser()
+        self.binary = binary
+        self.retries = self.binary_retries
+        self.gates = None
+        self.acks = []
+        # frames received after request_ascii(), None when not draining
+        self.draining = None
+
+    def reset(self):
+        """ drop any partial data (call it after reconnecting) """
+        self.parser = AsciiParser()
+        self.retries = self.binary_retries
+        self.draining = None
+        if self.binary:
+            self.request_binary()
+
+    def request_binary(self):
+        """ ask the firmware to send binary frames """
+        self.binary = True
+        self.draining = None
+        self.port.write(BINARY_REQUEST)
+
+    def request_ascii(self):
+        """ ask the firmware to go back to ASCII lines """
+        if self.binary or self.is_binary():
+            self.draining = b''
+        self.binary = False
+        self.port.write(ASCII_REQUEST)
+        self.parser = AsciiParser()
+
+    def drain(self, chunk):
+        """ the part of chunk after the frames sent before the firmware
+            went back to ASCII : the lines start after the last frame, or
+            after the first newline when only the end of a frame is left
+        """
+        data = self.draining + chunk
+        last = data.rfind(FRAME_SYNC)
+        start = last + FRAME_SIZE if last >= 0 else 0
+        if start > len(data):
+            # the last frame isn't complete yet
+            self.draining = data[last:]
+            return b''
+        end = data.find(b'\n', start)
+        if end < 0:
+            # more frames may follow
+            self.draining = data[last:] if last >= 0 else b''
+            return b''
+        self.draining = None
+        return data[start:] if last >= 0 else data[end + 1:]
+
+    def is_binary(self):
+        """ True once binary frames are received """
+        return isinstance(self.parser, FrameParser)
+
+    def read_batch(self):
+        """ read all available bytes and return the parsed samples """
+        self.gates = None
+        self.acks = []
+        chunk = self.port.read(max(1, self.port.in_waiting))
+        if not chunk:
+            return np.empty(0)
+        waiting = self.port.in_waiting
+        if waiting:
+            chunk += self.port.read(waiting)
+        return self.parse(chunk)
+
+    def parse(self, chunk):
+        """ parse a chunk, switching to binary frames on the first sync word
+            (0x5A 0xA5 never appears in the ASCII stream)
+        """
+        if isinstance(self.parser, AsciiParser):
+            if self.draining is not None:
+                chunk = self.drain(chunk)
+            start = chunk.find(FRAME_SYNC) if self.binary else -1
+            if start >= 0:
+                values = self.parser.feed(chunk[:start])
+                acks = self.parser.acks
+                self.parser = FrameParser()
+                frames = self.parser.feed(chunk[start:])
+                # the gates of the ASCII lines are unknown
+                self.acks = acks + [(index + values.size, *ack)
+                                    for index, *ack in self.parser.acks]
+                return np.concatenate((values, frames))
+            values = self.parser.feed(chunk)
+            self.acks = self.parser.acks
+            # the Arduino resets when the port is opened and may have missed
+            # the request : ask again a few times
+            if self.binary and values.size and self.retries > 0:
+                self.retries -= 1
+                self.request_binary()
+            return values
+        values = self.parser.feed(chunk)
+        if (not values.size and not self.parser.acks
+                and ASCII_LINES.search(chunk)):
+            # no valid frame but lines : the firmware sends ASCII again
+            self.parser = AsciiParser()
+            return self.parse(chunk[chunk.find(b'\n') + 1:])
+        self.gates, self.acks = self.parser.gates, self.parser.acks
+        return values
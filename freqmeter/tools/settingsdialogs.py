@@ -37,6 +37,7 @@ from PyQt5.QtGui import (QIcon, QColor, QRegularExpressionValidator,
                          QIntValidator)
 import serial
 from tools.langtranslate import loadLanguage, load_section
+from tools.emulator import emulated_ports
 
 
 class SerialSettingsDialog(QDialog):
@@ -170,6 +171,9 @@ class SerialSettingsDialog(QDialog):
             ports = glob.glob('/dev/tty[A-Za-z]*')
         elif sys.platform.startswith('darwin'):
             ports = glob.glob('/dev/tty.*')
+        # virtual Arduinos (python3 -m tools.emulator)
+        if not sys.platform.startswith('win'):
+            ports += emulated_ports()
 
         result = []
         for port in ports:
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/spectrum.py
+ Version     : 1.0
+ Description : Welch power spectral density of the readings, updated as
+               the segments complete.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from tools.channelsink import ChannelSink
+
+# segment lengths offered, powers of 2 : the fastest sizes for the FFT
+SEGMENTS = (256, 1024, 4096, 16384)
+
+
+def fft_size(size):
+    """ smallest power of 2 not below size """
+    return 1 << max(int(size) - 1, 0).bit_length()
+
+
+@functools.lru_cache(maxsize=8)
+def window(size):
+    """ Hann window (periodic), computed once per size, read only """
+    values = np.hanning(size + 1)[:size]
+    values.flags.writeable = False
+    return values
+
+
+def split(data, segment, step):
+    """ complete segments of data starting every step samples (a 2D view)
+        and the samples left for the next segments
+    """
+    if data.size < segment:
+        return np.empty((0, segment)), data
+    count = (data.size - segment) // step + 1
+    frames = sliding_window_view(data, segment)[::step][:count]
+    return frames, data[count * step:]
+
+
+def periodograms(frames):
+    """ |rfft|^2 of each segment, mean removed and Hann windowed """
+    frames = frames - frames.mean(axis=1, keepdims=True)
+    frames *= window(frames.shape[1])
+    spectra = np.fft.rfft(frames, axis=1)
+    return np.square(spectra.real) + np.square(spectra.imag)
+
+
+def density_scale(segment, rate):
+    """ periodogram to one-sided density (units^2 / Hz) """
+    taper = window(segment)
+    return 2.0 / (rate * np.dot(taper, taper))
+
+
+def decimated_rate(rate, stamps):
+    """ sample rate of samples counted at rate (Hz) then decimated by a
+        whole factor (filters), measured on their stamps (monotonic ns).
+        None when the stamps don't span any time.
+    """
+    if len(stamps) < 2 or stamps[-1] <= stamps[0]:
+        return None
+    period = (int(stamps[-1]) - int(stamps[0])) * 1e-9 / (len(stamps) - 1)
+    return rate / max(round(rate * period), 1)
+
+
+class WelchPSD():
+    """ Welch estimate of the one-sided PSD of a sample stream
+        usage : welch = WelchPSD(1024, rate=10.0)
+                welch.update(values)
+                frequencies, psd = welch.frequencies(), welch.psd()
+        Each complete segment (Hann window, mean removed, 'overlap' of the
+        previous one) is transformed once with rfft and its periodogram
+        added to a running sum : the cost doesn't depend on the history,
+        only the samples of the last incomplete segment are kept.
+        The segment length is rounded up to a power of 2.
+    """
+
+    def __init__(self, segment=1024, rate=1.0, overlap=0.5):
+        self.segment = fft_size(segment)
+        self.rate = rate
+        self.step = max(int(self.segment * (1 - overlap)), 1)
+        self.scale = density_scale(self.segment, rate)
+        self.reset()
+
+    def reset(self):
+        self.sums = np.zeros(self.segment // 2 + 1)
+        self.segments = 0
+        self.pending = np.empty(0)
+
+    def update(self, values):
+        frames, self.pending = split(np.concatenate((self.pending, values)),
+                                     self.segment, self.step)
+        if len(frames):
+            self.sums += periodograms(frames).sum(axis=0)
+            self.segments += len(frames)
+
+    def frequencies(self):
+        return np.fft.rfftfreq(self.segment, 1.0 / self.rate)
+
+    def psd(self):
+        """ average of the periodograms (zeros before the first segment) """
+        if not self.segments:
+            return np.zeros(self.sums.size)
+        psd = self.sums * (self.scale / self.segments)
+        # DC and Nyquist have no negative frequency twin
+        psd[0] /= 2
+        if self.segment % 2 == 0:
+            psd[-1] /= 2
+        return psd
+
+
+class Waterfall():
+    """ Spectrogram : one PSD column (dB) per segment, in a 2D ring
+        usage : waterfall = Waterfall(128, columns=1024, rate=10.0)
+                if waterfall.update(values):        # new columns
+                    image_item.setImage(waterfall.image())
+        Every column is written twice, at i and i + columns, so the last
+        'columns' columns are always the contiguous view image() (oldest
+        first) : scrolling moves an offset, nothing is copied. Columns not
+        computed yet are nan.
+    """
+
+    def __init__(self, segment=128, columns=1024, rate=1.0, overlap=0.5):
+        self.segment = fft_size(segment)
+        self.columns = columns
+        self.rate = rate
+        self.step = max(int(self.segment * (1 - overlap)), 1)
+        self.scale = density_scale(self.segment, rate)
+        self.ring = np.empty((2 * columns, self.segment // 2 + 1),
+                             dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.ring.fill(np.nan)
+        self.written = 0
+        self.pending = np.empty(0)
+
+    def update(self, values):
+        """ number of new columns """
+        frames, self.pending = split(np.concatenate((self.pending, values)),
+                                     self.segment, self.step)
+        frames = frames[-self.columns:]
+        if not len(frames):
+            return 0
+        with np.errstate(divide='ignore'):
+            columns = 10 * np.log10(periodograms(frames) * self.scale)
+        index = (self.written + np.arange(len(frames))) % self.columns
+        self.ring[index] = columns
+        self.ring[index + self.columns] = columns
+        self.written += len(frames)
+        return len(frames)
+
+    def image(self):
+        """ the last columns, oldest first (a view of the ring) """
+        start = self.written % self.columns
+        return self.ring[start:start + self.columns]
+
+    def duration(self):
+        """ time covered by the image (s) """
+        return self.columns * self.step / self.rate
+
+
+class Spectra(ChannelSink):
+    """ Device sink computing the Welch PSD of each channel
+        usage : spectra = Spectra(1024)
+                device.sinks.append(spectra)   # push() called per batch
+                spectra.result(channel)   # frequencies, psd, segments, pending
+        The sample rate is the inverse of the gate time, a channel starts
+        again when its gate or multiplier changes. Unreadable samples are
+        ignored.
+    """
+    restart = True
+
+    def __init__(self, segment=1024):
+        super().__init__()
+        self.segment = segment
+
+    def create(self, device):
+        return WelchPSD(self.segment, 1.0 / device.gate)
+
+    def update(self, channel, values, stamps):
+        self.channels[channel].update(values)
+
+    def result(self, channel):
+        """ None before any sample """
+        with self.lock:
+            if channel not in self.channels:
+                return None
+            welch = self.channels[channel]
+            return (welch.frequencies(), welch.psd(), welch.segments,
+                    welch.pending.size)
+
+    def set_segment(self, segment):
+        """ new segment length, every channel starts again """
+        with self.lock:
+            self.segment = segment
+        self.restart_all()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/spectrumdialog.py
+ Version     : 1.0
+ Description : Dialog plotting the power spectral density of a channel.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pyqtgraph as pg
+from PyQt5.QtCore import QSettings
+from PyQt5.QtWidgets import (QDialogButtonBox, QVBoxLayout,
+                             QHBoxLayout, QPushButton, QComboBox, QLabel)
+from PyQt5.QtGui import QIcon
+from tools.CustomWidgets import RefreshDialog
+from tools.spectrum import SEGMENTS
+
+
+class SpectrumDialog(RefreshDialog):
+    """ Welch PSD of the frequency fluctuations of a channel
+        usage : dialog = SpectrumDialog(spectra)   # tools/spectrum.py
+                dialog.set_channel(device.channel)
+                dialog.show()
+        Refreshed every second while the dialog is shown, only the new
+        segments are computed.
+    """
+
+    appsettings = QSettings("C.E.D", "freqmeter")
+
+    def __init__(self, spectra, parent=None):
+        super(SpectrumDialog, self).__init__('Spectrum')
+        self.spectra = spectra
+        self.spectra.set_segment(self.appsettings.value(
+            "SpectrumSegment", self.spectra.segment, type=int))
+        self.setupUI()
+
+    def setupUI(self):
+        self.setWindowIcon(QIcon('resources/images/icon.png'))
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        self.pw = pg.PlotWidget()
+        self.pw.setLogMode(False, True)
+        self.pw.showGrid(True, True)
+        self.pw.setLabel('left', 'PSD', 'Hz²/Hz')
+        self.pw.setLabel('bottom', 'Frequency', 'Hz')
+        self.psdplot = self.pw.plot(pen=(100, 200, 100))
+
+        self.segmentcombo = QComboBox()
+        for segment in SEGMENTS:
+            self.segmentcombo.addItem(f'{segment} samples / segment', segment)
+        self.segmentcombo.setCurrentIndex(
+            max(self.segmentcombo.findData(self.spectra.segment), 0))
+        self.segmentcombo.activated.connect(self.set_segment)
+        self.resetBtn = QPushButton('Reset')
+        self.resetBtn.clicked.connect(self.reset)
+        self.info = QLabel()
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Close)
+        self.buttonBox.rejected.connect(self.reject)
+
+        btnlayout = QHBoxLayout()
+        btnlayout.addWidget(self.segmentcombo)
+        btnlayout.addWidget(self.resetBtn)
+        btnlayout.addWidget(self.info)
+        btnlayout.addStretch()
+        btnlayout.addWidget(self.buttonBox)
+        layout.addWidget(self.pw)
+        layout.addLayout(btnlayout)
+        self.resize(700, 480)
+
+    def set_segment(self, index):
+        segment = self.segmentcombo.itemData(index)
+        self.appsettings.setValue("SpectrumSegment", segment)
+        self.spectra.set_segment(segment)
+        self.refresh()
+
+    def reset(self):
+        self.spectra.reset(self.channel)
+        self.refresh()
+
+    def refresh(self):
+        result = self.spectra.result(self.channel)
+        if result is None:
+            self.psdplot.setData([], [])
+            self.info.setText('')
+            return
+        frequencies, psd, segments, pending = result
+        if segments:
+            # DC is the mean removed from the segments
+            self.psdplot.setData(frequencies[1:], psd[1:])
+            text = (f'{segments} segments, resolution '
+                    f'{frequencies[1]:.3g} Hz')
+        else:
+            self.psdplot.setData([], [])
+            text = f'first segment : {pending}/{len(frequencies) * 2 - 2}'
+        self.info.setText(text)
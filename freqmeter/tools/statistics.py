@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/statistics.py
+ Version     : 1.0
+ Description : Streaming statistics of the readings, updated by batches in
+               the acquisition thread.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import numpy as np
+from tools.channelsink import ChannelSink
+
+
+def summary(count, mean, m2, minimum, maximum):
+    """ dict of the statistics (std is the sample standard deviation) """
+    return {'count': count, 'mean': mean if count else math.nan,
+            'std': math.sqrt(m2 / (count - 1)) if count > 1 else math.nan,
+            'min': minimum if count else math.nan,
+            'max': maximum if count else math.nan}
+
+
+class RunningStats():
+    """ Count, mean, variance (Welford), min and max of all the samples
+        usage : stats = RunningStats()
+                stats.update(values)
+                stats.summary()['std']
+        A batch is reduced with numpy then merged (Chan et al. update),
+        the cost per sample is constant.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        # sum of the squared deviations from the mean
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        size = len(values)
+        if not size:
+            return
+        mean = float(values.mean())
+        m2 = float(np.square(values - mean).sum())
+        count = self.count + size
+        delta = mean - self.mean
+        self.mean += delta * size / count
+        self.m2 += m2 + delta * delta * self.count * size / count
+        self.count = count
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def summary(self):
+        return summary(self.count, self.mean, self.m2, self.min, self.max)
+
+
+def merge(counts, means, m2s):
+    """ count, mean and m2 of several parts given theirs (Chan et al.) """
+    count = int(counts.sum())
+    mean = float((counts * means).sum() / count)
+    m2 = float(m2s.sum() + (counts * np.square(means - mean)).sum())
+    return count, mean, m2
+
+
+class SuffixMinimum():
+    """ Minimum of the samples from any number on, without scanning them
+        usage : minimum = SuffixMinimum()
+                minimum.update(values, number, oldest)  # number of values[0]
+                minimum.query(number)       # min from sample number on
+        Monotonic queue : only the samples smaller than all the following
+        ones are kept, their numbers and values both increase. A batch
+        finds its own with an accumulated minimum and replaces the queued
+        samples which aren't smaller than its minimum, those older than
+        oldest are dropped. A query is a bisection.
+    """
+
+    def __init__(self):
+        self.numbers = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0)
+
+    def update(self, values, number, oldest):
+        following = np.minimum.accumulate(values[::-1])[::-1]
+        kept = np.empty(len(values), dtype=bool)
+        np.less(values[:-1], following[1:], out=kept[:-1])
+        kept[-1] = True
+        cut = np.searchsorted(self.values, following[0])
+        first = np.searchsorted(self.numbers[:cut], oldest)
+        self.numbers = np.concatenate((self.numbers[first:cut],
+                                       number + np.flatnonzero(kept)))
+        self.values = np.concatenate((self.values[first:cut], values[kept]))
+
+    def query(self, number):
+        return float(self.values[np.searchsorted(self.numbers, number)])
+
+
+class WindowStats():
+    """ Statistics of the last samples, by count or by duration
+        usage : window = WindowStats(65536)
+                window.update(values, stamps)   # monotonic ns
+                window.summary(count=1000)      # last 1000 samples
+                window.summary(seconds=10)      # last 10 s (at most size)
+        The ring is cut in blocks of 'block' samples whose mean and sum of
+        squared deviations are kept once complete : a window merges its
+        whole blocks and reduces the samples of the partial ones, in
+        O(size / block + block) and without cancellation after a jump of
+        frequency. Min and max come from monotonic queues, a duration is
+        found by bisection : the history is never rescanned.
+    """
+
+    def __init__(self, size=65536, block=256):
+        self.block = block
+        self.size = -(-size // block) * block
+        self.times = np.zeros(self.size, dtype=np.int64)
+        self.values = np.zeros(self.size)
+        self.means = np.zeros(self.size // block)
+        self.m2s = np.zeros(self.size // block)
+        self.reset()
+
+    def reset(self):
+        self.written = 0
+        self.minimum = SuffixMinimum()
+        self.maximum = SuffixMinimum()
+
+    def update(self, values, stamps):
+        size = len(values)
+        if not size:
+            return
+        if size > self.size:
+            values = values[-self.size:]
+            stamps = stamps[-self.size:]
+            self.written += size - self.size
+            size = self.size
+        index = (self.written + np.arange(size)) % self.size
+        self.values[index] = values
+        self.times[index] = stamps
+        oldest = self.written + size - self.size
+        self.minimum.update(values, self.written, oldest)
+        self.maximum.update(-values, self.written, oldest)
+        first = self.written // self.block
+        self.written += size
+        if self.written // self.block == first:
+            return
+        # the blocks completed
+        slots = np.arange(first, self.written // self.block) % self.means.size
+        blocks = self.values.reshape(-1, self.block)[slots]
+        self.means[slots] = blocks.mean(axis=1)
+        self.m2s[slots] = np.square(
+            blocks - self.means[slots, np.newaxis]).sum(axis=1)
+
+    def start(self, count=None, seconds=None):
+        """ number of samples in the window """
+        available = min(self.written, self.size)
+        if count is not None:
+            available = min(available, count)
+        if seconds is not None and available:
+            # times of the kept samples, oldest first
+            first = self.written - available
+            limit = self.times[(self.written - 1) % self.size] - seconds * 1e9
+            # bisection on the ring without copying it
+            low, high = 0, available
+            while low < high:
+                middle = (low + high) // 2
+                if self.times[(first + middle) % self.size] < limit:
+                    low = middle + 1
+                else:
+                    high = middle
+            available -= low
+        return available
+
+    def summary(self, count=None, seconds=None):
+        count = self.start(count, seconds)
+        if not count:
+            return summary(0, 0.0, 0.0, 0.0, 0.0)
+        first = self.written - count
+        # partial blocks at both ends, whole ones between
+        head = min(-(-first // self.block) * self.block, self.written)
+        tail = max(self.written // self.block * self.block, head)
+        parts = [self.values[np.arange(start, end) % self.size]
+                 for start, end in ((first, head), (tail, self.written))]
+        slots = np.arange(head // self.block,
+                          tail // self.block) % self.means.size
+        counts = np.concatenate(([part.size for part in parts],
+                                 np.full(slots.size, self.block)))
+        means = np.concatenate(([part.mean() if part.size else 0.0
+                                 for part in parts], self.means[slots]))
+        m2s = np.concatenate(([np.square(part - part.mean()).sum()
+                               if part.size else 0.0 for part in parts],
+                              self.m2s[slots]))
+        count, mean, m2 = merge(counts, means, m2s)
+        return summary(count, mean, m2, self.minimum.query(first),
+                       -self.maximum.query(first))
+
+
+class Statistics(ChannelSink):
+    """ Device sink keeping the statistics of each channel
+        usage : statistics = Statistics()
+                device.sinks.append(statistics)   # push() called per batch
+                statistics.summary(channel)
+                statistics.window(channel, seconds=10)
+        Unreadable samples are ignored. The results are those of the raw
+        samples (multiplier applied, not filtered).
+    """
+
+    def __init__(self, window_size=65536):
+        super().__init__()
+        self.window_size = window_size
+
+    def create(self, device):
+        return RunningStats(), WindowStats(self.window_size)
+
+    def update(self, channel, values, stamps):
+        running, window = self.channels[channel]
+        running.update(values)
+        window.update(values, stamps)
+
+    def clear(self, channel):
+        for stats in self.channels[channel]:
+            stats.reset()
+
+    def summary(self, channel):
+        """ statistics of all the samples since the start or reset """
+        with self.lock:
+            if channel not in self.channels:
+                return RunningStats().summary()
+            return self.channels[channel][0].summary()
+
+    def window(self, channel, count=None, seconds=None):
+        """ statistics of the last samples (count and / or seconds) """
+        with self.lock:
+            if channel not in self.channels:
+                return summary(0, 0.0, 0.0, 0.0, 0.0)
+            return self.channels[channel][1].summary(count, seconds)
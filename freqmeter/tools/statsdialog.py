@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/statsdialog.py
+ Version     : 1.0
+ Description : Dialog showing the statistics of the displayed channel.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import (QDialogButtonBox, QVBoxLayout,
+                             QHBoxLayout, QPushButton, QSpinBox, QDoubleSpinBox,
+                             QTableWidget, QTableWidgetItem, QAbstractItemView,
+                             QHeaderView)
+from PyQt5.QtGui import QIcon
+from tools.CustomWidgets import RefreshDialog
+
+ROWS = (('count', 'Count'), ('mean', 'Mean'), ('std', 'Std dev'),
+        ('min', 'Min'), ('max', 'Max'))
+
+
+class StatisticsDialog(RefreshDialog):
+    """ Statistics of a channel since the reset and over the last samples
+        usage : dialog = StatisticsDialog(statistics)   # tools/statistics.py
+                dialog.set_channel(device.channel)
+                dialog.show()
+        The table is refreshed every second while the dialog is shown.
+    """
+
+    def __init__(self, statistics, parent=None):
+        super(StatisticsDialog, self).__init__('Statistics')
+        self.statistics = statistics
+        self.setupUI()
+
+    def setupUI(self):
+        self.setWindowIcon(QIcon('resources/images/icon.png'))
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        self.table = QTableWidget(len(ROWS), 3)
+        self.table.setHorizontalHeaderLabels(
+            ['Since reset', 'Last samples', 'Last seconds'])
+        self.table.setVerticalHeaderLabels([label for _, label in ROWS])
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.Stretch)
+
+        # window lengths
+        self.countspin = QSpinBox()
+        self.countspin.setPrefix('Last ')
+        self.countspin.setSuffix(' samples')
+        self.countspin.setRange(1, self.statistics.window_size)
+        self.countspin.setValue(100)
+        self.countspin.valueChanged.connect(self.refresh)
+        self.secondspin = QDoubleSpinBox()
+        self.secondspin.setPrefix('Last ')
+        self.secondspin.setSuffix(' s')
+        self.secondspin.setRange(0.1, 3600.0)
+        self.secondspin.setValue(10.0)
+        self.secondspin.valueChanged.connect(self.refresh)
+        self.resetBtn = QPushButton('Reset')
+        self.resetBtn.clicked.connect(self.reset)
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Close)
+        self.buttonBox.rejected.connect(self.reject)
+
+        btnlayout = QHBoxLayout()
+        btnlayout.addWidget(self.countspin)
+        btnlayout.addWidget(self.secondspin)
+        btnlayout.addWidget(self.resetBtn)
+        btnlayout.addWidget(self.buttonBox)
+        layout.addWidget(self.table)
+        layout.addLayout(btnlayout)
+        self.resize(560, 240)
+
+    def reset(self):
+        self.statistics.reset(self.channel)
+        self.refresh()
+
+    def refresh(self):
+        columns = (self.statistics.summary(self.channel),
+                   self.statistics.window(self.channel,
+                                          count=self.countspin.value()),
+                   self.statistics.window(self.channel,
+                                          seconds=self.secondspin.value()))
+        for column, results in enumerate(columns):
+            for row, (key, _) in enumerate(ROWS):
+                value = results[key]
+                if key == 'count':
+                    text = f'{value:,}'
+                elif math.isnan(value):
+                    text = ''
+                else:
+                    text = f'{value:.6f}'
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
@@ -0,0 +1,545 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+ Project     : The poorman's frequency counter.
+ File        : tools/streamfilters.py
+ Version     : 1.0
+ Description : Built-in streaming filters, O(1) or O(log window) per sample.
+
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import heapq
+import math
+import numpy as np
+from tools.filterapi import StreamFilter
+
+# normal distribution : sigma = MAD_SCALE * median absolute deviation
+MAD_SCALE = 1.4826
+# sliding medians of batches are computed with numpy up to this window,
+# wider ones from a sorted band of the window around the median
+BATCH_WINDOW = 64
+# samples copied at once by the numpy sliding medians
+BATCH_SAMPLES = 2**20
+
+
+def ema(values, alpha, last):
+    """ exponential moving average of a batch :
+        y[i] = alpha * x[i] + (1 - alpha) * y[i - 1], with y[-1] = last
+        Computed by blocks with cumsum, the block is short enough for
+        (1 - alpha) ** -block to stay far from overflow.
+    """
+    decay = 1.0 - alpha
+    out = np.empty(len(values))
+    if decay <= 0.0:
+        out[:] = values
+        return out
+    block = int(min(4096, max(1, 100 / -math.log10(decay))))
+    powers = decay ** np.arange(block)
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        weights = powers[:len(chunk)]
+        out[start:start + block] = weights * (
+            decay * last + alpha * np.cumsum(chunk / weights))
+        last = out[start + len(chunk) - 1]
+    return out
+
+
+def remove_sorted(ordered, values):
+    """ ordered (a sorted array) without values, which it holds """
+    values = np.sort(values)
+    positions = np.searchsorted(ordered, values)
+    # equal values are removed from the following positions
+    positions += np.arange(len(values)) - np.searchsorted(values, values)
+    kept = np.ones(len(ordered), dtype=bool)
+    kept[positions] = False
+    return ordered[kept]
+
+
+def insert_sorted(ordered, values):
+    """ ordered (a sorted array) with values, still sorted """
+    values = np.sort(values)
+    positions = np.searchsorted(ordered, values) + np.arange(len(values))
+    out = np.empty(len(ordered) + len(values))
+    kept = np.ones(len(out), dtype=bool)
+    kept[positions] = False
+    out[positions] = values
+    out[kept] = ordered
+    return out
+
+
+class MovingAverage(StreamFilter):
+    """ Mean of the last 'window' samples (running sum)
+        usage : average = MovingAverage({'window': 100})
+                filtered = average.process(values)   # or step(value)
+    """
+    name = 'Moving average'
+    # parameter asked by the menu
+    parameter = 'window'
+    minimum = 1
+    maximum = 10 ** 6
+    defaults = {'window': 16}
+
+    def reset(self):
+        self.window = int(self.config['window'])
+        self.history = np.zeros(self.window)
+        self.position = 0
+        self.count = 0
+        self.total = 0.0
+
+    def step(self, value):
+        window = self.window
+        self.total += value - self.history[self.position]
+        self.history[self.position] = value
+        self.position = (self.position + 1) % window
+        self.count = min(self.count + 1, window)
+        if self.position == 0:
+            # no rounding drift : exact sum once per window
+            self.total = self.history.sum()
+        return self.total / self.count
+
+    def process(self, values):
+        size = len(values)
+        if not size:
+            return np.empty(0)
+        window = self.window
+        # samples leaving the window
+        if size >= window:
+            outgoing = np.concatenate((self.history[self.position:],
+                                       self.history[:self.position],
+                                       values[:size - window]))
+        else:
+            index = (self.position + np.arange(size)) % window
+            outgoing = self.history[index]
+        sums = self.total + np.cumsum(values - outgoing)
+        counts = np.minimum(self.count + np.arange(1, size + 1), window)
+        wrapped = self.position + size >= window
+        if size >= window:
+            self.history[:] = values[-window:]
+            self.position = 0
+        else:
+            self.history[index] = values
+            self.position = (self.position + size) % window
+        self.count = int(counts[-1])
+        if wrapped:
+            # no rounding drift : exact sum once per window
+            self.total = self.history.sum()
+        else:
+            self.total = sums[-1]
+        return sums / counts
+
+
+class ExponentialAverage(StreamFilter):
+    """ Exponential moving average, alpha = 2 / (span + 1)
+        usage : average = ExponentialAverage({'span': 100})
+                filtered = average.process(values)
+    """
+    name = 'Exponential moving average'
+    parameter = 'span'
+    minimum = 1
+    maximum = 10 ** 6
+    defaults = {'span': 16}
+
+    def reset(self):
+        self.alpha = 2.0 / (self.config['span'] + 1.0)
+        self.last = None
+
+    def step(self, value):
+        if self.last is None:
+            self.last = value
+        self.last += self.alpha * (value - self.last)
+        return self.last
+
+    def process(self, values):
+        if not len(values):
+            return np.empty(0)
+        if self.last is None:
+            self.last = values[0]
+        out = ema(values, self.alpha, self.last)
+        self.last = out[-1]
+        return out
+
+
+class SlidingMedian(StreamFilter):
+    """ Median of the last 'window' samples
+        usage : median = SlidingMedian({'window': 101})
+                filtered = median.process(values)
+        Two heaps (lower half max-heap, upper half min-heap) with lazy
+        deletion of the samples leaving the window : O(log window). Once
+        the window is full, batches use numpy medians of the sliding
+        windows (up to BATCH_WINDOW samples), the heaps are rebuilt from
+        the window when step() is called again.
+        For wider windows, the windows ending at a block of samples share
+        all but 2 * block of them : the median of each one is taken among
+        its own samples and the few shared ones which can be its median.
+        These are found in a sorted band of the window around its median,
+        updated once per block and taken again from the window (O(window))
+        when the median leaves it.
+    """
+    name = 'Sliding median'
+    parameter = 'window'
+    minimum = 1
+    maximum = 10 ** 6
+    defaults = {'window': 15}
+
+    def reset(self):
+        self.window = int(self.config['window'])
+        self.history = [0.0] * self.window
+        self.position = 0
+        self.count = 0
+        # lower half is stored negated
+        self.low = []
+        self.high = []
+        self.low_size = 0
+        self.high_size = 0
+        self.delayed = {}
+        # the heaps don't hold the window after a numpy batch, 'current'
+        # is then its median
+        self.stale = False
+        self.current = None
+        # sorted samples of the window from band_low to band_high and the
+        # count of those below (band None : not known)
+        self.band = None
+        self.band_low = self.band_high = 0.0
+        self.below = 0
+
+    def _rebuild(self):
+        """ heaps of the samples of the window """
+        ordered = sorted(self.history[:self.count])
+        half = (len(ordered) + 1) // 2
+        # sorted lists are heaps
+        self.low = [-value for value in reversed(ordered[:half])]
+        self.high = ordered[half:]
+        self.low_size = len(self.low)
+        self.high_size = len(self.high)
+        self.delayed = {}
+        self.stale = False
+
+    def _prune(self, heap, sign):
+        """ pop the deleted samples from the top of a heap """
+        delayed = self.delayed
+        while heap:
+            value = sign * heap[0]
+            pending = delayed.get(value)
+            if not pending:
+                break
+            if pending == 1:
+                del delayed[value]
+            else:
+                delayed[value] = pending - 1
+            heapq.heappop(heap)
+
+    def _balance(self):
+        if self.low_size > self.high_size + 1:
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+            self.low_size -= 1
+            self.high_size += 1
+            self._prune(self.low, -1)
+        elif self.low_size < self.high_size:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+            self.low_size += 1
+            self.high_size -= 1
+            self._prune(self.high, 1)
+
+    def _insert(self, value):
+        if not self.low or value <= -self.low[0]:
+            heapq.heappush(self.low, -value)
+            self.low_size += 1
+        else:
+            heapq.heappush(self.high, value)
+            self.high_size += 1
+        self._balance()
+
+    def _discard(self, value):
+        self.delayed[value] = self.delayed.get(value, 0) + 1
+        if value <= -self.low[0]:
+            self.low_size -= 1
+            if value == -self.low[0]:
+                self._prune(self.low, -1)
+        else:
+            self.high_size -= 1
+            if value == self.high[0]:
+                self._prune(self.high, 1)
+        self._balance()
+
+    def push(self, value):
+        """ add a sample, the oldest one leaves a full window """
+        if self.stale:
+            self._rebuild()
+        if self.count == self.window:
+            self._discard(self.history[self.position])
+        else:
+            self.count += 1
+        self.band = None
+        self.history[self.position] = value
+        self.position = (self.position + 1) % self.window
+        self._insert(value)
+
+    def value(self):
+        """ median of the window (it must not be empty) """
+        if self.stale:
+            # the heaps are rebuilt by the next push()
+            return self.current
+        if self.low_size > self.high_size:
+            return -self.low[0]
+        return (self.high[0] - self.low[0]) / 2.0
+
+    def step(self, value):
+        self.push(value)
+        return self.value()
+
+    def process(self, values):
+        window = self.window
+        size = len(values)
+        out = np.empty(size)
+        index = 0
+        # the window fills up
+        while index < size and self.count < window:
+            out[index] = self.step(values[index])
+            index += 1
+        if index == size:
+            return out
+        # the samples kept and the batch, one window ending at each sample
+        data = np.concatenate((self.history[self.position:],
+                               self.history[:self.position],
+                               values[index:]))
+        if window > BATCH_WINDOW:
+            self._sorted_medians(data, out[index:])
+        else:
+            chunk = max(BATCH_SAMPLES // window, 1)
+            for start in range(0, size - index, chunk):
+                windows = np.lib.stride_tricks.sliding_window_view(
+                    data[1 + start:start + chunk + window], window)
+                out[index + start:index + start + len(windows)] = np.median(
+                    windows, axis=1)
+        self.history = data[-window:]
+        self.position = 0
+        self.stale = True
+        self.current = out[-1]
+        return out
+
+    def _take_band(self, values, first, last):
+        """ sorted band of values (the window less the samples leaving it)
+            holding the ranks first to last and some margin
+        """
+        margin = max(8 * BATCH_WINDOW, len(values) // 64)
+        first = max(first - margin, 0)
+        last = min(last + margin, len(values) - 1)
+        ranked = np.partition(values, (first, last))
+        self.band_low, self.band_high = ranked[first], ranked[last]
+        self.below = int(np.count_nonzero(values < self.band_low))
+        self.band = np.sort(values[(values >= self.band_low)
+                                   & (values <= self.band_high)])
+
+    def _sorted_medians(self, data, out):
+        """ medians of the windows ending at each sample of data after the
+            first window (the current one)
+        """
+        window = self.window
+        # ranks of the median
+        low, high = (window - 1) // 2, window // 2
+        # the band update costs O(band) per block, the sort of the
+        # candidates O(block * block log(block))
+        block = min(max(int(math.sqrt(window) / 2), 48), 128, low)
+        count = 0
+        for start in range(0, len(out), block):
+            if count != min(block, len(out) - start):
+                count = min(block, len(out) - start)
+                # the window ending at the sample j of the block has the
+                # samples leaving after j and those entering up to j
+                others = np.arange(count)[:, None] + np.arange(1, count + 1)
+                others[others >= count] += window - count
+                # count samples of a window at most are below its median,
+                # the shared ones from rank low - count to high can be it
+                shared_count = high + 1 - low + count
+                candidates = np.empty((count, shared_count + count))
+            # the samples of all the windows of the block
+            if self.band is not None:
+                self._update_band(data[start:start + count], remove_sorted,
+                                  -1)
+            if (self.band is None or self.below > low - count
+                    or self.below + len(self.band) <= high):
+                self._take_band(data[start + count:start + window],
+                                low - count, high)
+            first = low - count - self.below
+            candidates[:, :shared_count] = self.band[first:
+                                                     first + shared_count]
+            candidates[:, shared_count:] = data[start + others]
+            candidates.sort(axis=1)
+            out[start:start + count] = (
+                candidates[:, count] + candidates[:, count + high - low]) / 2.0
+            self._update_band(data[window + start:window + start + count],
+                              insert_sorted, 1)
+
+    def _update_band(self, values, change, sign):
+        """ remove (sign -1) or insert (sign 1) samples """
+        inside = (values >= self.band_low) & (values <= self.band_high)
+        self.below += sign * int(np.count_nonzero(values < self.band_low))
+        self.band = change(self.band, values[inside])
+
+
+class Hampel(StreamFilter):
+    """ Outlier rejection : a sample further than threshold * sigma from the
+        median of the last 'window' samples is replaced by that median,
+        sigma = MAD_SCALE * median absolute deviation.
+        usage : hampel = Hampel({'window': 15, 'threshold': 3})
+                filtered = hampel.process(values)
+        The deviations are taken from the median when each sample arrived,
+        so that both medians stay O(log window). Nothing is rejected
+        before the window is full (the deviation is 0 at first).
+    """
+    name = 'Hampel outlier rejection'
+    parameter = 'window'
+    minimum = 3
+    maximum = 10 ** 6
+    defaults = {'window': 15, 'threshold': 3.0}
+
+    def reset(self):
+        self.threshold = self.config['threshold']
+        self.median = SlidingMedian(self.config)
+        self.deviation = SlidingMedian(self.config)
+
+    def step(self, value):
+        if self.median.count:
+            median = self.median.value()
+            limit = self.threshold * MAD_SCALE * self.deviation.value()
+        else:
+            median = value
+            limit = 0.0
+        full = self.median.count == self.median.window
+        self.median.push(value)
+        self.deviation.push(abs(value - median))
+        if full and abs(value - median) > limit:
+            return median
+        return value
+
+    def process(self, values):
+        size = len(values)
+        if not size:
+            return np.empty(0)
+        # medians and limits before each sample
+        filled = self.median.count
+        first = self.median.value() if filled else values[0]
+        medians = np.concatenate(([first],
+                                  self.median.process(values)[:-1]))
+        deviations = np.abs(values - medians)
+        first = self.deviation.value() if filled else 0.0
+        limits = self.threshold * MAD_SCALE * np.concatenate(
+            ([first], self.deviation.process(deviations)[:-1]))
+        full = filled + np.arange(size) >= self.median.window
+        return np.where(full & (deviations > limits), medians, values)
+
+
+class Kalman(StreamFilter):
+    """ Scalar Kalman filter of a constant frequency with a random walk
+        usage : kalman = Kalman({'ratio': 1e-3})
+                filtered = kalman.process(values)
+        ratio is the process noise / measurement noise variance ratio.
+        The gain doesn't depend on the data : once it has converged, the
+        batches are computed as an exponential average of that gain.
+    """
+    name = 'Kalman'
+    parameter = 'ratio'
+    minimum = 1e-12
+    maximum = 1e6
+    defaults = {'ratio': 1e-3}
+
+    def reset(self):
+        # variances, the measurement one is the unit (a null process noise
+        # would never let the gain settle)
+        self.noise = max(float(self.config['ratio']), self.minimum)
+        self.measurement = 1.0
+        self.estimate = None
+        self.variance = self.measurement
+        self.gain = 1.0
+        self.steady = False
+
+    def step(self, value):
+        if self.estimate is None:
+            self.estimate = value
+            return value
+        if not self.steady:
+            prior = self.variance + self.noise
+            gain = prior / (prior + self.measurement)
+            self.variance = (1.0 - gain) * prior
+            self.steady = abs(gain - self.gain) <= 1e-12 * gain
+            self.gain = gain
+        self.estimate += self.gain * (value - self.estimate)
+        return self.estimate
+
+    def process(self, values):
+        size = len(values)
+        out = np.empty(size)
+        index = 0
+        while index < size and not self.steady:
+            out[index] = self.step(values[index])
+            index += 1
+        if index < size:
+            out[index:] = ema(values[index:], self.gain, self.estimate)
+            self.estimate = out[-1]
+        return out
+
+
+class BoxCar(StreamFilter):
+    """ Decimating box-car : one mean for each block of 'factor' samples
+        usage : boxcar = BoxCar({'factor': 10})
+                means = boxcar.process(values)   # len(values) // factor means
+        step() returns None until a block is complete.
+    """
+    name = 'Decimating box-car'
+    parameter = 'factor'
+    minimum = 1
+    maximum = 10 ** 6
+    defaults = {'factor': 10}
+
+    def reset(self):
+        self.factor = int(self.config['factor'])
+        self.clear()
+
+    def clear(self):
+        # partial block
+        self.total = 0.0
+        self.count = 0
+
+    def step(self, value):
+        self.total += value
+        self.count += 1
+        if self.count < self.factor:
+            return None
+        mean = self.total / self.factor
+        self.clear()
+        return mean
+
+    def process(self, values):
+        factor = self.factor
+        missing = factor - self.count
+        if len(values) < missing:
+            self.total += values.sum()
+            self.count += len(values)
+            return np.empty(0)
+        first = (self.total + values[:missing].sum()) / factor
+        rest = values[missing:]
+        blocks = len(rest) // factor
+        means = rest[:blocks * factor].reshape(blocks, factor).mean(axis=1)
+        tail = rest[blocks * factor:]
+        self.total = tail.sum()
+        self.count = len(tail)
+        return np.concatenate(([first], means))
+
+
+# class name -> class, in menu order
+BUILTIN_FILTERS = {cls.__name__: cls for cls in (
+    MovingAverage, ExponentialAverage, SlidingMedian, Hampel, Kalman, BoxCar)}